@@ -0,0 +1,196 @@
+import heapq, itertools, os, threading, time
+from contextlib import contextmanager
+from typing import Optional
+from .cancellation import Cancelled, get_cancel_token
+
+# ----------------
+# LLM admission control
+# ----------------
+# Every LLM call (chat and title) goes through one process-wide limiter so a
+# burst of users cannot open hundreds of upstream requests at once. Waiters
+# queue by priority (interactive turns before title generation) in a bounded
+# queue with a deadline; past that we fail fast with a readable message instead
+# of piling up provider 429 retries. On top, each user has a token bucket.
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+MAX_CONCURRENCY = int(os.getenv('CHATBOT_LLM_MAX_CONCURRENCY', '16'))
+MAX_QUEUE = int(os.getenv('CHATBOT_LLM_MAX_QUEUE', '64'))
+QUEUE_TIMEOUT = float(os.getenv('CHATBOT_LLM_QUEUE_TIMEOUT', '20'))
+USER_RATE_PER_MINUTE = float(os.getenv('CHATBOT_USER_LLM_CALLS_PER_MINUTE', '30'))
+USER_BURST = float(os.getenv('CHATBOT_USER_LLM_BURST', '10'))
+
+
+class AdmissionError(RuntimeError):
+    """Base class for requests turned away before reaching the LLM provider."""
+
+
+class LLMBusy(AdmissionError):
+    def __init__(self, message: str = 'The assistant is handling too many requests right now. Please try again in a moment.'):
+        super().__init__(message)
+
+
+class RateLimited(AdmissionError):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"You're sending messages too quickly. Please try again in {max(1, round(retry_after))}s.")
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting: list[tuple[int, int]] = []  # heap of (priority, ticket)
+        self._tickets = itertools.count()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @contextmanager
+    def slot(self, priority: int = INTERACTIVE, cancel_token=None, timeout: Optional[float] = None):
+        self._acquire(priority, cancel_token, self.queue_timeout if timeout is None else timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now, without queueing; release() it afterwards."""
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiting:
+                self._active += 1
+                self.admitted += 1
+                return True
+            return False
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def _acquire(self, priority: int, cancel_token, timeout: float):
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiting:
+                self._active += 1
+                self.admitted += 1
+                return
+            if len(self._waiting) >= self.max_queue:
+                self.rejected += 1
+                raise LLMBusy()
+
+            entry = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, entry)
+            unregister = cancel_token.on_cancel(self._wake) if cancel_token else (lambda: None)
+            deadline = time.monotonic() + timeout
+            try:
+                while True:
+                    if self._waiting[0] == entry and self._active < self.max_concurrency:
+                        heapq.heappop(self._waiting)
+                        self._active += 1
+                        self.admitted += 1
+                        # the next waiter may fit as well
+                        self._cond.notify_all()
+                        return
+                    if cancel_token and cancel_token.cancelled:
+                        raise Cancelled()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise LLMBusy()
+                    self._cond.wait(remaining)
+            except BaseException:
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+            finally:
+                unregister()
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'active': self._active,
+                'waiting': len(self._waiting),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+
+
+# ---------- Per-user rate limiting ----------
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, burst: float):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, max_wait: float) -> float:
+        """Take one token, possibly borrowing against the future; returns seconds to wait. Raises if too far out."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        if wait > max_wait:
+            raise RateLimited(wait)
+        self.tokens -= 1
+        return wait
+
+
+class UserRateLimiter:
+    def __init__(self, rate_per_minute: float, burst: float, max_users: int = 10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets: dict[int, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, user_id: int, max_wait: float, cancel_token=None):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                if len(self._buckets) >= self.max_users:
+                    self._evict_idle()
+                bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+            wait = bucket.reserve(max_wait)
+        if wait > 0:
+            if cancel_token:
+                if cancel_token.wait(wait):
+                    raise Cancelled()
+            else:
+                time.sleep(wait)
+
+    def _evict_idle(self):
+        # buckets that refilled completely carry no state worth keeping
+        now = time.monotonic()
+        for user_id, bucket in list(self._buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst:
+                del self._buckets[user_id]
+
+
+llm_admission = AdmissionController(MAX_CONCURRENCY, MAX_QUEUE, QUEUE_TIMEOUT)
+user_rate_limiter = UserRateLimiter(USER_RATE_PER_MINUTE, USER_BURST)
+
+
+@contextmanager
+def admit(config: dict, priority: int = INTERACTIVE):
+    """Wait for this user's rate limit and a global LLM slot, honouring the turn's cancel token."""
+    cancel_token = get_cancel_token(config)
+    user_id = (config.get('configurable') or {}).get('user_id')
+    deadline = time.monotonic() + QUEUE_TIMEOUT
+    if user_id is not None and priority == INTERACTIVE:
+        user_rate_limiter.acquire(user_id, max_wait=QUEUE_TIMEOUT, cancel_token=cancel_token)
+    with llm_admission.slot(priority, cancel_token, timeout=max(0.0, deadline - time.monotonic())):
+        yield
@@ -0,0 +1,188 @@
+import os, sqlite3, threading, time
+from typing import Optional
+import ormsgpack
+from langgraph.checkpoint.sqlite import SqliteSaver
+from .db import (
+    DB_PATH,
+    shards,
+    shard_for_user,
+    touch_thread,
+    get_thread_owner,
+    get_cold_threads,
+    export_thread_rows,
+    export_checkpoint_blobs,
+    archive_thread_rows,
+    restore_thread_rows,
+    is_thread_archived,
+    get_db_size,
+    vacuum_db,
+)
+from .checkpoint_serde import COMPRESSION, compress, decompress, thread_blob_refs, index_thread_blob_refs, collect_blobs
+
+# ----------------
+# Thread archive
+# ----------------
+# Threads idle for longer than ARCHIVE_AFTER_DAYS have their checkpoint rows
+# moved into a compressed per-user archive (`<ARCHIVE_DIR>/user_<id>.db`, one
+# zstd/zlib-compressed msgpack record per thread), together with copies of the
+# checkpoint blobs they reference; hot blobs nothing else uses are then
+# dropped. The chat_rooms row stays in the hot database as the stub (title,
+# owner, timestamps, `archived_at`). `ensure_thread_hot` runs before every turn
+# and history load and brings an archived thread back first.
+
+ARCHIVE_DIR = os.getenv('CHATBOT_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'archive'))
+ARCHIVE_AFTER_DAYS = float(os.getenv('CHATBOT_ARCHIVE_AFTER_DAYS', '7'))
+
+_setup_lock = threading.Lock()
+_setup_done = False
+
+
+def _ensure_checkpoint_tables():
+    global _setup_done
+    with _setup_lock:
+        if not _setup_done:
+            for shard in shards:
+                SqliteSaver(conn=shard.conn).setup()
+            _setup_done = True
+
+
+def archive_path(user_id: int) -> str:
+    return os.path.join(ARCHIVE_DIR, f'user_{user_id}.db')
+
+
+def _open_archive(user_id: int) -> sqlite3.Connection:
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    archive = sqlite3.connect(archive_path(user_id), timeout=30)
+    archive.execute("""
+    CREATE TABLE IF NOT EXISTS archived_threads (
+        thread_id TEXT PRIMARY KEY,
+        codec TEXT NOT NULL,
+        data BLOB NOT NULL,
+        archived_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    """)
+    return archive
+
+
+# ---------- Archive / rehydrate ----------
+
+def archive_thread(thread_id: str, user_id: int, last_active_at: Optional[float], refs: Optional[set] = None) -> bool:
+    """Move one thread into its owner's archive; False if it became active meanwhile.
+
+    The digests of the blobs it references are added to `refs`, for collect_blobs.
+    """
+    _ensure_checkpoint_tables()
+    if is_thread_archived(thread_id, user_id):
+        return False
+    shard = shard_for_user(user_id)
+    digests = thread_blob_refs(shard, thread_id)
+    # checkpoints, writes and blob refs
+    exported = export_thread_rows(thread_id, user_id)
+    if not exported['checkpoints']['rows']:
+        return False
+    if digests:
+        exported['checkpoint_blobs'] = export_checkpoint_blobs(shard, list(digests))
+    codec = COMPRESSION if COMPRESSION not in ('', 'none') else 'raw'
+    payload = ormsgpack.packb(exported)
+    if codec != 'raw':
+        payload = compress(payload, codec)
+
+    # the archive copy is committed before the hot rows go away
+    archive = _open_archive(user_id)
+    try:
+        with archive:
+            archive.execute(
+                "INSERT OR REPLACE INTO archived_threads (thread_id, codec, data, archived_at) VALUES (?, ?, ?, ?)",
+                (thread_id, codec, payload, time.time())
+            )
+        if archive_thread_rows(thread_id, user_id, last_active_at):
+            if refs is not None:
+                refs |= digests
+            return True
+        # touched meanwhile: drop our copy (unless another archiver won the race)
+        if not is_thread_archived(thread_id, user_id):
+            with archive:
+                archive.execute("DELETE FROM archived_threads WHERE thread_id=?", (thread_id,))
+        return False
+    finally:
+        archive.close()
+
+
+def _read_archived(archive: sqlite3.Connection, thread_id: str) -> Optional[dict]:
+    row = archive.execute(
+        "SELECT codec, data FROM archived_threads WHERE thread_id=?", (thread_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    codec, payload = row
+    return ormsgpack.unpackb(payload if codec == 'raw' else decompress(payload, codec))
+
+
+def read_archived_thread(thread_id: str, user_id: int) -> Optional[dict]:
+    """The archived rows of a thread (as export_thread_rows returns them, plus `checkpoint_blobs`), leaving it archived."""
+    if not os.path.exists(archive_path(user_id)):
+        return None
+    archive = _open_archive(user_id)
+    try:
+        return _read_archived(archive, thread_id)
+    finally:
+        archive.close()
+
+
+def rehydrate_thread(thread_id: str, user_id: int):
+    _ensure_checkpoint_tables()
+    archive = _open_archive(user_id)
+    try:
+        exported = _read_archived(archive, thread_id)
+        if exported is None:
+            if not is_thread_archived(thread_id, user_id):
+                return  # rehydrated concurrently
+            raise ValueError(f'Archived thread {thread_id} is missing from {archive_path(user_id)}')
+
+        if restore_thread_rows(thread_id, user_id, exported):
+            if 'checkpoint_blob_refs' not in exported:
+                # archived before refs were kept
+                index_thread_blob_refs(shard_for_user(user_id), thread_id)
+            with archive:
+                archive.execute("DELETE FROM archived_threads WHERE thread_id=?", (thread_id,))
+    finally:
+        archive.close()
+
+
+def check_thread_owner(thread_id: str, user_id: int):
+    """PermissionError unless the thread is the user's or does not exist yet."""
+    owner = get_thread_owner(thread_id, user_id)
+    if owner is not None and owner != user_id:
+        raise PermissionError('Thread belongs to another user')
+
+
+def ensure_thread_hot(thread_id: str, user_id: int):
+    """Record activity on the user's thread and rehydrate it if it was archived; PermissionError if it is someone else's."""
+    room = touch_thread(thread_id, user_id)
+    if room is None:
+        check_thread_owner(thread_id, user_id)
+    elif room['archived_at'] is not None:
+        rehydrate_thread(thread_id, user_id)
+
+
+def archive_cold_threads(inactive_days: float = ARCHIVE_AFTER_DAYS, limit: int = 1000, vacuum: bool = False, all_blobs: bool = False) -> dict:
+    """Archive up to `limit` threads idle for `inactive_days`, then drop the blobs only they used.
+
+    With `all_blobs`, every unreferenced blob older than the grace period goes (e.g.
+    left behind by deleted threads or scripts/reshard.py). Reports hot-DB size
+    before and after.
+    """
+    _ensure_checkpoint_tables()
+    before = get_db_size()
+    archived = skipped = blobs = 0
+    for shard in shards:
+        refs: set = set()
+        for room in get_cold_threads(shard, time.time() - inactive_days * 86400, limit - archived - skipped):
+            if archive_thread(room['thread_id'], room['user_id'], room['last_active_at'], refs):
+                archived += 1
+            else:
+                skipped += 1
+        blobs += collect_blobs(shard, None if all_blobs else refs)
+    if vacuum:
+        vacuum_db()
+    return {'archived': archived, 'skipped': skipped, 'blobs': blobs, 'before': before, 'after': get_db_size()}
@@ -1,16 +1,141 @@
-import sqlite3, hashlib, secrets, datetime
-from .db import conn
-
+import sqlite3, hashlib, hmac, secrets, datetime, base64, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from cachetools import TTLCache
+from .db import conn, conn_lock, get_user_details, get_storage_meta
 
 # ----------------
-# Helpers
+# Password hashing
 # ----------------
+# scrypt (memory-hard) with a random salt per password, stored as
+# `scrypt$<n>$<r>$<p>$<salt hex>$<hash hex>`. Derivations run on a small pool of
+# their own, so a burst of sign-ins occupies at most KDF_WORKERS cores; callers
+# beyond KDF_BACKLOG waiting ones are turned away instead of piling up. Older
+# hashes (plain sha256, or other scrypt parameters) are replaced on the next
+# successful sign-in.
+SCRYPT_N = int(os.getenv('CHATBOT_SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.getenv('CHATBOT_SCRYPT_R', '8'))
+SCRYPT_P = int(os.getenv('CHATBOT_SCRYPT_P', '1'))
+KDF_WORKERS = int(os.getenv('CHATBOT_KDF_WORKERS', '2'))
+KDF_BACKLOG = int(os.getenv('CHATBOT_KDF_BACKLOG', '32'))
+KDF_WAIT = float(os.getenv('CHATBOT_KDF_WAIT', '10'))
+
+kdf_executor = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix='kdf')
+_kdf_slots = threading.BoundedSemaphore(KDF_WORKERS + KDF_BACKLOG)
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    if not _kdf_slots.acquire(timeout=KDF_WAIT):
+        raise ValueError('Too many sign-in attempts right now, please try again')
+    try:
+        # hashlib.scrypt releases the GIL, the pool size is what bounds the CPU
+        return kdf_executor.submit(
+            hashlib.scrypt, password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * (n + p + 2), dklen=32
+        ).result()
+    finally:
+        _kdf_slots.release()
+
+
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    salt = secrets.token_bytes(16)
+    derived = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${derived.hex()}"
 
 
 def verify_password(password: str, password_hash: str) -> bool:
-    return hash_password(password) == password_hash
+    if not password_hash.startswith('scrypt$'):
+        # legacy unsalted sha256
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), password_hash)
+    _, n, r, p, salt, derived = password_hash.split('$')
+    return hmac.compare_digest(_scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p)).hex(), derived)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    return not password_hash.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+# ----------------
+# Sessions
+# ----------------
+# A session token is `<base64url JSON {uid, exp, pv}>.<HMAC-SHA256>`. `pv` is the
+# user's `password_version`, which only a password reset bumps: changing the
+# password ends older sessions, re-hashing the same one at sign-in does not.
+# The key is CHATBOT_SESSION_SECRET, or one generated on first use and kept in
+# storage_meta so every worker accepts every token. Validated tokens are cached
+# with the user's details: page loads and reruns do not touch `users` (a password
+# change reaches other workers' caches within SESSION_CACHE_TTL).
+SESSION_TTL = float(os.getenv('CHATBOT_SESSION_TTL_HOURS', '168')) * 3600
+SESSION_CACHE_SIZE = int(os.getenv('CHATBOT_SESSION_CACHE_SIZE', '10000'))
+SESSION_CACHE_TTL = float(os.getenv('CHATBOT_SESSION_CACHE_TTL', '300'))
+
+_sessions: TTLCache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+_sessions_lock = threading.Lock()
+_session_key: Optional[bytes] = None
+
+
+def _key() -> bytes:
+    global _session_key
+    if _session_key is None:
+        secret = os.getenv('CHATBOT_SESSION_SECRET') or get_storage_meta('session_secret', secrets.token_hex(32))
+        _session_key = secret.encode()
+    return _session_key
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _sign(payload: str) -> str:
+    return _b64(hmac.new(_key(), payload.encode(), hashlib.sha256).digest())
+
+
+def _load_session_user(user_id: int) -> Optional[tuple[int, dict]]:
+    with conn_lock:
+        row = conn.execute("SELECT password_version, is_active FROM users WHERE id = ?", (user_id,)).fetchone()
+    if not row or not row[1]:
+        return None
+    return row[0], get_user_details(user_id)
+
+
+def create_session(user_id: int) -> dict:
+    """A signed session token for `user_id`, plus the user's details (cached with it)."""
+    loaded = _load_session_user(user_id)
+    if loaded is None:
+        raise ValueError("Account doesn't exists")
+    password_version, details = loaded
+    expires_at = int(time.time() + SESSION_TTL)
+    payload = _b64(json.dumps({'uid': user_id, 'exp': expires_at, 'pv': password_version}).encode())
+    session = {'user_id': user_id, 'token': f"{payload}.{_sign(payload)}", 'expires_at': expires_at, 'user_details': details}
+    with _sessions_lock:
+        _sessions[session['token']] = session
+    return session
+
+
+def validate_session(token: str) -> dict:
+    """The session of a token from create_session; raises ValueError once it is expired or revoked."""
+    with _sessions_lock:
+        session = _sessions.get(token)
+    if session is None:
+        payload, _, signature = (token or '').partition('.')
+        if not signature or not hmac.compare_digest(_sign(payload), signature):
+            raise ValueError('Invalid session, please sign in again')
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        loaded = _load_session_user(claims['uid'])
+        if loaded is None or claims.get('pv') != loaded[0]:
+            raise ValueError('Invalid session, please sign in again')
+        session = {'user_id': claims['uid'], 'token': token, 'expires_at': claims['exp'], 'user_details': loaded[1]}
+        with _sessions_lock:
+            _sessions[token] = session
+    if session['expires_at'] < time.time():
+        raise ValueError('Session expired, please sign in again')
+    return session
+
+
+def _forget_sessions(user_id: int):
+    with _sessions_lock:
+        for token, session in list(_sessions.items()):
+            if session['user_id'] == user_id:
+                _sessions.pop(token, None)
 
 
 # ----------------
@@ -20,21 +145,22 @@ def sign_up(email: str, password: str, first_name: str, last_name: str | None) -
     password_hash = hash_password(password)
 
     try:
-        cur = conn.cursor()
-        cur.execute(
-        "SELECT id, password_hash FROM users WHERE email = ?",
-            (email,),
-        )
-        row = cur.fetchone()
-
-        if row:
-            raise ValueError("Account already exists")
-        cur.execute(
-            "INSERT INTO users (first_name, last_name, email, password_hash) VALUES (?, ?, ?, ?)",
-            (first_name, last_name, email, password_hash),
-        )
-        conn.commit()
-        return cur.lastrowid
+        with conn_lock:
+            cur = conn.cursor()
+            cur.execute(
+            "SELECT id, password_hash FROM users WHERE email = ?",
+                (email,),
+            )
+            row = cur.fetchone()
+
+            if row:
+                raise ValueError("Account already exists")
+            cur.execute(
+                "INSERT INTO users (first_name, last_name, email, password_hash) VALUES (?, ?, ?, ?)",
+                (first_name, last_name, email, password_hash),
+            )
+            conn.commit()
+            return cur.lastrowid
     except sqlite3.IntegrityError:
         raise ValueError("Email already registered")
 
@@ -43,12 +169,13 @@ def sign_up(email: str, password: str, first_name: str, last_name: str | None) -
 # Auth: Sign In
 # ----------------
 def sign_in(email: str, password: str) -> int:
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, password_hash FROM users WHERE email = ?",
-        (email,),
-    )
-    row = cur.fetchone()
+    with conn_lock:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, password_hash FROM users WHERE email = ?",
+            (email,),
+        )
+        row = cur.fetchone()
 
     if not row:
         raise ValueError("Account doesn't exists")
@@ -58,6 +185,13 @@ def sign_in(email: str, password: str) -> int:
     if not verify_password(password, password_hash):
         raise ValueError("Invalid email or password")
 
+    if needs_rehash(password_hash):
+        new_hash = hash_password(password)
+        with conn_lock:
+            # unless the password changed in the meantime
+            conn.execute("UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?", (new_hash, user_id, password_hash))
+            conn.commit()
+
     return user_id
 
 
@@ -65,6 +199,11 @@ def sign_in(email: str, password: str) -> int:
 # Password Reset
 # ----------------
 def create_reset_token(email: str) -> str:
+    with conn_lock:
+        return _create_reset_token(email)
+
+
+def _create_reset_token(email: str) -> str:
     now = datetime.datetime.now(datetime.timezone.utc)
 
     cur = conn.cursor()
@@ -77,23 +216,25 @@ def create_reset_token(email: str) -> str:
         (email,),
     )
     row = cur.fetchone()
-    if not row:
-        raise ValueError("Account doesn't exists")
-    token, expires_at = row
-    expires_at = datetime.datetime.fromisoformat(expires_at)
+    if row:
+        token, expires_at = row
+        expires_at = datetime.datetime.fromisoformat(expires_at)
 
-    # Make stored value UTC-aware if needed
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+        # Make stored value UTC-aware if needed
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
 
-    if now <= expires_at:
-        return token
+        if now <= expires_at:
+            return token
 
-    conn.execute(
-        "DELETE FROM password_resets WHERE email = ?",
-        (email,),
-    )
-    conn.commit()
+        conn.execute(
+            "DELETE FROM password_resets WHERE email = ?",
+            (email,),
+        )
+        conn.commit()
+    elif not conn.execute("SELECT 1 FROM users WHERE email = ?", (email,)).fetchone():
+        # first reset of this account
+        raise ValueError("Account doesn't exists")
 
     token = secrets.token_urlsafe(32)
     expires_at = now + datetime.timedelta(minutes=30)
@@ -112,15 +253,16 @@ def create_reset_token(email: str) -> str:
 
 
 def reset_password(token: str, new_password: str):
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT email, expires_at FROM password_resets
-        WHERE token = ?
-        """,
-        (token,),
-    )
-    row = cur.fetchone()
+    with conn_lock:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT email, expires_at FROM password_resets
+            WHERE token = ?
+            """,
+            (token,),
+        )
+        row = cur.fetchone()
 
     if not row:
         raise ValueError("Invalid or expired reset token")
@@ -133,29 +275,36 @@ def reset_password(token: str, new_password: str):
 
     if datetime.datetime.now(datetime.timezone.utc) > expires:
          # 🔥 flush expired token
+        with conn_lock:
+            conn.execute(
+                "DELETE FROM password_resets WHERE token = ?",
+                (token,),
+            )
+            conn.commit()
+        raise ValueError("Reset token expired")
+
+    new_hash = hash_password(new_password)
+
+    with conn_lock:
+        conn.execute(
+            "UPDATE users SET password_hash = ?, password_version = password_version + 1 WHERE email = ?",
+            (new_hash, email),
+        )
         conn.execute(
             "DELETE FROM password_resets WHERE token = ?",
             (token,),
         )
         conn.commit()
-        raise ValueError("Reset token expired")
-
-    new_hash = hash_password(new_password)
-
-    conn.execute(
-        "UPDATE users SET password_hash = ? WHERE email = ?",
-        (new_hash, email),
-    )
-    conn.execute(
-        "DELETE FROM password_resets WHERE token = ?",
-        (token,),
-    )
-    conn.commit()
+        row = conn.execute("SELECT id FROM users WHERE email = ?", (email,)).fetchone()
+    if row:
+        # older sessions no longer validate; drop this worker's cached ones right away
+        _forget_sessions(row[0])
 
 
 def flush_expired_tokens():
-    conn.execute(
-        "DELETE FROM password_resets WHERE expires_at < ?",
-        (datetime.datetime.now(datetime.timezone.utc).isoformat(),),
-    )
-    conn.commit()
+    with conn_lock:
+        conn.execute(
+            "DELETE FROM password_resets WHERE expires_at < ?",
+            (datetime.datetime.now(datetime.timezone.utc).isoformat(),),
+        )
+        conn.commit()
@@ -0,0 +1,210 @@
+import contextvars, os, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables.config import ensure_config, merge_configs
+from .profiling import run_attached
+
+T = TypeVar('T')
+
+# ----------------
+# Cancellation
+# ----------------
+# A CancellationToken travels in `config['configurable']['cancel_token']` so every
+# node and tool of a turn can see it. Blocking work (LLM calls, tools) runs via
+# `run_cancellable`, which returns control the moment the token fires; the
+# abandoned call is then cut short at its next checkpoint (next streamed token,
+# next HTTP chunk, next search result). The calls run on one shared pool of
+# WORKERS threads: abandoned calls keep a worker until they reach that
+# checkpoint, and `/stats` reports how many do.
+
+
+class Cancelled(Exception):
+    """Raised inside a turn once its cancellation token has fired."""
+
+    def __init__(self, message: str = 'Generation stopped'):
+        super().__init__(message)
+
+
+class CancellationToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: list[Callable[[], Any]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise Cancelled()
+
+    def on_cancel(self, callback: Callable[[], Any]) -> Callable[[], None]:
+        """Register `callback` (runs immediately if already cancelled); returns an unregister function."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+
+                def unregister():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+                return unregister
+        callback()
+        return lambda: None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Interruptible sleep; returns True if cancelled meanwhile."""
+        return self._event.wait(timeout)
+
+
+# ---------- Helpers ----------
+
+def get_cancel_token(config: Optional[dict] = None) -> Optional[CancellationToken]:
+    """Token of the current turn; without `config`, falls back to the active runnable config (inside tools)."""
+    config = config if config is not None else ensure_config()
+    return (config.get('configurable') or {}).get('cancel_token')
+
+
+def raise_if_cancelled(config: Optional[dict] = None):
+    token = get_cancel_token(config)
+    if token:
+        token.raise_if_cancelled()
+
+
+# ---------- Helper pool ----------
+
+WORKERS = int(os.getenv('CHATBOT_CANCELLABLE_WORKERS', '64'))
+
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='cancellable')
+_worker = threading.local()
+
+
+class CancellableStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.abandoned = 0  # cancelled, but their work still holds a worker
+        self.abandoned_total = 0
+
+    def submitted(self):
+        with self._lock:
+            self.queued += 1
+
+    def started(self):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+
+    def dropped(self):
+        with self._lock:
+            self.queued -= 1
+
+    def finished(self, call: dict):
+        with self._lock:
+            self.running -= 1
+            call['finished'] = True
+            if call.get('abandoned'):
+                self.abandoned -= 1
+
+    def abandon(self, call: dict):
+        with self._lock:
+            if not call.get('finished'):
+                call['abandoned'] = True
+                self.abandoned += 1
+                self.abandoned_total += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': WORKERS,
+                'queued': self.queued,
+                'running': self.running,
+                'abandoned': self.abandoned,
+                'abandoned_total': self.abandoned_total,
+            }
+
+
+cancellable_stats = CancellableStats()
+
+
+def run_cancellable(fn: Callable[[], T], token: Optional[CancellationToken]) -> T:
+    """Run `fn` on the helper pool and stop waiting for it as soon as `token` fires."""
+    if token is None:
+        return fn()
+    token.raise_if_cancelled()
+    if getattr(_worker, 'active', False):
+        # already on a helper thread, whose caller is the one waiting: queueing
+        # behind it on a saturated pool would never return
+        return fn()
+
+    ctx = contextvars.copy_context()
+    done = threading.Event()
+    call: dict = {}
+
+    def target():
+        cancellable_stats.started()
+        _worker.active = True
+        try:
+            # sampled with the turn when it is profiled (see backend/profiling.py)
+            return ctx.run(run_attached, fn)
+        finally:
+            _worker.active = False
+            cancellable_stats.finished(call)
+
+    cancellable_stats.submitted()
+    future = executor.submit(target)
+    future.add_done_callback(lambda _: done.set())
+    unregister = token.on_cancel(done.set)
+    try:
+        done.wait()
+    finally:
+        unregister()
+
+    if future.done():
+        return future.result()
+    if future.cancel():
+        # still queued: it never starts
+        cancellable_stats.dropped()
+    else:
+        cancellable_stats.abandon(call)
+    raise Cancelled()
+
+
+class _AbortStreamHandler(BaseCallbackHandler):
+    """Aborts a streaming LLM call at the next token once the turn is cancelled."""
+    raise_error = True
+
+    def __init__(self, token: CancellationToken):
+        self.token = token
+
+    def on_llm_new_token(self, token: str, **kwargs: Any):
+        self.token.raise_if_cancelled()
+
+
+def invoke_cancellable(runnable, input, config: Optional[dict] = None):
+    token = get_cancel_token(config)
+    if token is None:
+        return runnable.invoke(input, config)
+    config = merge_configs(config, {'callbacks': [_AbortStreamHandler(token)]})
+    return run_cancellable(lambda: runnable.invoke(input, config), token)
+
+
+def cancellable_tool_call(request, execute):
+    """ToolNode `wrap_tool_call` hook: makes every tool call abortable."""
+    token = get_cancel_token(request.runtime.config)
+    return run_cancellable(lambda: execute(request), token)
@@ -0,0 +1,287 @@
+import hashlib, os, threading, time, zlib
+from contextlib import contextmanager
+from typing import Any, Optional
+from cachetools import LRUCache, TTLCache
+from langchain_core.messages import ToolMessage
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from .db import (
+    Shard,
+    shards,
+    put_checkpoint_blob,
+    get_checkpoint_blobs,
+    iter_checkpoint_payloads,
+    get_thread_blob_refs,
+    add_blob_refs,
+    delete_thread_blob_refs,
+    delete_unreferenced_blobs,
+    get_shard_meta,
+    set_shard_meta,
+)
+from .profiling import attach
+
+try:
+    import zstandard
+except ImportError:  # zlib is always available
+    zstandard = None
+
+# ----------------
+# Checkpoint serializer
+# ----------------
+# Every checkpoint holds the whole ChatState.messages list, so a large tool
+# output used to be re-written with each later turn of its thread. This
+# serializer keeps langgraph's msgpack encoding but
+#   * moves checkpointed ToolMessage contents (and raw-payload artifacts, see
+#     backend/tool_budget.py) above BLOB_MIN_BYTES into `checkpoint_blobs`,
+#     stored once per sha256 and referenced from the message (and, for
+#     collection, from `checkpoint_blob_refs` by the thread being saved),
+#   * compresses payloads above COMPRESS_MIN_BYTES (zstd, else zlib) and tags
+#     the type as e.g. 'msgpack+zstd'.
+# Untagged types are handed to JsonPlusSerializer, so checkpoints written before
+# keep loading; scripts/migrate_checkpoints.py rewrites them in place.
+# Blobs live in the same shard as the checkpoints referencing them, so every
+# shard's saver gets its own serializer (see backend/sharding.py).
+
+COMPRESSION = os.getenv('CHATBOT_CHECKPOINT_COMPRESSION', 'zstd' if zstandard else 'zlib')
+COMPRESS_MIN_BYTES = int(os.getenv('CHATBOT_CHECKPOINT_COMPRESS_MIN_BYTES', '1024'))
+BLOB_MIN_BYTES = int(os.getenv('CHATBOT_CHECKPOINT_BLOB_MIN_BYTES', '4096'))
+BLOB_KEY = 'checkpoint_blob'
+# a blob unreferenced for this long is dropped (see collect_blobs); it must
+# outlast STORED_TTL plus the longest turn
+BLOB_GRACE_SECONDS = float(os.getenv('CHATBOT_CHECKPOINT_BLOB_GRACE_HOURS', '24')) * 3600
+STORED_TTL = 600
+MAX_DEPTH = 4
+
+_local = threading.local()
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        if not hasattr(_local, 'zstd'):
+            _local.zstd = zstandard.ZstdCompressor(level=3)
+        return _local.zstd.compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data, 6)
+    raise ValueError(f'Unknown checkpoint codec {codec}')
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstandard is required to read zstd-compressed checkpoints')
+        if not hasattr(_local, 'unzstd'):
+            _local.unzstd = zstandard.ZstdDecompressor()
+        return _local.unzstd.decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError(f'Unknown checkpoint codec {codec}')
+
+
+def _artifact_ref(message: ToolMessage) -> str | None:
+    artifact = message.artifact
+    return artifact.get(BLOB_KEY) if isinstance(artifact, dict) and len(artifact) == 1 else None
+
+
+class CompactSerializer(SerializerProtocol):
+    def __init__(self, shard: Optional[Shard] = None, compression: str = COMPRESSION, compress_min_bytes: int = COMPRESS_MIN_BYTES, blob_min_bytes: int = BLOB_MIN_BYTES):
+        self.base = JsonPlusSerializer()
+        self.shard = shard or shards[0]
+        self.compression = None if compression in ('', 'none') else compression
+        self.compress_min_bytes = compress_min_bytes
+        self.blob_min_bytes = blob_min_bytes
+        # (thread_id, digest) this process stored lately / blobs recently loaded, by
+        # digest; only stores vouch for a blob, since a loaded one may be collected meanwhile
+        self._stored = TTLCache(maxsize=4096, ttl=STORED_TTL)
+        self._loaded = LRUCache(maxsize=256)
+        self._lock = threading.Lock()
+        self._context = threading.local()
+
+    @contextmanager
+    def thread(self, thread_id: str):
+        """Checkpoints serialized inside are the thread's: the blobs they store are recorded as its refs."""
+        previous = getattr(self._context, 'thread_id', None)
+        self._context.thread_id = thread_id
+        try:
+            yield
+        finally:
+            self._context.thread_id = previous
+
+    def forget_thread(self, thread_id: str):
+        """Drop the thread's dedup entries, e.g. once it was deleted, so its refs are written again."""
+        with self._lock:
+            for key in [key for key in self._stored if key[0] == thread_id]:
+                self._stored.pop(key, None)
+
+    # ---------- SerializerProtocol ----------
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        # checkpoints of a profiled turn may be written from langgraph's background threads
+        with attach():
+            return self._dumps_typed(obj)
+
+    def _dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        # only checkpoints repeat old messages; pending writes are stored once anyway
+        # (and are serialized inside the saver's transaction, where blobs can't be written)
+        if self.blob_min_bytes and isinstance(obj, dict) and 'channel_values' in obj:
+            obj = {**obj, 'channel_values': self._externalize(obj['channel_values'], 0)}
+        type_, data = self.base.dumps_typed(obj)
+        if self.compression and type_ == 'msgpack' and len(data) >= self.compress_min_bytes:
+            return f'{type_}+{self.compression}', compress(data, self.compression)
+        return type_, data
+
+    def loads_typed(self, data: tuple[str, bytes], blobs: Optional[dict[str, tuple[str, bytes]]] = None) -> Any:
+        """`blobs` ({digest: (codec, data)}) are used before the shard's, e.g. those of an archived thread."""
+        obj = self._decode(data)
+        refs: list[ToolMessage] = []
+        self._collect_refs(obj, refs, 0)
+        if refs:
+            self._restore(refs, blobs or {})
+        return obj
+
+    def blob_refs(self, data: tuple[str, bytes]) -> set[str]:
+        """Digests of the blobs a serialized checkpoint points at, without loading them."""
+        refs: list[ToolMessage] = []
+        self._collect_refs(self._decode(data), refs, 0)
+        return {m.additional_kwargs[BLOB_KEY] for m in refs if BLOB_KEY in m.additional_kwargs} | {
+            _artifact_ref(m) for m in refs if _artifact_ref(m)
+        }
+
+    def _decode(self, data: tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if '+' in type_:
+            type_, codec = type_.split('+', 1)
+            payload = decompress(payload, codec)
+        return self.base.loads_typed((type_, payload))
+
+    # ---------- content-addressed tool outputs ----------
+
+    def _externalize(self, obj: Any, depth: int) -> Any:
+        if isinstance(obj, ToolMessage):
+            update = {}
+            if isinstance(obj.content, str) and len(obj.content) >= self.blob_min_bytes:
+                update['content'] = ''
+                update['additional_kwargs'] = {**obj.additional_kwargs, BLOB_KEY: self._store(obj.content)}
+            if isinstance(obj.artifact, str) and len(obj.artifact) >= self.blob_min_bytes:
+                update['artifact'] = {BLOB_KEY: self._store(obj.artifact)}
+            return obj.model_copy(update=update) if update else obj
+        if depth >= MAX_DEPTH:
+            return obj
+        if isinstance(obj, dict):
+            return {key: self._externalize(value, depth + 1) for key, value in obj.items()}
+        if isinstance(obj, list):
+            return [self._externalize(value, depth + 1) for value in obj]
+        return obj
+
+    def _store(self, content: str) -> str:
+        raw = content.encode()
+        digest = hashlib.sha256(raw).hexdigest()
+        key = (getattr(self._context, 'thread_id', None), digest)
+        with self._lock:
+            if key in self._stored:
+                return digest
+        codec = self.compression or 'raw'
+        put_checkpoint_blob(self.shard, digest, codec, raw if codec == 'raw' else compress(raw, codec), key[0])
+        with self._lock:
+            self._stored[key] = True
+        return digest
+
+    def _collect_refs(self, obj: Any, refs: list, depth: int):
+        if isinstance(obj, ToolMessage):
+            if BLOB_KEY in obj.additional_kwargs or _artifact_ref(obj):
+                refs.append(obj)
+        elif depth < MAX_DEPTH:
+            if isinstance(obj, dict):
+                for value in obj.values():
+                    self._collect_refs(value, refs, depth + 1)
+            elif isinstance(obj, (list, tuple)):
+                for value in obj:
+                    self._collect_refs(value, refs, depth + 1)
+
+    def _restore(self, refs: list[ToolMessage], blobs: dict[str, tuple[str, bytes]]):
+        digests = {m.additional_kwargs[BLOB_KEY] for m in refs if BLOB_KEY in m.additional_kwargs}
+        digests.update(_artifact_ref(m) for m in refs if _artifact_ref(m))
+        contents: dict[str, str] = {}
+        with self._lock:
+            for digest in digests:
+                if digest in self._loaded:
+                    contents[digest] = self._loaded[digest]
+        missing = list(digests - contents.keys())
+        found = {digest: blobs[digest] for digest in missing if digest in blobs}
+        found.update(get_checkpoint_blobs(self.shard, [digest for digest in missing if digest not in found]))
+        for digest, (codec, data) in found.items():
+            contents[digest] = (data if codec == 'raw' else decompress(data, codec)).decode()
+            with self._lock:
+                self._loaded[digest] = contents[digest]
+
+        for digest in digests:
+            if digest not in contents:
+                raise ValueError(f'Checkpoint blob {digest} is missing')
+        for message in refs:
+            if BLOB_KEY in message.additional_kwargs:
+                message.content = contents[message.additional_kwargs.pop(BLOB_KEY)]
+            if _artifact_ref(message):
+                message.artifact = contents[_artifact_ref(message)]
+
+
+# ---------- Blob collection ----------
+# Blobs are shared by content, so one can only go once no thread of its shard
+# references it any more: after its threads were archived (their blobs travel
+# with them, see backend/archive.py) or deleted. References are the
+# `checkpoint_blob_refs` rows written with each store, so collecting is one
+# indexed query. Shards with checkpoints from before that table get their rows
+# filled in once, by decoding every checkpoint, before anything is collected.
+# Each store refreshes the blob's `stored_at` and the dedup cache forgets after
+# STORED_TTL, so a blob that a turn in flight is about to reference is never
+# older than BLOB_GRACE_SECONDS.
+
+_refs_complete: set[str] = set()
+_refs_lock = threading.Lock()
+
+
+def ensure_blob_refs(shard: Shard):
+    """Fill in `checkpoint_blob_refs` for checkpoints written before it existed (once per shard file)."""
+    if shard.path in _refs_complete:
+        return
+    with _refs_lock:
+        if shard.path in _refs_complete:
+            return
+        if get_shard_meta(shard, 'blob_refs') != 'complete':
+            serde = CompactSerializer(shard)
+            refs: set[tuple[str, str]] = set()
+            for thread_id, type_, checkpoint in iter_checkpoint_payloads(shard):
+                refs.update((thread_id, digest) for digest in serde.blob_refs((type_, checkpoint)))
+                if len(refs) >= 1000:
+                    add_blob_refs(shard, list(refs))
+                    refs.clear()
+            add_blob_refs(shard, list(refs))
+            set_shard_meta(shard, 'blob_refs', 'complete')
+        _refs_complete.add(shard.path)
+
+
+def index_thread_blob_refs(shard: Shard, thread_id: str):
+    """Record the refs of a thread whose checkpoints were written without them (e.g. restored from an older archive)."""
+    serde = CompactSerializer(shard)
+    add_blob_refs(shard, [
+        (thread_id, digest)
+        for _, type_, checkpoint in iter_checkpoint_payloads(shard, thread_id)
+        for digest in serde.blob_refs((type_, checkpoint))
+    ])
+
+
+def thread_blob_refs(shard: Shard, thread_id: str) -> set[str]:
+    ensure_blob_refs(shard)
+    return set(get_thread_blob_refs(shard, thread_id))
+
+
+def forget_thread_blobs(shard: Shard, thread_id: str) -> set[str]:
+    """Drop the refs of a deleted thread; returns the digests it referenced, for collect_blobs."""
+    return set(delete_thread_blob_refs(shard, thread_id))
+
+
+def collect_blobs(shard: Shard, candidates: Optional[set[str]] = None) -> int:
+    """Drop the candidate blobs (default: every old enough one) no thread of the shard references; returns how many."""
+    ensure_blob_refs(shard)
+    if candidates is not None and not candidates:
+        return 0
+    stored_before = time.time() - BLOB_GRACE_SECONDS
+    return delete_unreferenced_blobs(shard, stored_before, None if candidates is None else list(candidates))
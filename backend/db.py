@@ -1,9 +1,103 @@
-import sqlite3, datetime
-from typing import Literal, Optional, List, Dict, Any
+import sqlite3, datetime, hashlib, json, os, re, threading, time, unicodedata
+from typing import Literal, Optional, List, Dict, Any, Iterator
+
+DB_PATH = os.getenv("CHATBOT_DB_PATH", "chatbot.db")
+
+# ----------------
+# Storage layout
+# ----------------
+# `conn` is the central database (users, password resets, LLM cache). Per-user
+# chat data (chat rooms, checkpoints, runs, usage, memory) lives in CHATBOT_SHARDS SQLite files
+# picked by a hash of user_id, so writers of different users do not queue on
+# one file lock. With the default of one shard, shard 0 *is* the central file.
+
+SHARDS = int(os.getenv("CHATBOT_SHARDS", "1"))
+SHARD_DIR = os.getenv("CHATBOT_SHARD_DIR", os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "shards"))
+
+# how long a writer waits for another process's write lock before "database is locked"
+BUSY_TIMEOUT_MS = int(os.getenv("CHATBOT_DB_BUSY_TIMEOUT_MS", "30000"))
+
+
+def open_connection(path: str, autocommit: bool = False) -> sqlite3.Connection:
+    """Every connection to the central file and the shards is opened here, so they all wait alike."""
+    connection = sqlite3.connect(
+        path, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None if autocommit else ''
+    )
+    # readers never block the writer; every worker process writes the same files
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return connection
+
+
+conn = open_connection(DB_PATH)
+# guards `conn`; with one shard it is also that shard's lock
+conn_lock = threading.Lock()
+
+
+class Shard:
+    """One SQLite file holding the chat data of a subset of users, with one connection per access pattern."""
+
+    def __init__(self, index: int, path: str, main_conn: Optional[sqlite3.Connection] = None):
+        self.index = index
+        self.path = path
+        self.conn = main_conn or open_connection(path)
+        self.conn.row_factory = sqlite3.Row
+        # guards `conn`; the shard's SqliteSaver takes the same lock (see backend/sharding.py)
+        self.lock = conn_lock if self.conn is conn else threading.Lock()
+
+        # autocommit connections, see the helper sections below
+        self.runs_conn, self.runs_lock = self._open()
+        self.blobs_conn, self.blobs_lock = self._open()
+        self.archive_conn, self.archive_lock = self._open()
+        self.search_conn, self.search_lock = self._open()
+        self.usage_conn, self.usage_lock = self._open()
+        self.memory_conn, self.memory_lock = self._open()
+
+    def _open(self) -> tuple[sqlite3.Connection, threading.Lock]:
+        connection = open_connection(self.path, autocommit=True)
+        connection.row_factory = sqlite3.Row
+        return connection, threading.Lock()
+
+
+def shard_index(user_id: int, count: int) -> int:
+    # stable across processes and Python versions (unlike hash())
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def shard_path(index: int, count: int) -> str:
+    # the count is part of the name so scripts/reshard.py can hold both layouts
+    return DB_PATH if count == 1 else os.path.join(SHARD_DIR, f"shard_{index:03d}-of-{count:03d}.db")
+
+
+def open_shards(count: int) -> List[Shard]:
+    if count == 1:
+        return [Shard(0, DB_PATH, main_conn=conn)]
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    return [Shard(i, shard_path(i, count)) for i in range(count)]
+
+
+shards = open_shards(SHARDS)
+
+
+def shard_for_user(user_id: int) -> Shard:
+    return shards[shard_index(user_id, len(shards))]
+
+
+_schema_lock = threading.Lock()
+_schema_ready = False
 
-conn = sqlite3.connect("chatbot.db", check_same_thread=False)
 
 def init_db():
+    """Create and migrate the schema; only the first call in a process does any work."""
+    global _schema_ready
+    with _schema_lock:
+        if not _schema_ready:
+            _create_schema()
+            _schema_ready = True
+
+
+def _create_schema():
     conn.execute("""
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -12,17 +106,7 @@ def init_db():
         email TEXT UNIQUE NOT NULL,
         password_hash TEXT NOT NULL,
         is_active INTEGER NOT NULL DEFAULT 1 CHECK (is_active IN (0,1)),
-        is_admin INTEGER NOT NULL DEFAULT 0 CHECK (is_admin IN (0,1))     
-    );
-    """)
-
-    conn.execute("""
-    CREATE TABLE IF NOT EXISTS chat_rooms (
-        thread_id TEXT PRIMARY KEY,
-        user_id INTEGER NOT NULL,
-        thread_title TEXT,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY(user_id) REFERENCES users(id)
+        is_admin INTEGER NOT NULL DEFAULT 0 CHECK (is_admin IN (0,1))
     );
     """)
 
@@ -34,6 +118,46 @@ def init_db():
     );
     """)
 
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        tokens INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS storage_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS profile_targets (
+        user_id INTEGER PRIMARY KEY,
+        turns_left INTEGER NOT NULL,
+        expires_at REAL NOT NULL,
+        set_by INTEGER,
+        created_at REAL NOT NULL
+    );
+    """)
+
+    # bumped by every password reset; sessions carry it (see backend/auth.py)
+    user_columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    if 'password_version' not in user_columns:
+        conn.execute("ALTER TABLE users ADD COLUMN password_version INTEGER NOT NULL DEFAULT 0")
+
+    # refuse to start with a shard count the data was not laid out for
+    conn.execute("INSERT OR IGNORE INTO storage_meta (key, value) VALUES ('shards', ?)", (str(SHARDS),))
+    row = conn.execute("SELECT value FROM storage_meta WHERE key='shards'").fetchone()
+    if int(row[0]) != SHARDS:
+        raise RuntimeError(
+            f"{DB_PATH} holds {row[0]} shard(s) but CHATBOT_SHARDS={SHARDS}; "
+            f"run scripts/reshard.py --shards {SHARDS} first"
+        )
+
     conn.execute(
         "DELETE FROM password_resets WHERE expires_at < ?",
         (datetime.datetime.now(datetime.timezone.utc).isoformat(),),
@@ -42,6 +166,169 @@ def init_db():
     conn.row_factory = sqlite3.Row
     conn.commit()
 
+    for shard in shards:
+        init_shard(shard)
+
+
+def init_shard(shard: Shard):
+    shard.conn.execute("""
+    CREATE TABLE IF NOT EXISTS chat_rooms (
+        thread_id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        thread_title TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    """)
+
+    shard.conn.execute("""
+    CREATE TABLE IF NOT EXISTS chat_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id TEXT UNIQUE NOT NULL,
+        thread_id TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        cancel_requested INTEGER NOT NULL DEFAULT 0 CHECK (cancel_requested IN (0,1)),
+        error TEXT,
+        heartbeat_at REAL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
+    shard.conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_runs_thread ON chat_runs (thread_id, status);")
+
+    shard.conn.execute("""
+    CREATE TABLE IF NOT EXISTS chat_run_events (
+        run_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (run_id, seq)
+    ) WITHOUT ROWID;
+    """)
+
+    shard.conn.execute("""
+    CREATE TABLE IF NOT EXISTS checkpoint_blobs (
+        hash TEXT PRIMARY KEY,
+        codec TEXT NOT NULL,
+        data BLOB NOT NULL,
+        stored_at REAL
+    ) WITHOUT ROWID;
+    """)
+
+    # which threads' checkpoints point at which blob (see the checkpoint blob helpers)
+    shard.conn.execute("""
+    CREATE TABLE IF NOT EXISTS checkpoint_blob_refs (
+        thread_id TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        PRIMARY KEY (thread_id, hash)
+    ) WITHOUT ROWID;
+    """)
+
+    shard.conn.execute("CREATE INDEX IF NOT EXISTS idx_checkpoint_blob_refs_hash ON checkpoint_blob_refs (hash);")
+
+    # per-file flags, e.g. whether checkpoint_blob_refs covers every checkpoint yet
+    shard.conn.execute("""
+    CREATE TABLE IF NOT EXISTS storage_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    """)
+
+    # full-text index over message text and thread titles (see the search helpers)
+    shard.conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS chat_search USING fts5(
+        content,
+        owner,
+        thread_id UNINDEXED,
+        role UNINDEXED,
+        position UNINDEXED,
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    );
+    """)
+
+    shard.conn.execute("""
+    CREATE TABLE IF NOT EXISTS chat_search_progress (
+        thread_id TEXT PRIMARY KEY,
+        indexed INTEGER NOT NULL DEFAULT 0,
+        title_rowid INTEGER
+    ) WITHOUT ROWID;
+    """)
+
+    # per-turn usage, append-only, plus rollups kept up to date on insert (see the usage helpers)
+    shard.conn.execute("""
+    CREATE TABLE IF NOT EXISTS usage_events (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        thread_id TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        status TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL DEFAULT 0,
+        completion_tokens INTEGER NOT NULL DEFAULT 0,
+        llm_calls INTEGER NOT NULL DEFAULT 0,
+        tool_calls TEXT,
+        latency_ms INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+
+    shard.conn.execute("""
+    CREATE TABLE IF NOT EXISTS usage_rollups (
+        user_id INTEGER NOT NULL,
+        period TEXT NOT NULL CHECK (period IN ('hour', 'day')),
+        bucket INTEGER NOT NULL,
+        turns INTEGER NOT NULL DEFAULT 0,
+        prompt_tokens INTEGER NOT NULL DEFAULT 0,
+        completion_tokens INTEGER NOT NULL DEFAULT 0,
+        llm_calls INTEGER NOT NULL DEFAULT 0,
+        tool_calls INTEGER NOT NULL DEFAULT 0,
+        latency_ms INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, period, bucket)
+    ) WITHOUT ROWID;
+    """)
+
+    shard.conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_rollups_bucket ON usage_rollups (period, bucket);")
+
+    shard.conn.execute("""
+    CREATE TABLE IF NOT EXISTS usage_tool_rollups (
+        user_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        tool TEXT NOT NULL,
+        calls INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, bucket, tool)
+    ) WITHOUT ROWID;
+    """)
+
+    shard.conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_tool_rollups_bucket ON usage_tool_rollups (bucket);")
+
+    # long-term memory: facts per user, `slot` is the fact's row in the user's vector file (see the memory helpers)
+    shard.conn.execute("""
+    CREATE TABLE IF NOT EXISTS memory_facts (
+        user_id INTEGER NOT NULL,
+        slot INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        text TEXT NOT NULL,
+        thread_id TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (user_id, slot)
+    ) WITHOUT ROWID;
+    """)
+
+    shard.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_memory_facts_key ON memory_facts (user_id, key);")
+
+    # chat_rooms columns added after the first release
+    room_columns = {row[1] for row in shard.conn.execute("PRAGMA table_info(chat_rooms)")}
+    for column in ('last_active_at', 'archived_at'):
+        if column not in room_columns:
+            shard.conn.execute(f"ALTER TABLE chat_rooms ADD COLUMN {column} REAL")
+    # NULL for blobs stored before it existed; those are never collected (older archives may point at them)
+    blob_columns = {row[1] for row in shard.conn.execute("PRAGMA table_info(checkpoint_blobs)")}
+    if 'stored_at' not in blob_columns:
+        shard.conn.execute("ALTER TABLE checkpoint_blobs ADD COLUMN stored_at REAL")
+
+    shard.conn.commit()
+
 
 # ---------- Chat room helpers ----------
 
@@ -50,10 +337,11 @@ def execute_select_query(
     select_query: str,
     parameters: tuple = (),
     fetch: Literal["one", "all", "many"] = "all",
-    many_size: int = 10
+    many_size: int = 10,
+    connection: Optional[sqlite3.Connection] = None
 ) -> Optional[Dict[str, Any] | List[Dict[str, Any]]]:
 
-    curr = conn.execute(select_query, parameters)
+    curr = (connection or conn).execute(select_query, parameters)
 
     try:
         match(fetch):
@@ -68,7 +356,7 @@ def execute_select_query(
             case "all":  # fetch == "all"
                 rows = curr.fetchall()
                 return [dict(row) for row in rows]
-            
+
             case _:
                 raise ValueError(f"Invalid fetch mode: {fetch}")
 
@@ -78,52 +366,1059 @@ def execute_select_query(
 
 
 def get_thread_title(thread_id: str, user_id: int) -> Optional[str]:
-    row = execute_select_query(
-        "SELECT thread_title FROM chat_rooms WHERE thread_id=? AND user_id=?",
-        (thread_id, user_id),
-        fetch="one"
-    )
+    shard = shard_for_user(user_id)
+    with shard.lock:
+        row = execute_select_query(
+            "SELECT thread_title FROM chat_rooms WHERE thread_id=? AND user_id=?",
+            (thread_id, user_id),
+            fetch="one",
+            connection=shard.conn
+        )
     return row["thread_title"] if row else None
 
 
 def set_thread_title(thread_id: str, user_id: int, title: str):
-    conn.execute(
-        """
-        INSERT OR IGNORE INTO chat_rooms (thread_id, user_id, thread_title)
-        VALUES (?, ?, ?)
-        """,
-        (thread_id, user_id, title)
-    )
-    conn.execute(
-        """
-        UPDATE chat_rooms
-        SET thread_title=?
-        WHERE thread_id=? AND user_id=?
-        """,
-        (title, thread_id, user_id)
-    )
-    conn.commit()
+    shard = shard_for_user(user_id)
+    with shard.lock:
+        shard.conn.execute(
+            """
+            INSERT OR IGNORE INTO chat_rooms (thread_id, user_id, thread_title)
+            VALUES (?, ?, ?)
+            """,
+            (thread_id, user_id, title)
+        )
+        shard.conn.execute(
+            """
+            UPDATE chat_rooms
+            SET thread_title=?
+            WHERE thread_id=? AND user_id=?
+            """,
+            (title, thread_id, user_id)
+        )
+        shard.conn.commit()
+    index_thread_title(thread_id, user_id, title)
 
 
 def get_user_rooms(user_id: int):
-    return execute_select_query(
-        """
-        SELECT thread_id, thread_title
-        FROM chat_rooms
-        WHERE user_id=?
-        ORDER BY created_at DESC
-        """,
-        (user_id,),
-        fetch="all"
-    )
+    shard = shard_for_user(user_id)
+    with shard.lock:
+        return execute_select_query(
+            """
+            SELECT thread_id, thread_title
+            FROM chat_rooms
+            WHERE user_id=?
+            ORDER BY created_at DESC
+            """,
+            (user_id,),
+            fetch="all",
+            connection=shard.conn
+        )
 
 def get_user_details(user_id: int):
-    return execute_select_query(
-        "SELECT first_name, last_name, email, is_active, is_admin FROM users WHERE id=?",
-        (user_id,),
+    with conn_lock:
+        return execute_select_query(
+            "SELECT first_name, last_name, email, is_active, is_admin FROM users WHERE id=?",
+            (user_id,),
+            fetch="one"
+        )
+
+
+def get_storage_meta(key: str, default: str) -> str:
+    """The value stored under `key` in storage_meta; the first caller (of any worker) stores `default`."""
+    with conn_lock:
+        conn.execute("INSERT OR IGNORE INTO storage_meta (key, value) VALUES (?, ?)", (key, default))
+        conn.commit()
+        return conn.execute("SELECT value FROM storage_meta WHERE key=?", (key,)).fetchone()[0]
+
+
+# ---------- Chat run helpers ----------
+# Background turns (see backend/runs.py) log their events here so any service
+# worker can replay / resume a run, not just the one executing it. The run log
+# has its own autocommit connection: it is written from many run threads at
+# once and must always see rows committed by other workers, never a snapshot
+# left open by another thread's transaction on the shared `conn`.
+
+
+def _runs_select(shard: Shard, query: str, parameters: tuple = (), fetch: Literal["one", "all"] = "all"):
+    with shard.runs_lock:
+        rows = shard.runs_conn.execute(query, parameters).fetchall()
+    if fetch == "one":
+        return dict(rows[0]) if rows else None
+    return [dict(row) for row in rows]
+
+
+def create_run(run_id: str, thread_id: str, user_id: int) -> int:
+    shard = shard_for_user(user_id)
+    with shard.runs_lock:
+        cur = shard.runs_conn.execute(
+            "INSERT INTO chat_runs (run_id, thread_id, user_id, heartbeat_at) VALUES (?, ?, ?, ?)",
+            (run_id, thread_id, user_id, time.time())
+        )
+        return cur.lastrowid
+
+
+def get_run(run_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+    return _runs_select(
+        shard_for_user(user_id),
+        "SELECT id, run_id, thread_id, user_id, status, cancel_requested, error, heartbeat_at FROM chat_runs WHERE run_id=?",
+        (run_id,),
         fetch="one"
     )
 
 
+def get_active_runs(thread_id: str, user_id: int, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    query = "SELECT id, run_id, status, heartbeat_at FROM chat_runs WHERE thread_id=? AND status IN ('queued', 'running')"
+    parameters: tuple = (thread_id,)
+    if before_id is not None:
+        query += " AND id < ?"
+        parameters += (before_id,)
+    return _runs_select(shard_for_user(user_id), query + " ORDER BY id", parameters)
+
+
+def update_run(run_id: str, user_id: int, status: Optional[str] = None, error: Optional[str] = None):
+    shard = shard_for_user(user_id)
+    with shard.runs_lock:
+        shard.runs_conn.execute(
+            "UPDATE chat_runs SET status=COALESCE(?, status), error=COALESCE(?, error), heartbeat_at=? WHERE run_id=?",
+            (status, error, time.time(), run_id)
+        )
+
+
+def request_run_cancel(run_id: str, user_id: int):
+    shard = shard_for_user(user_id)
+    with shard.runs_lock:
+        shard.runs_conn.execute("UPDATE chat_runs SET cancel_requested=1 WHERE run_id=?", (run_id,))
+
+
+def get_cancel_requests(runs: List[tuple[str, int]]) -> List[str]:
+    """`runs` are (run_id, user_id) pairs; returns the run_ids with a pending cancel request."""
+    by_shard: Dict[int, List[str]] = {}
+    for run_id, user_id in runs:
+        by_shard.setdefault(shard_for_user(user_id).index, []).append(run_id)
+
+    cancelled = []
+    for index, run_ids in by_shard.items():
+        placeholders = ','.join('?' * len(run_ids))
+        rows = _runs_select(
+            shards[index],
+            f"SELECT run_id FROM chat_runs WHERE cancel_requested=1 AND run_id IN ({placeholders})",
+            tuple(run_ids)
+        )
+        cancelled.extend(row["run_id"] for row in rows)
+    return cancelled
+
+
+def append_run_events(run_id: str, user_id: int, first_seq: int, events: List[tuple]) -> bool:
+    """Persist a batch of events; returns whether a cancel was requested meanwhile."""
+    shard = shard_for_user(user_id)
+    with shard.runs_lock:
+        shard.runs_conn.execute("BEGIN")
+        try:
+            shard.runs_conn.executemany(
+                "INSERT OR IGNORE INTO chat_run_events (run_id, seq, event, data) VALUES (?, ?, ?, ?)",
+                [(run_id, first_seq + i, event, data) for i, (event, data) in enumerate(events)]
+            )
+            shard.runs_conn.execute("UPDATE chat_runs SET heartbeat_at=? WHERE run_id=?", (time.time(), run_id))
+            row = shard.runs_conn.execute("SELECT cancel_requested FROM chat_runs WHERE run_id=?", (run_id,)).fetchone()
+            shard.runs_conn.execute("COMMIT")
+        except Exception:
+            shard.runs_conn.execute("ROLLBACK")
+            raise
+    return bool(row and row["cancel_requested"])
+
+
+def get_run_events(run_id: str, user_id: int, offset: int = 0) -> List[Dict[str, Any]]:
+    return _runs_select(
+        shard_for_user(user_id),
+        "SELECT seq, event, data FROM chat_run_events WHERE run_id=? AND seq >= ? ORDER BY seq",
+        (run_id, offset)
+    )
+
+
+def purge_finished_runs(older_than_seconds: float):
+    cutoff = time.time() - older_than_seconds
+    for shard in shards:
+        with shard.runs_lock:
+            shard.runs_conn.execute(
+                """
+                DELETE FROM chat_run_events WHERE run_id IN (
+                    SELECT run_id FROM chat_runs WHERE status NOT IN ('queued', 'running') AND heartbeat_at < ?
+                )
+                """,
+                (cutoff,)
+            )
+            shard.runs_conn.execute("DELETE FROM chat_runs WHERE status NOT IN ('queued', 'running') AND heartbeat_at < ?", (cutoff,))
+
+
+# ---------- LLM cache helpers ----------
+# Persistent tier of backend/llm_cache.py, shared by all service workers.
+# Like the run log it uses its own autocommit connection.
+
+cache_conn = open_connection(DB_PATH, autocommit=True)
+cache_lock = threading.Lock()
+
+
+def get_cached_response(key: str, max_age: float) -> Optional[tuple[str, int]]:
+    with cache_lock:
+        row = cache_conn.execute(
+            "SELECT response, tokens FROM llm_cache WHERE key=? AND created_at >= ?",
+            (key, time.time() - max_age)
+        ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def set_cached_response(key: str, response: str, tokens: int):
+    with cache_lock:
+        cache_conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, response, tokens, created_at) VALUES (?, ?, ?, ?)",
+            (key, response, tokens, time.time())
+        )
+
+
+def purge_cached_responses(older_than_seconds: float):
+    with cache_lock:
+        cache_conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - older_than_seconds,))
+
+
+# ---------- Profiling helpers ----------
+# Users whose next turns an admin asked to profile (see backend/profiling.py).
+# Every worker reads the list now and then; taking one turn is a single UPDATE,
+# so a turn is profiled once however many workers serve the user.
+
+profile_conn = open_connection(DB_PATH, autocommit=True)
+profile_conn.row_factory = sqlite3.Row
+profile_lock = threading.Lock()
+
+
+def set_profile_target(user_id: int, turns: int, expires_at: float, set_by: Optional[int] = None):
+    """Profile the user's next `turns` turns until `expires_at`; 0 turns stops profiling them."""
+    with profile_lock:
+        if turns <= 0:
+            profile_conn.execute("DELETE FROM profile_targets WHERE user_id=?", (user_id,))
+            return
+        profile_conn.execute(
+            "INSERT OR REPLACE INTO profile_targets (user_id, turns_left, expires_at, set_by, created_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, turns, expires_at, set_by, time.time())
+        )
+
+
+def get_profile_targets(now: float) -> List[Dict[str, Any]]:
+    with profile_lock:
+        rows = profile_conn.execute(
+            "SELECT user_id, turns_left, expires_at, set_by, created_at FROM profile_targets WHERE turns_left > 0 AND expires_at > ? ORDER BY created_at",
+            (now,)
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def claim_profile_turn(user_id: int, now: float) -> bool:
+    """Take one of the user's profiled turns; False if none is left."""
+    with profile_lock:
+        claimed = profile_conn.execute(
+            "UPDATE profile_targets SET turns_left = turns_left - 1 WHERE user_id=? AND turns_left > 0 AND expires_at > ?",
+            (user_id, now)
+        ).rowcount
+        profile_conn.execute("DELETE FROM profile_targets WHERE turns_left <= 0 OR expires_at <= ?", (now,))
+    return claimed == 1
+
+
+# ---------- Checkpoint blob helpers ----------
+# Large tool outputs referenced from checkpoints (see backend/checkpoint_serde.py),
+# stored once per content hash in the shard of the checkpoint. Written on their
+# own autocommit connection before the checkpoint that references them commits,
+# so a reference never dangles, together with a `checkpoint_blob_refs` row for
+# the thread storing them. A blob without refs rows can go; every store
+# refreshes `stored_at`, and recently stored blobs are left alone anyway.
+# `storage_meta.blob_refs` = 'complete' once the refs rows of checkpoints
+# written before the table existed were filled in.
+
+
+def put_checkpoint_blob(shard: Shard, digest: str, codec: str, data: bytes, thread_id: Optional[str] = None):
+    with shard.blobs_lock:
+        shard.blobs_conn.execute("BEGIN")
+        try:
+            shard.blobs_conn.execute(
+                "INSERT INTO checkpoint_blobs (hash, codec, data, stored_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (hash) DO UPDATE SET stored_at=excluded.stored_at",
+                (digest, codec, data, time.time())
+            )
+            if thread_id is not None:
+                shard.blobs_conn.execute(
+                    "INSERT OR IGNORE INTO checkpoint_blob_refs (thread_id, hash) VALUES (?, ?)", (thread_id, digest)
+                )
+            shard.blobs_conn.execute("COMMIT")
+        except BaseException:
+            shard.blobs_conn.execute("ROLLBACK")
+            raise
+
+
+def get_checkpoint_blobs(shard: Shard, digests: List[str]) -> Dict[str, tuple[str, bytes]]:
+    if not digests:
+        return {}
+    placeholders = ','.join('?' * len(digests))
+    with shard.blobs_lock:
+        rows = shard.blobs_conn.execute(
+            f"SELECT hash, codec, data FROM checkpoint_blobs WHERE hash IN ({placeholders})", tuple(digests)
+        ).fetchall()
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+def export_checkpoint_blobs(shard: Shard, digests: List[str]) -> Dict[str, list]:
+    """The blob rows as {'columns': [...], 'rows': [...]}, the shape export_thread_rows uses."""
+    with shard.blobs_lock:
+        cur = shard.blobs_conn.execute(
+            f"SELECT * FROM checkpoint_blobs WHERE hash IN ({','.join('?' * len(digests))})", tuple(digests)
+        )
+        return {'columns': [c[0] for c in cur.description], 'rows': [tuple(row) for row in cur.fetchall()]}
+
+
+def iter_checkpoint_payloads(shard: Shard, thread_id: Optional[str] = None) -> Iterator[tuple[str, str, bytes]]:
+    """(thread_id, type, serialized checkpoint) of every checkpoint in the shard (or of one thread), page by page."""
+    after = 0
+    while True:
+        with shard.archive_lock:
+            rows = shard.archive_conn.execute(
+                "SELECT rowid, thread_id, type, checkpoint FROM checkpoints WHERE rowid > ? AND (? IS NULL OR thread_id = ?) ORDER BY rowid LIMIT ?",
+                (after, thread_id, thread_id, EXPORT_PAGE)
+            ).fetchall()
+        for row in rows:
+            yield row['thread_id'], row['type'], row['checkpoint']
+        if len(rows) < EXPORT_PAGE:
+            return
+        after = rows[-1]['rowid']
+
+
+def get_thread_blob_refs(shard: Shard, thread_id: str) -> List[str]:
+    with shard.blobs_lock:
+        rows = shard.blobs_conn.execute("SELECT hash FROM checkpoint_blob_refs WHERE thread_id=?", (thread_id,)).fetchall()
+    return [row[0] for row in rows]
+
+
+def add_blob_refs(shard: Shard, refs: List[tuple[str, str]]):
+    """Record (thread_id, hash) pairs, skipping threads that have no checkpoints (any more)."""
+    with shard.blobs_lock:
+        shard.blobs_conn.executemany(
+            "INSERT OR IGNORE INTO checkpoint_blob_refs (thread_id, hash) "
+            "SELECT ?1, ?2 WHERE EXISTS (SELECT 1 FROM checkpoints WHERE thread_id=?1)",
+            refs
+        )
+
+
+def delete_thread_blob_refs(shard: Shard, thread_id: str) -> List[str]:
+    """Forget what the (deleted) thread referenced; returns those digests."""
+    with shard.blobs_lock:
+        shard.blobs_conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = shard.blobs_conn.execute("SELECT hash FROM checkpoint_blob_refs WHERE thread_id=?", (thread_id,)).fetchall()
+            shard.blobs_conn.execute("DELETE FROM checkpoint_blob_refs WHERE thread_id=?", (thread_id,))
+            shard.blobs_conn.execute("COMMIT")
+        except BaseException:
+            shard.blobs_conn.execute("ROLLBACK")
+            raise
+    return [row[0] for row in rows]
+
+
+def delete_unreferenced_blobs(shard: Shard, stored_before: float, digests: Optional[List[str]] = None) -> int:
+    """Drop the blobs (default: all) no thread references, unless they were stored (again) since `stored_before`."""
+    unreferenced = "stored_at < ? AND NOT EXISTS (SELECT 1 FROM checkpoint_blob_refs r WHERE r.hash = checkpoint_blobs.hash)"
+    with shard.blobs_lock:
+        if digests is None:
+            return shard.blobs_conn.execute(f"DELETE FROM checkpoint_blobs WHERE {unreferenced}", (stored_before,)).rowcount
+        return shard.blobs_conn.executemany(
+            f"DELETE FROM checkpoint_blobs WHERE hash=? AND {unreferenced}", [(digest, stored_before) for digest in digests]
+        ).rowcount
+
+
+def get_shard_meta(shard: Shard, key: str) -> Optional[str]:
+    with shard.blobs_lock:
+        row = shard.blobs_conn.execute("SELECT value FROM storage_meta WHERE key=?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_shard_meta(shard: Shard, key: str, value: str):
+    with shard.blobs_lock:
+        shard.blobs_conn.execute("INSERT OR REPLACE INTO storage_meta (key, value) VALUES (?, ?)", (key, value))
+
+
+# ---------- Thread archive helpers ----------
+# Cold threads have their checkpoint rows (and blob refs) moved out of the hot database (see
+# backend/archive.py); the chat_rooms row stays behind as the stub. Both moves
+# run in BEGIN IMMEDIATE transactions on their own connection so that a turn
+# touching the thread and the archiver can never interleave.
+# `last_active_at` only has to be accurate to ARCHIVE_AFTER_DAYS, so a thread is
+# written to at most once per TOUCH_INTERVAL seconds (and when it is archived).
+
+CHECKPOINT_TABLES = ('checkpoints', 'writes', 'checkpoint_blob_refs')
+TOUCH_INTERVAL = float(os.getenv("CHATBOT_TOUCH_INTERVAL", "300"))
+
+
+def touch_thread(thread_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+    """Mark the user's thread as active now; returns its `user_id` / `archived_at` (None unless it is theirs)."""
+    shard = shard_for_user(user_id)
+    now = time.time()
+    with shard.archive_lock:
+        row = shard.archive_conn.execute(
+            "SELECT user_id, archived_at, last_active_at FROM chat_rooms WHERE thread_id=? AND user_id=?", (thread_id, user_id)
+        ).fetchone()
+    if row is None:
+        return None
+    if row['archived_at'] is None and row['last_active_at'] is not None and now - row['last_active_at'] < TOUCH_INTERVAL:
+        return {'user_id': row['user_id'], 'archived_at': None}
+    with shard.archive_lock:
+        shard.archive_conn.execute("BEGIN IMMEDIATE")
+        try:
+            shard.archive_conn.execute(
+                "UPDATE chat_rooms SET last_active_at=? WHERE thread_id=? AND user_id=?", (now, thread_id, user_id)
+            )
+            row = shard.archive_conn.execute(
+                "SELECT user_id, archived_at FROM chat_rooms WHERE thread_id=? AND user_id=?", (thread_id, user_id)
+            ).fetchone()
+            shard.archive_conn.execute("COMMIT")
+        except BaseException:
+            shard.archive_conn.execute("ROLLBACK")
+            raise
+    return dict(row) if row else None
+
+
+def get_thread_owner(thread_id: str, user_id: int) -> Optional[int]:
+    """Who owns the thread in the user's shard: its chat room, else its first checkpoint (titles come later); None if new."""
+    shard = shard_for_user(user_id)
+    with shard.archive_lock:
+        row = shard.archive_conn.execute("SELECT user_id FROM chat_rooms WHERE thread_id=?", (thread_id,)).fetchone()
+        if row is not None:
+            return row['user_id']
+        has_checkpoints = shard.archive_conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='checkpoints'"
+        ).fetchone()
+        row = has_checkpoints and shard.archive_conn.execute(
+            "SELECT metadata FROM checkpoints WHERE thread_id=? LIMIT 1", (thread_id,)
+        ).fetchone()
+    if not row or row['metadata'] is None:
+        return None
+    owner = json.loads(row['metadata']).get('user_id')
+    return int(owner) if owner is not None else None
+
+
+def get_cold_threads(shard: Shard, inactive_before: float, limit: int) -> List[Dict[str, Any]]:
+    with shard.archive_lock:
+        rows = shard.archive_conn.execute(
+            """
+            SELECT thread_id, user_id, last_active_at FROM chat_rooms
+            WHERE archived_at IS NULL
+            AND COALESCE(last_active_at, CAST(strftime('%s', created_at) AS REAL)) < ?
+            ORDER BY COALESCE(last_active_at, CAST(strftime('%s', created_at) AS REAL))
+            LIMIT ?
+            """,
+            (inactive_before, limit)
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def export_thread_rows(thread_id: str, user_id: int) -> Dict[str, Dict[str, list]]:
+    """All checkpointer rows of a thread as {table: {'columns': [...], 'rows': [...]}}."""
+    shard = shard_for_user(user_id)
+    exported = {}
+    with shard.archive_lock:
+        for table in CHECKPOINT_TABLES:
+            cur = shard.archive_conn.execute(f"SELECT * FROM {table} WHERE thread_id=?", (thread_id,))
+            exported[table] = {'columns': [c[0] for c in cur.description], 'rows': [tuple(row) for row in cur.fetchall()]}
+    return exported
+
+
+def archive_thread_rows(thread_id: str, user_id: int, last_active_at: Optional[float]) -> bool:
+    """Drop the thread's checkpoints unless it was touched (or has a run) since `last_active_at`."""
+    shard = shard_for_user(user_id)
+    with shard.archive_lock:
+        shard.archive_conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = shard.archive_conn.execute(
+                "SELECT last_active_at, archived_at FROM chat_rooms WHERE thread_id=?", (thread_id,)
+            ).fetchone()
+            busy = shard.archive_conn.execute(
+                "SELECT 1 FROM chat_runs WHERE thread_id=? AND status IN ('queued', 'running') LIMIT 1", (thread_id,)
+            ).fetchone()
+            if not row or row['archived_at'] is not None or row['last_active_at'] != last_active_at or busy:
+                shard.archive_conn.execute("ROLLBACK")
+                return False
+            for table in CHECKPOINT_TABLES:
+                shard.archive_conn.execute(f"DELETE FROM {table} WHERE thread_id=?", (thread_id,))
+            shard.archive_conn.execute("UPDATE chat_rooms SET archived_at=? WHERE thread_id=?", (time.time(), thread_id))
+            shard.archive_conn.execute("COMMIT")
+            return True
+        except BaseException:
+            shard.archive_conn.execute("ROLLBACK")
+            raise
+
+
+def restore_thread_rows(thread_id: str, user_id: int, exported: Dict[str, Dict[str, list]]) -> bool:
+    """Put archived rows back and clear `archived_at`; False if someone else already did."""
+    shard = shard_for_user(user_id)
+    with shard.archive_lock:
+        shard.archive_conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = shard.archive_conn.execute("SELECT archived_at FROM chat_rooms WHERE thread_id=?", (thread_id,)).fetchone()
+            if not row or row['archived_at'] is None:
+                shard.archive_conn.execute("ROLLBACK")
+                return False
+            for table, data in exported.items():
+                columns = ', '.join(data['columns'])
+                placeholders = ', '.join('?' * len(data['columns']))
+                shard.archive_conn.executemany(
+                    f"INSERT OR IGNORE INTO {table} ({columns}) VALUES ({placeholders})", data['rows']
+                )
+            shard.archive_conn.execute("UPDATE chat_rooms SET archived_at=NULL WHERE thread_id=?", (thread_id,))
+            shard.archive_conn.execute("COMMIT")
+            return True
+        except BaseException:
+            shard.archive_conn.execute("ROLLBACK")
+            raise
+
+
+def is_thread_archived(thread_id: str, user_id: int) -> bool:
+    shard = shard_for_user(user_id)
+    with shard.archive_lock:
+        row = shard.archive_conn.execute("SELECT archived_at FROM chat_rooms WHERE thread_id=?", (thread_id,)).fetchone()
+    return bool(row and row['archived_at'] is not None)
+
+
+def get_db_size() -> Dict[str, int]:
+    """File size and bytes in use (file minus free pages) of the hot database, all shards included."""
+    size = {'file_bytes': 0, 'used_bytes': 0}
+    connections = [(cache_lock, cache_conn)] + [(s.archive_lock, s.archive_conn) for s in shards if s.path != DB_PATH]
+    for lock, connection in connections:
+        with lock:
+            page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+            pages = connection.execute("PRAGMA page_count").fetchone()[0]
+            free = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        size['file_bytes'] += pages * page_size
+        size['used_bytes'] += (pages - free) * page_size
+    return size
+
+
+def vacuum_db():
+    with cache_lock:
+        cache_conn.execute("VACUUM")
+    for shard in shards:
+        if shard.path != DB_PATH:
+            with shard.archive_lock:
+                shard.archive_conn.execute("VACUUM")
+
+
+# ---------- Bulk export / import helpers ----------
+# Used by backend/transfer.py. Reads page through tables by rowid (keyset), one
+# short read per page, so exporting a large database holds no long transaction
+# and keeps memory flat. Imports write many threads per BEGIN IMMEDIATE
+# transaction on the shard's archive connection, search index included.
+
+EXPORT_PAGE = 500
+
+
+def iter_users(user_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    after = 0
+    while True:
+        with conn_lock:
+            rows = conn.execute(
+                """
+                SELECT id, first_name, last_name, email, password_hash, is_active, is_admin FROM users
+                WHERE id > ? AND (? IS NULL OR id = ?) ORDER BY id LIMIT ?
+                """,
+                (after, user_id, user_id, EXPORT_PAGE)
+            ).fetchall()
+        yield from (dict(row) for row in rows)
+        if len(rows) < EXPORT_PAGE:
+            return
+        after = rows[-1]['id']
+
+
+def iter_rooms(shard: Shard, user_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    after = 0
+    while True:
+        with shard.archive_lock:
+            rows = shard.archive_conn.execute(
+                """
+                SELECT rowid, thread_id, user_id, thread_title, created_at, last_active_at, archived_at FROM chat_rooms
+                WHERE rowid > ? AND (? IS NULL OR user_id = ?) ORDER BY rowid LIMIT ?
+                """,
+                (after, user_id, user_id, EXPORT_PAGE)
+            ).fetchall()
+        yield from (dict(row) for row in rows)
+        if len(rows) < EXPORT_PAGE:
+            return
+        after = rows[-1]['rowid']
+
+
+def get_latest_checkpoint_row(shard: Shard, thread_id: str) -> Optional[tuple[str, bytes]]:
+    """(type, serialized checkpoint) of the thread's newest root checkpoint, without its pending writes."""
+    with shard.archive_lock:
+        row = shard.archive_conn.execute(
+            "SELECT type, checkpoint FROM checkpoints WHERE thread_id=? AND checkpoint_ns='' ORDER BY checkpoint_id DESC LIMIT 1",
+            (thread_id,)
+        ).fetchone()
+    return (row['type'], row['checkpoint']) if row else None
+
+
+def import_users(users: List[Dict[str, Any]]) -> Dict[int, int]:
+    """Insert exported users; returns old id -> id here. Existing emails keep their account, taken ids get new ones."""
+    mapping = {}
+    with conn_lock:
+        try:
+            for user in users:
+                row = conn.execute("SELECT id FROM users WHERE email=?", (user['email'],)).fetchone()
+                if row is None:
+                    taken = conn.execute("SELECT 1 FROM users WHERE id=?", (user['id'],)).fetchone()
+                    cur = conn.execute(
+                        """
+                        INSERT INTO users (id, first_name, last_name, email, password_hash, is_active, is_admin)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        (None if taken else user['id'], user['first_name'], user['last_name'], user['email'],
+                         user['password_hash'], user['is_active'], user['is_admin'])
+                    )
+                    row = (cur.lastrowid,)
+                mapping[user['id']] = row[0]
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return mapping
+
+
+def get_existing_threads(shard: Shard, thread_ids: List[str]) -> set:
+    with shard.archive_lock:
+        rows = shard.archive_conn.execute(
+            "SELECT thread_id FROM chat_rooms WHERE thread_id IN (SELECT value FROM json_each(?))", (json.dumps(thread_ids),)
+        ).fetchall()
+    return {row['thread_id'] for row in rows}
+
+
+def import_thread_batch(shard: Shard, rooms: List[Dict[str, Any]], checkpoints: List[tuple], search: List[tuple[str, List[tuple[str, str]]]]):
+    """
+    Write imported threads in one transaction: chat_rooms rows, one checkpoint
+    row each (thread_id, checkpoint_id, type, checkpoint, metadata) and their
+    search rows, `search` being (thread_id, [(role, content), ...]) like
+    index_thread_messages takes.
+    """
+    owners = {room['thread_id']: _owner_token(room['user_id']) for room in rooms}
+    with shard.archive_lock:
+        shard.archive_conn.execute("BEGIN IMMEDIATE")
+        try:
+            shard.archive_conn.executemany(
+                """
+                INSERT OR IGNORE INTO chat_rooms (thread_id, user_id, thread_title, created_at, last_active_at)
+                VALUES (:thread_id, :user_id, :thread_title, :created_at, :last_active_at)
+                """,
+                rooms
+            )
+            shard.archive_conn.executemany(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, type, checkpoint, metadata) VALUES (?, '', ?, ?, ?, ?)",
+                checkpoints
+            )
+            shard.archive_conn.executemany(
+                "INSERT INTO chat_search (content, owner, thread_id, role, position) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (content, owners[thread_id], thread_id, role, position)
+                    for thread_id, messages in search
+                    for position, (role, content) in enumerate(messages)
+                    if content
+                )
+            )
+            progress = []
+            for room in rooms:
+                title_rowid = None
+                if room['thread_title']:
+                    title_rowid = shard.archive_conn.execute(
+                        "INSERT INTO chat_search (content, owner, thread_id, role, position) VALUES (?, ?, ?, 'title', NULL)",
+                        (room['thread_title'], owners[room['thread_id']], room['thread_id'])
+                    ).lastrowid
+                progress.append((room['thread_id'], title_rowid))
+            indexed = {thread_id: len(messages) for thread_id, messages in search}
+            shard.archive_conn.executemany(
+                "INSERT OR REPLACE INTO chat_search_progress (thread_id, indexed, title_rowid) VALUES (?, ?, ?)",
+                [(thread_id, indexed.get(thread_id, 0), title_rowid) for thread_id, title_rowid in progress]
+            )
+            shard.archive_conn.execute("COMMIT")
+        except BaseException:
+            shard.archive_conn.execute("ROLLBACK")
+            raise
+
+
+def defer_search_merges(shard: Shard, deferred: bool):
+    """
+    Turn FTS5 segment merging off for a bulk import, or back on; turning it
+    back on merges everything written meanwhile in one pass.
+    """
+    with shard.search_lock:
+        if deferred:
+            shard.search_conn.execute("INSERT INTO chat_search (chat_search, rank) VALUES ('automerge', 0)")
+        else:
+            shard.search_conn.execute("INSERT INTO chat_search (chat_search, rank) VALUES ('automerge', 4)")
+            shard.search_conn.execute("INSERT INTO chat_search (chat_search) VALUES ('optimize')")
+
+
+# ---------- Search helpers ----------
+# `chat_search` is an FTS5 index per shard, filled incrementally as turns
+# complete (see index_chat_thread in backend/langgraph_tool_backend.py). Each
+# row carries an `owner` token so the user filter is part of the MATCH itself
+# and a query only walks that user's postings. `chat_search_progress` records
+# how many messages of a thread are indexed, so re-indexing only adds the tail.
+# Only the newest SEARCH_WINDOW matches are ranked: FTS5 walks rowids newest
+# first and stops there, so a common word costs about the same in a 50k-message
+# history as in a 2k one.
+
+
+SEARCH_WINDOW = int(os.getenv("CHATBOT_SEARCH_WINDOW", "1000"))
+
+
+def _owner_token(user_id: int) -> str:
+    return f"u{user_id}"
+
+
+def index_thread_messages(thread_id: str, user_id: int, messages: List[tuple[str, str]]) -> int:
+    """Index the `(role, content)` messages of a thread past the indexed prefix; returns how many were added."""
+    shard = shard_for_user(user_id)
+    with shard.search_lock:
+        shard.search_conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = shard.search_conn.execute("SELECT indexed FROM chat_search_progress WHERE thread_id=?", (thread_id,)).fetchone()
+            start = row['indexed'] if row else 0
+            rows = [
+                (content, _owner_token(user_id), thread_id, role, position)
+                for position, (role, content) in enumerate(messages)
+                if position >= start and content
+            ]
+            shard.search_conn.executemany(
+                "INSERT INTO chat_search (content, owner, thread_id, role, position) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            shard.search_conn.execute(
+                """
+                INSERT INTO chat_search_progress (thread_id, indexed) VALUES (?, ?)
+                ON CONFLICT(thread_id) DO UPDATE SET indexed=excluded.indexed
+                """,
+                (thread_id, max(start, len(messages)))
+            )
+            shard.search_conn.execute("COMMIT")
+        except BaseException:
+            shard.search_conn.execute("ROLLBACK")
+            raise
+    return len(rows)
+
+
+def index_thread_title(thread_id: str, user_id: int, title: str):
+    shard = shard_for_user(user_id)
+    with shard.search_lock:
+        shard.search_conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = shard.search_conn.execute("SELECT title_rowid FROM chat_search_progress WHERE thread_id=?", (thread_id,)).fetchone()
+            if row and row['title_rowid'] is not None:
+                shard.search_conn.execute("DELETE FROM chat_search WHERE rowid=?", (row['title_rowid'],))
+            cur = shard.search_conn.execute(
+                "INSERT INTO chat_search (content, owner, thread_id, role, position) VALUES (?, ?, ?, 'title', NULL)",
+                (title, _owner_token(user_id), thread_id)
+            )
+            shard.search_conn.execute(
+                """
+                INSERT INTO chat_search_progress (thread_id, title_rowid) VALUES (?, ?)
+                ON CONFLICT(thread_id) DO UPDATE SET title_rowid=excluded.title_rowid
+                """,
+                (thread_id, cur.lastrowid)
+            )
+            shard.search_conn.execute("COMMIT")
+        except BaseException:
+            shard.search_conn.execute("ROLLBACK")
+            raise
+
+
+def _fold(text: str) -> str:
+    # lower-case without diacritics, like the `unicode61 remove_diacritics 2` tokenizer
+    return ''.join(c for c in unicodedata.normalize('NFKD', text.lower()) if not unicodedata.combining(c))
+
+
+def _snippet(content: str, terms: List[str], size: int = 12) -> str:
+    """`size` words around the first match, matching words in **bold**."""
+    words = content.split()
+    hits = set()
+    for i, word in enumerate(words):
+        tokens = re.findall(r"\w+", _fold(word))
+        if any(token in terms[:-1] or token.startswith(terms[-1]) for token in tokens):
+            hits.add(i)
+    start = max(0, min(min(hits, default=0) - size // 3, len(words) - size))
+    window = [f"**{word}**" if start + i in hits else word for i, word in enumerate(words[start:start + size])]
+    return ('…' if start else '') + ' '.join(window) + ('…' if start + size < len(words) else '')
+
+
+def search_user_messages(user_id: int, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Best-ranked messages / titles of the user matching every word of `query` (the last one as a prefix)."""
+    terms = re.findall(r"\w+", _fold(query))
+    if not terms:
+        return []
+    # plain words only: user input never reaches the FTS5 query syntax
+    phrases = ' '.join(f'"{term}"' for term in terms[:-1])
+    match = f'owner:{_owner_token(user_id)} AND content:({phrases} "{terms[-1]}"*)'
+    shard = shard_for_user(user_id)
+    with shard.search_lock:
+        top = shard.search_conn.execute(
+            """
+            SELECT rowid, score FROM (
+                SELECT rowid, bm25(chat_search, 1.0, 0.0) AS score
+                FROM chat_search
+                WHERE chat_search MATCH ?
+                ORDER BY rowid DESC
+                LIMIT ?
+            )
+            ORDER BY score
+            LIMIT ?
+            """,
+            (match, SEARCH_WINDOW, limit)
+        ).fetchall()
+        # snippets for the winners only: FTS5's snippet() would run for the whole window
+        rows = {
+            row['rowid']: row for row in shard.search_conn.execute(
+                f"""
+                SELECT s.rowid, s.content, s.thread_id, s.role, s.position, r.thread_title
+                FROM chat_search AS s
+                LEFT JOIN chat_rooms AS r ON r.thread_id = s.thread_id
+                WHERE s.rowid IN ({','.join('?' * len(top))})
+                """,
+                tuple(row['rowid'] for row in top)
+            )
+        }
+    return [
+        {
+            'thread_id': rows[hit['rowid']]['thread_id'],
+            'thread_title': rows[hit['rowid']]['thread_title'],
+            'role': rows[hit['rowid']]['role'],
+            'position': rows[hit['rowid']]['position'],
+            'snippet': _snippet(rows[hit['rowid']]['content'], terms),
+            'score': hit['score'],
+        }
+        for hit in top
+    ]
+
+
+# ---------- Usage helpers ----------
+# Every turn appends one `usage_events` row and, in the same transaction, adds
+# itself to the user's hour and day rows of `usage_rollups` (tool calls by name
+# to the day rows of `usage_tool_rollups`). Quotas and the admin report only
+# ever read rollups, so their cost does not grow with the number of turns; the
+# raw rows are kept for audits and purged after a retention period (see
+# backend/usage.py). Buckets are UTC period starts in unix seconds.
+
+USAGE_PERIODS = {'hour': 3600, 'day': 86400}
+USAGE_COUNTERS = ('turns', 'prompt_tokens', 'completion_tokens', 'llm_calls', 'tool_calls', 'latency_ms')
+
+
+def usage_bucket(period: str, at: float) -> int:
+    return int(at // USAGE_PERIODS[period] * USAGE_PERIODS[period])
+
+
+def record_usage(user_id: int, thread_id: str, created_at: float, status: str, prompt_tokens: int,
+                 completion_tokens: int, llm_calls: int, tools: Dict[str, int], latency_ms: int):
+    counters = (1, prompt_tokens, completion_tokens, llm_calls, sum(tools.values()), latency_ms)
+    shard = shard_for_user(user_id)
+    with shard.usage_lock:
+        shard.usage_conn.execute("BEGIN IMMEDIATE")
+        try:
+            shard.usage_conn.execute(
+                """
+                INSERT INTO usage_events (user_id, thread_id, created_at, status, prompt_tokens, completion_tokens, llm_calls, tool_calls, latency_ms)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, thread_id, created_at, status, prompt_tokens, completion_tokens, llm_calls, json.dumps(tools) if tools else None, latency_ms)
+            )
+            shard.usage_conn.executemany(
+                f"""
+                INSERT INTO usage_rollups (user_id, period, bucket, {', '.join(USAGE_COUNTERS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, period, bucket) DO UPDATE SET {', '.join(f'{c} = {c} + excluded.{c}' for c in USAGE_COUNTERS)}
+                """,
+                [(user_id, period, usage_bucket(period, created_at)) + counters for period in USAGE_PERIODS]
+            )
+            shard.usage_conn.executemany(
+                """
+                INSERT INTO usage_tool_rollups (user_id, bucket, tool, calls) VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, bucket, tool) DO UPDATE SET calls = calls + excluded.calls
+                """,
+                [(user_id, usage_bucket('day', created_at), tool, calls) for tool, calls in tools.items()]
+            )
+            shard.usage_conn.execute("COMMIT")
+        except Exception:
+            shard.usage_conn.execute("ROLLBACK")
+            raise
+
+
+def get_usage_totals(user_id: int, at: float) -> Dict[str, Dict[str, int]]:
+    """The user's rollups of the hour and the day containing `at`: {'hour': {...}, 'day': {...}}."""
+    shard = shard_for_user(user_id)
+    keys = [(user_id, period, usage_bucket(period, at)) for period in USAGE_PERIODS]
+    with shard.usage_lock:
+        rows = shard.usage_conn.execute(
+            f"""
+            SELECT period, {', '.join(USAGE_COUNTERS)} FROM usage_rollups
+            WHERE (user_id = ? AND period = ? AND bucket = ?) OR (user_id = ? AND period = ? AND bucket = ?)
+            """,
+            keys[0] + keys[1]
+        ).fetchall()
+    totals = {period: dict.fromkeys(USAGE_COUNTERS, 0) for period in USAGE_PERIODS}
+    for row in rows:
+        totals[row['period']] = {c: row[c] for c in USAGE_COUNTERS}
+    return totals
+
+
+def get_usage_report(period: str, since: float) -> Dict[str, List[Dict[str, Any]]]:
+    """Rollups from `since` on, over all shards: per user, per bucket, and tool calls by name."""
+    sums = ', '.join(f'SUM({c}) AS {c}' for c in USAGE_COUNTERS)
+    start = usage_bucket(period, since)
+    users: Dict[int, Dict[str, Any]] = {}
+    series: Dict[int, Dict[str, Any]] = {}
+    tools: Dict[str, int] = {}
+
+    def add(target: Dict[str, Any], row: sqlite3.Row):
+        for c in USAGE_COUNTERS:
+            target[c] = target.get(c, 0) + row[c]
+
+    for shard in shards:
+        with shard.usage_lock:
+            user_rows = shard.usage_conn.execute(
+                f"SELECT user_id, {sums} FROM usage_rollups WHERE period = ? AND bucket >= ? GROUP BY user_id", (period, start)
+            ).fetchall()
+            bucket_rows = shard.usage_conn.execute(
+                f"SELECT bucket, {sums} FROM usage_rollups WHERE period = ? AND bucket >= ? GROUP BY bucket", (period, start)
+            ).fetchall()
+            tool_rows = shard.usage_conn.execute(
+                "SELECT tool, SUM(calls) FROM usage_tool_rollups WHERE bucket >= ? GROUP BY tool", (usage_bucket('day', since),)
+            ).fetchall()
+        for row in user_rows:
+            add(users.setdefault(row['user_id'], {'user_id': row['user_id']}), row)
+        for row in bucket_rows:
+            add(series.setdefault(row['bucket'], {'bucket': row['bucket']}), row)
+        for tool, calls in tool_rows:
+            tools[tool] = tools.get(tool, 0) + calls
+
+    return {
+        'users': sorted(users.values(), key=lambda u: u['prompt_tokens'] + u['completion_tokens'], reverse=True),
+        'series': [series[bucket] for bucket in sorted(series)],
+        'tools': [{'tool': tool, 'calls': calls} for tool, calls in sorted(tools.items(), key=lambda t: t[1], reverse=True)],
+    }
+
+
+USAGE_PURGE_BATCH = 5000
+
+
+def purge_usage(events_before: float, hourly_before: float):
+    """Drop raw usage rows older than `events_before` and hour rollups older than `hourly_before`; day rollups stay."""
+    statements = [
+        # rows are appended in time order: only the oldest ids are looked at
+        (
+            "DELETE FROM usage_events WHERE id IN (SELECT id FROM usage_events ORDER BY id LIMIT ?) AND created_at < ?",
+            events_before,
+        ),
+        (
+            """
+            DELETE FROM usage_rollups WHERE period = 'hour' AND (user_id, bucket) IN (
+                SELECT user_id, bucket FROM usage_rollups WHERE period = 'hour' AND bucket < ?2 LIMIT ?1
+            )
+            """,
+            usage_bucket('hour', hourly_before),
+        ),
+    ]
+    for shard in shards:
+        for statement, cutoff in statements:
+            # in small batches, so turns recording their usage meanwhile never wait long
+            deleted = USAGE_PURGE_BATCH
+            while deleted == USAGE_PURGE_BATCH:
+                with shard.usage_lock:
+                    deleted = shard.usage_conn.execute(statement, (USAGE_PURGE_BATCH, cutoff)).rowcount
+
+
+def get_users_by_id(user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    with conn_lock:
+        rows = conn.execute(
+            "SELECT id, first_name, last_name, email, is_admin FROM users WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(user_ids),)
+        ).fetchall()
+    return {row['id']: dict(row) for row in rows}
+
+
+# ---------- Memory helpers ----------
+# Facts remembered about a user (see backend/memory.py). Each one owns a `slot`,
+# its row in the user's vector file, and slots stay dense: when facts go, the
+# user's last facts move into the freed slots. The vector file is changed by a
+# callback inside the same transaction, so writers of one user (in any worker)
+# take turns on the shard's write lock.
+
+def get_memory_facts(user_id: int) -> List[sqlite3.Row]:
+    """The user's facts, ordered by slot."""
+    shard = shard_for_user(user_id)
+    with shard.memory_lock:
+        return shard.memory_conn.execute(
+            "SELECT slot, key, text FROM memory_facts WHERE user_id = ? ORDER BY slot", (user_id,)
+        ).fetchall()
+
+
+def save_memory_facts(user_id: int, facts: List[tuple], thread_id: Optional[str], now: float,
+                      max_facts: int, expire_before: float, write_vectors) -> Dict[str, int]:
+    """
+    Add or restate `facts` ([(key, text)]), drop facts not restated since
+    `expire_before` and the oldest beyond `max_facts`. `write_vectors(moves, writes, count)`
+    gets the slot moves [(from, to)], the slots to embed [(slot, key, text)] and the
+    new fact count, and runs before the commit. Returns counts of what changed.
+    """
+    shard = shard_for_user(user_id)
+    facts = dict(facts)
+    with shard.memory_lock:
+        shard.memory_conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = {
+                row['key']: row for row in shard.memory_conn.execute(
+                    "SELECT slot, key, text, updated_at FROM memory_facts WHERE user_id = ?", (user_id,)
+                )
+            }
+            changed = [(rows[key]['slot'], key, text) for key, text in facts.items() if key in rows and rows[key]['text'] != text]
+            new = [key for key in facts if key not in rows]
+            kept = [row for key, row in rows.items() if key not in facts]
+            evicted = [row for row in kept if row['updated_at'] < expire_before]
+            kept = sorted((row for row in kept if row['updated_at'] >= expire_before), key=lambda row: row['updated_at'])
+            overflow = len(kept) + len(facts) - max_facts
+            if overflow > 0:
+                evicted += kept[:overflow]
+            count = len(rows) - len(evicted) + len(new)
+
+            # new facts take freed slots first; survivors beyond the new count fill the rest
+            free = sorted(row['slot'] for row in evicted)
+            next_slot = len(rows)
+            added = []
+            for key in new:
+                if free:
+                    slot = free.pop(0)
+                else:
+                    slot, next_slot = next_slot, next_slot + 1
+                added.append((slot, key, facts[key]))
+            used = ({row['slot'] for row in rows.values()} - {row['slot'] for row in evicted}) | {slot for slot, _, _ in added}
+            high = sorted(slot for slot in used if slot >= count)
+            moves = [(high.pop(), hole) for hole in free if hole < count]
+            moved = dict(moves)
+            writes = [(moved.get(slot, slot), key, text) for slot, key, text in changed] + added
+
+            shard.memory_conn.executemany(
+                "DELETE FROM memory_facts WHERE user_id = ? AND slot = ?", [(user_id, row['slot']) for row in evicted]
+            )
+            shard.memory_conn.executemany(
+                "UPDATE memory_facts SET slot = ? WHERE user_id = ? AND slot = ?", [(to, user_id, frm) for frm, to in moves]
+            )
+            shard.memory_conn.executemany(
+                "UPDATE memory_facts SET text = ?, thread_id = ?, updated_at = ? WHERE user_id = ? AND key = ?",
+                [(text, thread_id, now, user_id, key) for key, text in facts.items() if key in rows]
+            )
+            shard.memory_conn.executemany(
+                "INSERT INTO memory_facts (user_id, slot, key, text, thread_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(user_id, slot, key, text, thread_id, now, now) for slot, key, text in added]
+            )
+            write_vectors(moves, writes, count)
+            shard.memory_conn.execute("COMMIT")
+        except Exception:
+            shard.memory_conn.execute("ROLLBACK")
+            raise
+    return {'added': len(new), 'updated': len(changed), 'evicted': len(evicted), 'count': count}
+
+
 def get_connection():
     return conn
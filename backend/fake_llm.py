@@ -0,0 +1,110 @@
+import json, re, time, uuid
+from typing import Any, Iterator, Optional, List
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+# ----------------
+# Fake chat model
+# ----------------
+# Offline, deterministic stand-in for ChatOpenAI. Enabled with CHATBOT_FAKE_LLM=1
+# so load tests and benchmarks exercise the real graph, tools and checkpointer
+# without spending tokens. Only local tools are ever requested.
+
+_ARITHMETIC = re.compile(r"(-?\d+(?:\.\d+)?)\s*([+\-*/%^])\s*(-?\d+(?:\.\d+)?)")
+_OPERATIONS = {'+': 'add', '-': 'sub', '*': 'mul', '/': 'div', '%': 'mod', '^': 'pow'}
+_FILLER = (
+    "Here is a clear and practical answer to your question with enough detail "
+    "to be useful while staying concise and easy to follow for the reader"
+).split()
+
+
+class FakeChatModel(BaseChatModel):
+    first_token_latency: float = 0.05
+    token_latency: float = 0.005
+    answer_words: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    # ---------- response planning ----------
+
+    def _plan(self, messages: List[BaseMessage]) -> AIMessage:
+        if messages and 'chatroom title' in str(messages[0].content):
+            return AIMessage(content="Quick Question About Things")
+
+        last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+        tool_results = [m for m in messages[last_human + 1:] if isinstance(m, ToolMessage)]
+        if tool_results:
+            return AIMessage(content=self._answer(f"The tool returned {tool_results[-1].content[:80]}."))
+
+        text = str(messages[last_human].content).lower() if last_human >= 0 else ''
+        tool_call = self._tool_call(text)
+        if tool_call:
+            return AIMessage(content='', tool_calls=[tool_call])
+        return AIMessage(content=self._answer())
+
+    def _tool_call(self, text: str) -> Optional[dict]:
+        call_id = f"call_{uuid.uuid4().hex[:12]}"
+        if match := _ARITHMETIC.search(text):
+            first, op, second = match.groups()
+            args = {'first_num': float(first), 'second_num': float(second), 'operation': _OPERATIONS[op]}
+            return {'name': 'calculator', 'args': args, 'id': call_id}
+        if 'bmi' in text:
+            return {'name': 'calculate_bmi', 'args': {'height': 1.75, 'weight': 70.0}, 'id': call_id}
+        if 'time' in text or 'date' in text:
+            return {'name': 'current_datetime', 'args': {}, 'id': call_id}
+        if 'radian' in text or 'degree' in text:
+            args = {'value': 90.0, 'frm': 'deg', 'to': 'rad'}
+            return {'name': 'mathematical_conversions', 'args': args, 'id': call_id}
+        return None
+
+    @staticmethod
+    def _usage(messages: List[BaseMessage], message: AIMessage) -> dict:
+        # ~4 characters per token, like the estimate in backend/llm_cache.py
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        output_tokens = (len(str(message.content)) + len(json.dumps(message.tool_calls))) // 4
+        return {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens}
+
+    def _answer(self, prefix: str = '') -> str:
+        words = [_FILLER[i % len(_FILLER)] for i in range(self.answer_words)]
+        return (prefix + ' ' + ' '.join(words)).strip() + '.'
+
+    # ---------- BaseChatModel ----------
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        message = self._plan(messages)
+        message.usage_metadata = self._usage(messages, message)
+        time.sleep(self.first_token_latency + self.token_latency * len(str(message.content).split()))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        message = self._plan(messages)
+        time.sleep(self.first_token_latency)
+
+        if message.tool_calls:
+            tool_call_chunks = [
+                {'name': tc['name'], 'args': json.dumps(tc['args']), 'id': tc['id'], 'index': i}
+                for i, tc in enumerate(message.tool_calls)
+            ]
+            usage = self._usage(messages, message)
+            yield ChatGenerationChunk(message=AIMessageChunk(content='', tool_call_chunks=tool_call_chunks, usage_metadata=usage))
+            return
+
+        for token in re.split(r"(\s)", str(message.content)):
+            if not token:
+                continue
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            if not token.isspace():
+                time.sleep(self.token_latency)
+        # token counts arrive in a last, empty chunk, as with stream_usage on ChatOpenAI
+        yield ChatGenerationChunk(message=AIMessageChunk(content='', usage_metadata=self._usage(messages, message)))
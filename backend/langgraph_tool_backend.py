@@ -1,22 +1,54 @@
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, BaseMessage, ToolMessage
-from langchain_openai import ChatOpenAI
 from langgraph.prebuilt import ToolNode, tools_condition
 from .tools import *
 from .db import *
+from .cancellation import CancellationToken, invoke_cancellable, cancellable_tool_call
+from .admission import admit, AdmissionError, INTERACTIVE, BACKGROUND
+from .models import build_tier, pick_tier
+from .llm_cache import llm_cache
+from .sharding import build_checkpointer
+from .archive import ensure_thread_hot
+from .tool_budget import shape_tool_result
+from .usage import TurnUsage, get_turn_usage, check_quota
+from .speculation import ToolSpeculation, new_speculation, get_speculation
+from .memory import recall, remember_turn, memory_prompt
+from .profiling import TurnProfile, new_profile, get_profile, attach, attached, profiled
+from langchain_core.language_models.chat_models import BaseChatModel
 from typing import TypedDict, Annotated, Generator
 from dotenv import load_dotenv
-import os
+import os, threading
 
 load_dotenv()
 
+_build_lock = threading.RLock()
+
+
+def once_per_process(build):
+    """Build on first call and return the same object afterwards; concurrent first callers wait for one build."""
+    built = []
+
+    def get():
+        if not built:
+            with _build_lock:
+                if not built:
+                    built.append(build())
+        return built[0]
+
+    get.__name__, get.__doc__ = build.__name__, build.__doc__
+    return get
+
+
 # --------------
 # 1. LLMs
 # --------------
-llm = ChatOpenAI()
-llm_title = ChatOpenAI()
+# Built on first use: importing langchain_openai and creating the clients is most
+# of a cold start, and sign-in, thread lists and history never need them.
+@once_per_process
+def get_llm_tiers() -> dict[str, BaseChatModel]:
+    """'fast' tier for titles and simple turns, 'strong' for tool-heavy ones (see backend/models.py)."""
+    return {tier: build_tier(tier) for tier in ('fast', 'strong')}
 
 
 # make tool lists
@@ -36,7 +68,46 @@ tools = [
     calculate_bmi, 
 ]
 
-llm_with_tools = llm.bind_tools(tools)
+@once_per_process
+def get_llm_with_tools() -> dict[str, BaseChatModel]:
+    return {tier: model.bind_tools(tools) for tier, model in get_llm_tiers().items()}
+
+# -------------
+# 2. Checkpoint durability
+# -------------
+# When a turn's checkpoints reach SQLite (see "Checkpoint durability" in the README):
+#   step  - after every step, before the next one starts
+#   async - in the background while the next step runs
+#   turn  - once, when the turn ends (including cancelled / failed turns)
+DURABILITY_MODES = {'step': 'sync', 'async': 'async', 'turn': 'exit'}
+CHECKPOINT_DURABILITY = os.getenv('CHATBOT_CHECKPOINT_DURABILITY', 'async')
+if CHECKPOINT_DURABILITY not in DURABILITY_MODES:
+    raise ValueError(f"CHATBOT_CHECKPOINT_DURABILITY must be one of {', '.join(DURABILITY_MODES)}")
+
+INTERRUPTED_TOOL_RESULT = '{"error": "The tool call was interrupted before it returned a result."}'
+
+
+def close_dangling_tool_calls(messages: list[BaseMessage]) -> list[BaseMessage]:
+    """
+    Answer tool calls that never got a result with a placeholder. A turn cut short
+    after `chat_node` asked for tools (worker crash with step / async durability, a
+    cancelled tool) leaves them in the thread, and the model API rejects them.
+    """
+    answered = {m.tool_call_id for m in messages if isinstance(m, ToolMessage)}
+    if all(call['id'] in answered for m in messages if isinstance(m, AIMessage) for call in m.tool_calls):
+        return messages
+    closed, pending = [], []
+    for message in messages:
+        if pending and not isinstance(message, ToolMessage):
+            closed.extend(pending)
+            pending = []
+        closed.append(message)
+        if isinstance(message, AIMessage):
+            pending = [
+                ToolMessage(content=INTERRUPTED_TOOL_RESULT, tool_call_id=call['id'], name=call['name'])
+                for call in message.tool_calls if call['id'] not in answered
+            ]
+    return closed + pending
 
 # -------------
 # 3. State
@@ -47,7 +118,7 @@ class ChatState(TypedDict):
 # --------------
 # 4. Nodes
 # --------------
-def chat_node(state: ChatState) -> ChatState:
+def chat_node(state: ChatState, config) -> ChatState:
     # take user querry from state
     messages = state['messages']
     if not isinstance(messages[0], SystemMessage):
@@ -64,8 +135,31 @@ def chat_node(state: ChatState) -> ChatState:
             )
         )
 
-    # send to llm_with_tools
-    response = llm_with_tools.invoke(messages)
+    messages = close_dangling_tool_calls(messages)
+
+    # what the user said in other threads and bears on this question, for this call only (see backend/memory.py)
+    question = next((m.text for m in reversed(messages) if isinstance(m, HumanMessage)), '')
+    if facts := recall(config['configurable']['user_id'], question):
+        messages = [SystemMessage(content=f"{messages[0].content}\n\n{memory_prompt(facts)}"), *messages[1:]]
+
+    # likely tool calls of a new question start now, while the model decides (see backend/speculation.py)
+    speculation = get_speculation(config)
+    if speculation and isinstance(messages[-1], HumanMessage):
+        speculation.start(messages[-1].text)
+
+    # send to llm_with_tools once admitted (aborted promptly if the turn is cancelled),
+    # unless the same request was answered before
+    model = get_llm_with_tools()[pick_tier(messages)]
+
+    def call_llm():
+        with admit(config, INTERACTIVE):
+            return invoke_cancellable(model, messages, config)
+
+    response = llm_cache.call(model, messages, call_llm)
+    if usage := get_turn_usage(config):
+        usage.add_llm_response(response)
+    if speculation:
+        speculation.settle(response.tool_calls)
 
     # response store state
     return {'messages': [response]}
@@ -98,13 +192,37 @@ Return only the title text.
         *initial_chats
     ]
 
-    title = llm_title.invoke(prompt).content.strip()
+    # titles yield to interactive turns; when the LLM is saturated skip it, the next turn retries
+    llm_title = get_llm_tiers()['fast']
+
+    def call_llm():
+        with admit(config, BACKGROUND):
+            return invoke_cancellable(llm_title, prompt, config)
+
+    try:
+        response = llm_cache.call(llm_title, prompt, call_llm)
+    except AdmissionError:
+        return state
+    if usage := get_turn_usage(config):
+        usage.add_llm_response(response)
+    title = response.content.strip()
     cleaned = ''.join(c for c in title if c.isalnum() or c in {' ', '-', '?'})
     set_thread_title(thread_id, user_id, cleaned.strip())
 
     return state
 
-tool_node = ToolNode(tools)
+def tool_call(request, execute):
+    if usage := get_turn_usage(request.runtime.config):
+        usage.add_tool_call(request.tool_call['name'])
+    # served from the turn's speculative calls when one of them was this call
+    if speculation := get_speculation(request.runtime.config):
+        execute = speculation.serve(execute)
+    # abandoned mid-flight when the turn is cancelled; the result is projected and
+    # held to the per-message budget before it enters the thread (see backend/tool_budget.py)
+    with attach(get_profile(request.runtime.config)):
+        return shape_tool_result(cancellable_tool_call(request, execute))
+
+tool_node = ToolNode(tools, wrap_tool_call=tool_call)
 
 # -------------
 # 5. SqlLite
@@ -113,44 +231,58 @@ tool_node = ToolNode(tools)
 init_db()
 
 
-checkpointer = SqliteSaver(conn=conn)
-graph = StateGraph(ChatState)
+# one saver per storage shard, routed by user_id (see backend/sharding.py)
+checkpointer = build_checkpointer()
 
-graph.add_node("generate_title", generate_title_node)
-graph.add_node("chat_node", chat_node)
-graph.add_node("tools", tool_node)
 
-graph.add_edge(START, "chat_node")
+@once_per_process
+def get_chatbot():
+    """The compiled chat graph."""
+    graph = StateGraph(ChatState)
 
-# # 1️⃣ Conditional routing for titles
-graph.add_conditional_edges(
-    START,
-    check_title_condition,
-    {
-        "generate_title": "generate_title",
-        "skip_title": END,
-    }
-)
+    # nodes of a profiled turn are sampled with it (see backend/profiling.py)
+    graph.add_node("generate_title", attached(generate_title_node))
+    graph.add_node("chat_node", attached(chat_node))
+    graph.add_node("tools", tool_node)
 
-# 2️⃣ Conditional routing for tools (FIX)
-graph.add_conditional_edges(
-    "chat_node",
-    tools_condition,
-)
+    graph.add_edge(START, "chat_node")
 
-# 3️⃣ Flow
-graph.add_edge("tools", "chat_node")
-graph.add_edge("chat_node", END)
-graph.add_edge("generate_title", END)
+    # # 1️⃣ Conditional routing for titles
+    graph.add_conditional_edges(
+        START,
+        check_title_condition,
+        {
+            "generate_title": "generate_title",
+            "skip_title": END,
+        }
+    )
+
+    # 2️⃣ Conditional routing for tools (FIX)
+    graph.add_conditional_edges(
+        "chat_node",
+        tools_condition,
+    )
 
-chatbot = graph.compile(checkpointer=checkpointer)
+    # 3️⃣ Flow
+    graph.add_edge("tools", "chat_node")
+    graph.add_edge("chat_node", END)
+    graph.add_edge("generate_title", END)
 
+    return graph.compile(checkpointer=checkpointer)
 
-def get_config(thread_id: str, user_id: int):
+
+def get_config(
+    thread_id: str, user_id: int, cancel_token: CancellationToken | None = None, usage: TurnUsage | None = None,
+    speculation: ToolSpeculation | None = None, profile: TurnProfile | None = None,
+):
     config =  {
         'configurable': {
             'thread_id': thread_id,
-            'user_id': user_id
+            'user_id': user_id,
+            'cancel_token': cancel_token,
+            'usage': usage,
+            'speculation': speculation,
+            'profile': profile
         },
         'metadata': {
             'thread_id': thread_id.capitalize,
@@ -161,32 +293,68 @@ def get_config(thread_id: str, user_id: int):
 
     return config
 
-def get_chat_response(user_message: str, thread_id: str, user_id: int) -> str:
-
-    config = get_config(thread_id, user_id)
-    response = chatbot.invoke(
-        {'messages': [HumanMessage(content=user_message)]},
-        config=config
-    )
+def get_chat_response(
+    user_message: str, thread_id: str, user_id: int, cancel_token: CancellationToken | None = None, profile: bool = False
+) -> str:
+
+    check_quota(user_id)
+    ensure_thread_hot(thread_id, user_id)
+    usage = TurnUsage(user_id, thread_id)
+    speculation = new_speculation(cancel_token)
+    # profile=True, or an admin profiling this user's turns (see backend/profiling.py)
+    turn_profile = new_profile(user_id, thread_id, requested=profile)
+    config = get_config(thread_id, user_id, cancel_token, usage, speculation, turn_profile)
+    try:
+        with profiled(turn_profile):
+            response = get_chatbot().invoke(
+                {'messages': [HumanMessage(content=user_message)]},
+                config=config,
+                durability=DURABILITY_MODES[CHECKPOINT_DURABILITY]
+            )
+    except BaseException:
+        usage.record('cancelled' if cancel_token and cancel_token.cancelled else 'error')
+        raise
+    finally:
+        if speculation:
+            speculation.close()
+    usage.record('done')
     assistant_message = response['messages'][-1].content
+    index_chat_thread(thread_id, user_id, response['messages'])
+    remember_turn(user_id, thread_id, user_message)
     return assistant_message
 
-def get_chat_stream(user_message: str, thread_id: str, user_id: int) -> Generator:
+def get_chat_stream(
+    user_message: str, thread_id: str, user_id: int, cancel_token: CancellationToken | None = None, usage: TurnUsage | None = None,
+    profile: TurnProfile | None = None,
+) -> Generator:
+    # a `profile` is sampled while the caller consumes the stream inside profiled(profile)
+    ensure_thread_hot(thread_id, user_id)
+    speculation = new_speculation(cancel_token)
+    config = get_config(thread_id, user_id, cancel_token, usage, speculation, profile)
 
-    config = get_config(thread_id, user_id)
-
-    stream = chatbot.stream(
+    stream = get_chatbot().stream(
         { 'messages': [HumanMessage(content=user_message)] },
         config=config,
-        stream_mode='messages'
+        stream_mode='messages',
+        durability=DURABILITY_MODES[CHECKPOINT_DURABILITY]
     )
 
-    return stream
+    return _closing_speculation(stream, speculation)
+
+def _closing_speculation(stream: Generator, speculation) -> Generator:
+    # the turn's speculative tool calls are dropped however the stream ends:
+    # exhausted, failed, or closed by the caller (stream.close() reaches the graph's stream too)
+    try:
+        yield from stream
+    finally:
+        if speculation:
+            speculation.close()
 
 def get_chat_history(thread_id: str, user_id: int):
+    ensure_thread_hot(thread_id, user_id)
     config = get_config(thread_id, user_id)
 
-    state = chatbot.get_state(config=config)
+    state = get_chatbot().get_state(config=config)
     messages = state.values.get('messages', [])
 
     history = [
@@ -200,3 +368,19 @@ def get_chat_history(thread_id: str, user_id: int):
 
     return history
 
+
+def index_chat_thread(thread_id: str, user_id: int, messages: list[BaseMessage] | None = None):
+    """Add the thread's messages that are not indexed yet to the search index (see search_user_messages)."""
+    if messages is None:
+        messages = get_chatbot().get_state(config=get_config(thread_id, user_id)).values.get('messages', [])
+    index_thread_messages(thread_id, user_id, [
+        ('user' if isinstance(msg, HumanMessage) else 'assistant', msg.text)
+        for msg in messages
+        if isinstance(msg, (HumanMessage, AIMessage))
+    ])
+
+
+def warm_up():
+    """Build the graph and the LLM clients now rather than on the first turn."""
+    get_chatbot()
+    get_llm_with_tools()
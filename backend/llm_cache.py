@@ -0,0 +1,173 @@
+import hashlib, json, os, threading, uuid
+from typing import Any, Callable, List, Optional
+from cachetools import TTLCache
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage, message_to_dict, messages_from_dict
+from langchain_core.runnables import RunnableBinding
+from .db import get_cached_response, set_cached_response, purge_cached_responses
+
+# ----------------
+# LLM response cache
+# ----------------
+# The same opening question (and the same title prompt) recurs across users, and
+# UI reruns retry identical requests. Responses are cached under a hash of the
+# normalized message list, the bound tools and the model parameters: first in an
+# in-process LRU with TTL, then in the `llm_cache` table shared by all workers.
+# Turns involving time-sensitive tools are never served from or written to it.
+
+ENABLED = os.getenv('CHATBOT_LLM_CACHE', '1').lower() not in ('0', 'false', 'no', 'off')
+MEMORY_SIZE = int(os.getenv('CHATBOT_LLM_CACHE_SIZE', '1024'))
+MEMORY_TTL = float(os.getenv('CHATBOT_LLM_CACHE_TTL', '3600'))
+DB_TTL = float(os.getenv('CHATBOT_LLM_CACHE_DB_TTL', '86400'))
+PURGE_EVERY = 500
+
+TIME_SENSITIVE_TOOLS = {'current_datetime', 'get_weather', 'get_stock_price'}
+
+
+# ---------- Keys ----------
+
+def _normalize_content(content) -> Any:
+    if isinstance(content, str):
+        return ' '.join(content.split())
+    return content
+
+
+def _normalize_message(message: BaseMessage) -> dict:
+    # message / tool call ids differ on every request and carry no meaning for the answer
+    normalized = {'type': message.type, 'content': _normalize_content(message.content)}
+    if isinstance(message, AIMessage) and message.tool_calls:
+        normalized['tool_calls'] = [{'name': tc['name'], 'args': tc['args']} for tc in message.tool_calls]
+    if isinstance(message, ToolMessage):
+        normalized['name'] = message.name
+    return normalized
+
+
+def _model_fingerprint(model) -> dict:
+    kwargs = {}
+    while isinstance(model, RunnableBinding):
+        kwargs = {**model.kwargs, **kwargs}
+        model = model.bound
+    return {'type': model._llm_type, 'params': model._identifying_params, 'kwargs': kwargs}
+
+
+def cache_key(model, messages: List[BaseMessage]) -> str:
+    payload = {'model': _model_fingerprint(model), 'messages': [_normalize_message(m) for m in messages]}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _called_tools(messages: List[BaseMessage]) -> set[str]:
+    names = set()
+    for message in messages:
+        if isinstance(message, AIMessage):
+            names.update(tc['name'] for tc in message.tool_calls)
+        elif isinstance(message, ToolMessage) and message.name:
+            names.add(message.name)
+    return names
+
+
+def is_time_sensitive(messages: List[BaseMessage]) -> bool:
+    """True if the current turn (since the last user message) used a time-sensitive tool."""
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+    return bool(_called_tools(messages[last_human + 1:]) & TIME_SENSITIVE_TOOLS)
+
+
+def _count_tokens(messages: List[BaseMessage], response: AIMessage) -> int:
+    if response.usage_metadata:
+        return response.usage_metadata.get('total_tokens', 0)
+    # rough estimate (~4 characters per token) for models that report no usage
+    chars = sum(len(str(m.content)) for m in messages) + len(str(response.content))
+    return chars // 4
+
+
+def _fresh_copy(response: AIMessage) -> AIMessage:
+    """A cached response must not reuse message / tool call ids (add_messages would overwrite by id)."""
+    message = messages_from_dict([message_to_dict(response)])[0]
+    message.id = None
+    message.usage_metadata = None
+    message.response_metadata = {**message.response_metadata, 'cache_hit': True}
+    if message.tool_calls:
+        message.tool_calls = [{**tc, 'id': f'call_{uuid.uuid4().hex[:24]}'} for tc in message.tool_calls]
+        message.additional_kwargs.pop('tool_calls', None)
+    return message
+
+
+# ---------- Cache ----------
+
+class LLMCache:
+    def __init__(self, size: int, ttl: float, db_ttl: float):
+        self.memory: TTLCache = TTLCache(maxsize=size, ttl=ttl)
+        self.db_ttl = db_ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.tokens_saved = 0
+
+    def get(self, key: str) -> Optional[AIMessage]:
+        with self._lock:
+            entry = self.memory.get(key)
+        if entry is None:
+            row = get_cached_response(key, self.db_ttl)
+            if row is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            entry = (messages_from_dict([json.loads(row[0])])[0], row[1])
+            with self._lock:
+                self.memory[key] = entry
+                self.db_hits += 1
+        else:
+            with self._lock:
+                self.memory_hits += 1
+        response, tokens = entry
+        with self._lock:
+            self.tokens_saved += tokens
+        return _fresh_copy(response)
+
+    def put(self, key: str, messages: List[BaseMessage], response: AIMessage):
+        tokens = _count_tokens(messages, response)
+        with self._lock:
+            self.memory[key] = (response, tokens)
+            self._writes += 1
+            purge = self._writes % PURGE_EVERY == 0
+        set_cached_response(key, json.dumps(message_to_dict(response), default=str), tokens)
+        if purge:
+            purge_cached_responses(self.db_ttl)
+
+    def call(self, model, messages: List[BaseMessage], invoke: Callable[[], AIMessage]) -> AIMessage:
+        """Return the cached response for (model, messages) or run `invoke` and cache its result."""
+        if not ENABLED:
+            return invoke()
+        if is_time_sensitive(messages):
+            with self._lock:
+                self.bypassed += 1
+            return invoke()
+
+        key = cache_key(model, messages)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        response = invoke()
+        if isinstance(response, AIMessage) and not _called_tools([response]) & TIME_SENSITIVE_TOOLS:
+            self.put(key, messages, response)
+        return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.db_hits
+            lookups = hits + self.misses
+            return {
+                'enabled': ENABLED,
+                'entries': len(self.memory),
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_ratio': hits / lookups if lookups else 0.0,
+                'tokens_saved': self.tokens_saved,
+            }
+
+
+llm_cache = LLMCache(MEMORY_SIZE, MEMORY_TTL, DB_TTL)
@@ -0,0 +1,266 @@
+import hashlib, os, re, threading, time, zlib
+from typing import Optional
+import numpy as np
+from cachetools import LRUCache
+from .db import DB_PATH, get_memory_facts, save_memory_facts
+from .speculation import TICKER, NOT_TICKERS
+
+# ----------------
+# Long-term memory
+# ----------------
+# Short facts users state about themselves (where they live, the tickers they
+# hold, the units they want, anything they ask to be remembered) are picked out
+# of their messages after each turn and kept per user_id, across threads;
+# chat_node adds the TOP_K facts closest to the question to its system message.
+# Facts are embedded locally, without a model or a network call, as sparse
+# unit vectors over hashed words and word pairs (plus a few hint words per kind
+# of fact, so that "weather tomorrow?" finds where the user lives). A user's
+# vectors are one file in MEMORY_DIR of fixed-size rows (row = the fact's slot
+# in `memory_facts`) that is written row by row. Every process keeps recently
+# used users in memory as NumPy postings sorted by feature hash and reloads a
+# file only after it changed; a query looks its features up with searchsorted
+# and adds up exact cosine scores with bincount. Sparse rather than dense:
+# squeezed into a few hundred dimensions, words that share a bucket drown a
+# one-word match (the city fact for "weather tomorrow?") among thousands of
+# facts.
+
+ENABLED = os.getenv('CHATBOT_MEMORY', '1').lower() not in ('0', 'false', 'no', 'off')
+MEMORY_DIR = os.getenv('CHATBOT_MEMORY_DIR', os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'memory'))
+TOP_K = int(os.getenv('CHATBOT_MEMORY_TOP_K', '5'))
+MIN_SCORE = float(os.getenv('CHATBOT_MEMORY_MIN_SCORE', '0.15'))
+MAX_FACTS = int(os.getenv('CHATBOT_MEMORY_MAX_FACTS', '2000'))
+FACT_TTL = float(os.getenv('CHATBOT_MEMORY_TTL_DAYS', '365')) * 86400
+CACHE_BYTES = int(float(os.getenv('CHATBOT_MEMORY_CACHE_MB', '64')) * 2**20)
+
+FEATURES = 64  # per fact, words before word pairs
+ROW = np.dtype([('hash', '<u4', (FEATURES,)), ('weight', '<f4', (FEATURES,))])  # unused features weigh 0
+
+# words a kind of fact is about: embedded with it, never shown to the model
+HINTS = {
+    'city': 'weather forecast temperature rain raining local time',
+    'ticker': 'stock stocks shares price portfolio',
+    'units': 'units convert conversion',
+    'name': 'name',
+    'job': 'work job',
+    'note': '',
+}
+
+
+# ---------- Embeddings ----------
+
+_WORD = re.compile(r"[^\W_]+")
+_STOPWORDS = frozenset(
+    'a an and are as at be can do does for from how i in is it me my of on or please '
+    'the that this to user what whats when where which who why will with you your asked remember'.split()
+)
+
+
+def _words(text: str) -> list[str]:
+    return [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+
+
+def features(text: str, hints: str = '') -> dict[str, float]:
+    """Words and word pairs of `text`, plus the words of `hints`, with their weights."""
+    words = _words(text)
+    weights = dict.fromkeys(words + _words(hints), 1.0)
+    # word pairs count half, so a question of a few words is not drowned out by them
+    weights.update(dict.fromkeys((f'{a} {b}' for a, b in zip(words, words[1:])), 0.5))
+    return weights
+
+
+def embed(weights: dict[str, float], limit: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+    """Sparse unit vector of a feature set: (feature hashes, weights)."""
+    items = list(weights.items())[:limit]
+    hashes = np.fromiter((zlib.crc32(feature.encode()) for feature, _ in items), dtype=np.uint32, count=len(items))
+    values = np.fromiter((weight for _, weight in items), dtype=np.float32, count=len(items))
+    norm = np.linalg.norm(values)
+    return hashes, values / norm if norm else values
+
+
+def _fact_row(key: str, text: str) -> bytes:
+    hashes, values = embed(_fact_features(key, text), FEATURES)
+    row = np.zeros(1, dtype=ROW)
+    row['hash'][0, :len(hashes)] = hashes
+    row['weight'][0, :len(values)] = values
+    return row.tobytes()
+
+
+def _fact_features(key: str, text: str) -> dict[str, float]:
+    return features(text, HINTS[key.split(':')[0]])
+
+
+# ---------- Facts ----------
+
+_SENTENCE = re.compile(r"[^.!?\n]+[.!?]?")
+_PROPER = r"[A-Z][\w'-]*(?:\s+[A-Z][\w'-]*){0,3}"
+# (kind, pattern on one sentence, fact text); only proper nouns count as places and names
+_PATTERNS = [
+    ('city', re.compile(
+        rf"(?i:\bI(?:'m| am)?\s+(?:live|living|based|located|staying)\s+in|\bmy (?:home ?town|city) is|\bI(?:'m| am) from)\s+(?P<value>{_PROPER})"
+    ), 'The user lives in {value}'),
+    ('name', re.compile(rf"(?i:\bmy name is|\bcall me)\s+(?P<value>{_PROPER})"), "The user's name is {value}"),
+    ('job', re.compile(r"(?i:\bI work\s+(?P<prep>as an?|at|for)\s+(?P<value>[\w&' -]{2,60}))"), 'The user works {prep} {value}'),
+    ('units', re.compile(
+        r"(?i:\b(?:I (?:prefer|use|want)|please (?:always )?use|always use)\s+(?:the\s+)?(?P<value>metric|imperial|celsius|fahrenheit)\b)"
+    ), 'The user prefers {value} units'),
+]
+_HOLDINGS = re.compile(r"(?i:\bI (?:own|hold|bought|have shares of|am long)\b|\bmy (?:portfolio|holdings|positions|stocks)\b)")
+_REMEMBER = re.compile(r"(?i:^\s*(?:please\s+)?remember(?:\s+that)?)\s+(?P<value>.{3,200}?)[\s.!]*$")
+
+
+def extract_facts(text: str) -> list[tuple[str, str]]:
+    """Durable facts stated in a user message, as (key, text); a newer fact with the same key replaces the older."""
+    facts: dict[str, str] = {}
+    for sentence in _SENTENCE.findall(text):
+        sentence = sentence.strip()
+        if not sentence or sentence.endswith('?'):
+            continue  # questions state nothing
+        for kind, pattern, template in _PATTERNS:
+            if match := pattern.search(sentence):
+                values = {name: ' '.join(value.split()) for name, value in match.groupdict().items()}
+                facts[kind] = template.format(**values)
+        if _HOLDINGS.search(sentence):
+            for match in TICKER.finditer(sentence):
+                if match['cashtag'] or match['symbol'] not in NOT_TICKERS:
+                    symbol = (match['cashtag'] or match['symbol']).upper()
+                    facts[f'ticker:{symbol}'] = f'The user holds {symbol} stock'
+        if match := _REMEMBER.match(sentence):
+            note = ' '.join(match['value'].split())
+            digest = hashlib.blake2b(note.lower().encode(), digest_size=8).hexdigest()
+            facts[f'note:{digest}'] = f'The user asked you to remember: {note}'
+    return list(facts.items())
+
+
+# ---------- Index ----------
+
+class _UserIndex:
+    def __init__(self, stamp: tuple, rows: np.ndarray, texts: list[str]):
+        self.stamp = stamp
+        self.texts = texts
+        slots = np.repeat(np.arange(len(rows), dtype=np.int32), FEATURES)
+        hashes, weights = rows['hash'].ravel(), rows['weight'].ravel()
+        used = weights != 0
+        order = np.argsort(hashes[used], kind='stable')
+        self.hashes = hashes[used][order]
+        self.slots = slots[used][order]
+        self.weights = weights[used][order]
+
+    @property
+    def nbytes(self) -> int:
+        return self.hashes.nbytes + self.slots.nbytes + self.weights.nbytes
+
+    def scores(self, hashes: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """Cosine of every fact with a query vector."""
+        lo = np.searchsorted(self.hashes, hashes, 'left')
+        hi = np.searchsorted(self.hashes, hashes, 'right')
+        spans = hi - lo
+        if not spans.any():
+            return np.zeros(len(self.texts), dtype=np.float32)
+        postings = np.concatenate([np.arange(a, b) for a, b in zip(lo.tolist(), hi.tolist()) if b > a])
+        return np.bincount(
+            self.slots[postings], weights=self.weights[postings] * np.repeat(weights, spans), minlength=len(self.texts)
+        )
+
+
+# sized by the bytes of the postings it holds
+_indexes: LRUCache = LRUCache(maxsize=CACHE_BYTES, getsizeof=lambda index: index.nbytes + 1)
+_indexes_lock = threading.Lock()
+
+
+def _path(user_id: int) -> str:
+    return os.path.join(MEMORY_DIR, f'user_{user_id}.vec')
+
+
+def _stamp(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _load(user_id: int) -> Optional[_UserIndex]:
+    path = _path(user_id)
+    stamp = _stamp(path)
+    if stamp is None:
+        return None  # nothing remembered yet
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+    if index is not None and index.stamp == stamp:
+        return index
+
+    texts = [row['text'] for row in get_memory_facts(user_id)]
+    data = np.fromfile(path, dtype=ROW)
+    rows = np.zeros(len(texts), dtype=ROW)  # a fact without its row (crash mid-write) scores 0
+    rows[:min(len(texts), len(data))] = data[:len(texts)]
+    index = _UserIndex(stamp, rows, texts)
+    # a writer that changed the file meanwhile may not have committed yet: use this copy once, load again next time
+    if _stamp(path) == stamp:
+        with _indexes_lock:
+            _indexes[user_id] = index
+    return index
+
+
+def recall(user_id: int, query: str, k: int = TOP_K) -> list[str]:
+    """The user's facts closest to `query`, best first: at most `k`, none scoring below MIN_SCORE."""
+    if not ENABLED or not query or k < 1:
+        return []
+    index = _load(user_id)
+    if index is None or not index.texts:
+        return []
+    hashes, weights = embed(features(query))
+    if not len(hashes):
+        return []
+    scores = index.scores(hashes, weights)
+    top = np.argpartition(-scores, k)[:k] if len(scores) > k else np.arange(len(scores))
+    top = top[np.argsort(-scores[top])]
+    return [index.texts[slot] for slot in top.tolist() if scores[slot] >= MIN_SCORE]
+
+
+def remember(user_id: int, thread_id: Optional[str], text: str) -> Optional[dict]:
+    """Store the facts stated in a user message; returns counts of what changed, or None if it stated none."""
+    if not ENABLED:
+        return None
+    facts = extract_facts(text)
+    if not facts:
+        return None
+    path = _path(user_id)
+
+    def write_vectors(moves: list, writes: list, count: int):
+        # only the rows that changed are written
+        os.makedirs(MEMORY_DIR, exist_ok=True)
+        rows = [(slot, _fact_row(key, fact)) for slot, key, fact in writes]
+        with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as f:
+            for frm, to in moves:
+                f.seek(frm * ROW.itemsize)
+                row = f.read(ROW.itemsize)
+                f.seek(to * ROW.itemsize)
+                f.write(row.ljust(ROW.itemsize, b'\0'))
+            for slot, row in rows:
+                f.seek(slot * ROW.itemsize)
+                f.write(row)
+            f.truncate(count * ROW.itemsize)
+
+    now = time.time()
+    changes = save_memory_facts(user_id, facts, thread_id, now, MAX_FACTS, now - FACT_TTL, write_vectors)
+    # touched again once committed: readers that loaded the new rows before the commit reload
+    os.utime(path)
+    with _indexes_lock:
+        _indexes.pop(user_id, None)
+    return changes
+
+
+def remember_turn(user_id: int, thread_id: str, user_message: str):
+    """After a turn: remember what the user's message stated. Memory never fails a turn."""
+    try:
+        remember(user_id, thread_id, user_message)
+    except Exception:
+        pass
+
+
+def memory_prompt(facts: list[str]) -> str:
+    lines = '\n'.join(f'- {fact}' for fact in facts)
+    return (
+        "What you remember about the user from earlier conversations (use it when relevant, "
+        f"the user's latest messages take precedence):\n{lines}"
+    )
@@ -0,0 +1,248 @@
+import os, queue, threading, time
+from collections import deque
+from typing import Any, Iterator, List, Optional
+from langchain_core.callbacks import CallbackManager
+from langchain_core.language_models.chat_models import BaseChatModel, generate_from_stream
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langgraph.constants import TAG_NOSTREAM
+from pydantic import PrivateAttr
+from .admission import llm_admission
+
+# ----------------
+# Model tiers
+# ----------------
+# 'fast' serves titles and simple turns, 'strong' serves turns that already use
+# tools or carry long questions. Each tier has its own model name and request
+# timeout. With CHATBOT_HEDGE_MODEL set, a tier that is slower than its usual
+# time-to-first-token percentile gets a backup request to the hedge model and
+# the first one to answer wins, if the LLM admission limit has a slot to spare.
+
+TIERS = {
+    'fast': {
+        'model': os.getenv('CHATBOT_FAST_MODEL', 'gpt-4o-mini'),
+        'timeout': float(os.getenv('CHATBOT_FAST_TIMEOUT', '20')),
+    },
+    'strong': {
+        'model': os.getenv('CHATBOT_STRONG_MODEL', 'gpt-4o'),
+        'timeout': float(os.getenv('CHATBOT_STRONG_TIMEOUT', '60')),
+    },
+}
+SIMPLE_TURN_CHARS = int(os.getenv('CHATBOT_SIMPLE_TURN_CHARS', '280'))
+
+HEDGE_MODEL = os.getenv('CHATBOT_HEDGE_MODEL')
+HEDGE_PERCENTILE = float(os.getenv('CHATBOT_HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_SAMPLES = int(os.getenv('CHATBOT_HEDGE_MIN_SAMPLES', '20'))
+
+_DONE = object()
+
+
+def _child_callbacks(run_manager) -> CallbackManager:
+    """Callbacks for a model call nested in `run_manager`'s LLM run (what get_child does for chain runs)."""
+    manager = CallbackManager(
+        handlers=run_manager.inheritable_handlers,
+        inheritable_handlers=run_manager.inheritable_handlers,
+        parent_run_id=run_manager.run_id,
+        tags=run_manager.inheritable_tags,
+        inheritable_tags=run_manager.inheritable_tags,
+        metadata=run_manager.inheritable_metadata,
+        inheritable_metadata=run_manager.inheritable_metadata,
+    )
+    manager.add_tags([TAG_NOSTREAM], inherit=False)
+    return manager
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    Streams from `primary`; if it has not produced a first chunk within the
+    `hedge_percentile` of its recent time-to-first-token (or fails before that),
+    starts `fallback` on the same input and keeps whichever streams first.
+    Only the winner's chunks are yielded, so callers never see mixed output.
+    Both attempts run as child runs of this one, so callbacks (tracing, the
+    cancellation handler) see them; they are tagged nostream so langgraph's
+    `messages` stream mode only emits the winner's tokens, once.
+    """
+    primary: BaseChatModel
+    fallback: BaseChatModel
+    # The caller's admission slot covers one upstream request. A hedge is a
+    # second one running alongside, so it needs a slot of its own from
+    # `admission`, taken without queueing: when none is free the call is not
+    # hedged (hedging a saturated provider only adds load). The slot is held
+    # until the request that did not win is over. A fallback after the primary
+    # failed replaces it and reuses its slot.
+    hedge_percentile: float = 95
+    min_samples: int = 20
+    admission: Any = None
+
+    # recent time-to-first-chunk of the winning attempt
+    _latencies: deque = PrivateAttr(default_factory=lambda: deque(maxlen=200))
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    hedged: int = 0
+    hedge_wins: int = 0
+    hedges_skipped: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return f"hedged-{self.primary._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {'primary': self.primary._identifying_params, 'fallback': self.fallback._identifying_params}
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait on the primary before hedging; None until enough samples."""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if self.hedge_percentile <= 0 or len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))]
+
+    def _record(self, latency: float, hedge_won: bool):
+        with self._lock:
+            self._latencies.append(latency)
+            if hedge_won:
+                self.hedge_wins += 1
+
+    def _take_hedge_slot(self) -> bool:
+        taken = self.admission is None or self.admission.try_acquire()
+        with self._lock:
+            if taken:
+                self.hedged += 1
+            else:
+                self.hedges_skipped += 1
+        return taken
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        results: queue.Queue = queue.Queue()
+        # 'leader' streamed first: it becomes the winner, on the caller's slot
+        state = {'winner': None, 'leader': None, 'closed': False, 'hedge_slot': False}
+        lock = threading.Lock()
+        live: set[str] = set()  # attempts whose request is still out
+
+        def settle(name: str):
+            with lock:
+                live.discard(name)
+                release = state['hedge_slot'] and (not live or name != state['leader'])
+                if release:
+                    state['hedge_slot'] = False
+            if release:
+                self.admission.release()
+
+        def attempt(name: str, model: BaseChatModel):
+            try:
+                config = {'run_name': f'{self.get_name()}:{name}'}
+                if run_manager:
+                    config['callbacks'] = _child_callbacks(run_manager)
+                for chunk in model.stream(messages, config, stop=stop, **kwargs):
+                    if state['closed'] or state['winner'] not in (None, name):
+                        return
+                    if state['leader'] is None:
+                        with lock:
+                            # in the order of the queue, so the leader is the winner
+                            state['leader'] = state['leader'] or name
+                            results.put((name, ChatGenerationChunk(message=chunk)))
+                        continue
+                    results.put((name, ChatGenerationChunk(message=chunk)))
+                results.put((name, _DONE))
+            except BaseException as e:
+                results.put((name, e))
+            finally:
+                settle(name)
+
+        def launch(name: str, model: BaseChatModel):
+            running.add(name)
+            with lock:
+                live.add(name)
+            threading.Thread(target=attempt, args=(name, model), daemon=True, name=f'llm-{name}').start()
+
+        running: set[str] = set()
+        started = time.monotonic()
+        hedge_after = self.hedge_delay()
+        launch('primary', self.primary)
+        try:
+            while True:
+                timeout = None
+                if state['winner'] is None and hedge_after is not None and 'fallback' not in running:
+                    timeout = max(0.0, started + hedge_after - time.monotonic())
+                try:
+                    name, item = results.get(timeout=timeout)
+                except queue.Empty:
+                    hedge_after = None
+                    if self._take_hedge_slot():
+                        with lock:
+                            state['hedge_slot'] = self.admission is not None
+                        launch('fallback', self.fallback)
+                    continue
+
+                if state['winner'] is None:
+                    if isinstance(item, BaseException):
+                        running.discard(name)
+                        if name == 'primary' and 'fallback' not in running:
+                            launch('fallback', self.fallback)
+                        if running:
+                            continue
+                        raise item
+                    state['winner'] = name
+                    self._record(time.monotonic() - started, name == 'fallback')
+                elif name != state['winner']:
+                    continue
+
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            state['closed'] = True
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+
+def build_model(model: Optional[str], timeout: float) -> BaseChatModel:
+    if os.getenv('CHATBOT_FAKE_LLM'):
+        # offline model for load tests / benchmarks (see backend/fake_llm.py)
+        from .fake_llm import FakeChatModel
+        return FakeChatModel()
+    from langchain_openai import ChatOpenAI
+    kwargs = {'model': model} if model else {}
+    # stream_usage: streamed answers report their token counts too (see backend/usage.py)
+    return ChatOpenAI(timeout=timeout, stream_usage=True, **kwargs)
+
+
+def build_tier(name: str) -> BaseChatModel:
+    settings = TIERS[name]
+    primary = build_model(settings['model'], settings['timeout'])
+    if not HEDGE_MODEL:
+        return primary
+    return HedgedChatModel(
+        primary=primary,
+        fallback=build_model(HEDGE_MODEL, settings['timeout']),
+        hedge_percentile=HEDGE_PERCENTILE,
+        min_samples=HEDGE_MIN_SAMPLES,
+        admission=llm_admission,
+    )
+
+
+def iter_models(models) -> Iterator[BaseChatModel]:
+    """Underlying models of the given tiers (primary and hedge), e.g. to tune the fake model."""
+    for model in models:
+        if isinstance(model, HedgedChatModel):
+            yield model.primary
+            yield model.fallback
+        else:
+            yield model
+
+
+def pick_tier(messages: List[BaseMessage]) -> str:
+    """'strong' once the current turn involves tools or a long question, else 'fast'."""
+    last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+    if any(isinstance(m, ToolMessage) for m in messages[last_human + 1:]):
+        return 'strong'
+    if last_human >= 0 and len(str(messages[last_human].content)) > SIMPLE_TURN_CHARS:
+        return 'strong'
+    return 'fast'
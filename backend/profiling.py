@@ -0,0 +1,448 @@
+import contextvars, functools, glob, html, json, os, re, sys, sysconfig, threading, time, uuid, zlib
+from collections import Counter
+from concurrent.futures import _base as futures_base
+from contextlib import nullcontext
+from typing import Any, Callable, Optional
+from .db import DB_PATH, set_profile_target, get_profile_targets, claim_profile_turn
+
+# ----------------
+# Turn profiling
+# ----------------
+# A TurnProfile travels in `config['configurable']['profile']` (like the cancel
+# token) when a turn is profiled: asked for by the caller, or because an admin
+# switched profiling on for the user's next turns (`profile_targets`). While
+# any turn is profiled, one sampler thread reads the stacks of the threads
+# attached to it every INTERVAL: the thread running the turn, the graph nodes,
+# the helper threads of LLM and tool calls (see backend/cancellation.py) and
+# checkpoint serialization. Waiting for another attached thread is counted as
+# idle, not as time spent. When the turn ends the samples are saved under
+# PROFILE_DIR/<thread_id>/<run_id> as JSON (stacks plus a summary) and as an
+# SVG flame graph; scripts/profiles.py lists, shows and diffs them.
+# A turn that is not profiled pays for one ContextVar / dict lookup per hook.
+
+ENABLED = os.getenv('CHATBOT_PROFILING', '1').lower() not in ('0', 'false', 'no', 'off')
+PROFILE_DIR = os.getenv('CHATBOT_PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'profiles'))
+INTERVAL = float(os.getenv('CHATBOT_PROFILE_INTERVAL_MS', '5')) / 1000
+TARGETS_TTL = 10  # seconds between reads of the per-user switches
+MAX_DEPTH = 256  # frames kept per sample, from the innermost
+TOP = 30  # functions in a stored summary
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_current: contextvars.ContextVar[Optional['TurnProfile']] = contextvars.ContextVar('turn_profile', default=None)
+_OFF = nullcontext()
+
+
+# ---------- Sampling ----------
+
+# a thread blocked here waits for work of the turn that runs (and is sampled) elsewhere
+_WAITS = frozenset(code for code in (
+    threading.Condition.wait.__code__,
+    threading.Event.wait.__code__,
+    threading.Thread._wait_for_tstate_lock.__code__,
+))
+
+
+def _waits_for_turn(frame) -> bool:
+    if frame.f_code not in _WAITS:
+        return False
+    caller = frame.f_back
+    while caller is not None and caller.f_code in _WAITS:
+        caller = caller.f_back
+    # futures of the graph's tasks, or the helper thread of run_cancellable
+    return caller is not None and (caller.f_code.co_filename == futures_base.__file__ or caller.f_code.co_name == 'run_cancellable')
+
+
+class _Sampler:
+    """The one sampler thread of the process; runs only while some turn is profiled."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profiles: set['TurnProfile'] = set()
+        self.thread: Optional[threading.Thread] = None
+
+    def add(self, profile: 'TurnProfile'):
+        with self._lock:
+            self.profiles.add(profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, daemon=True, name='turn-profiler')
+                self.thread.start()
+
+    def remove(self, profile: 'TurnProfile'):
+        with self._lock:
+            self.profiles.discard(profile)
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if not self.profiles:
+                    self.thread = None
+                    return
+                profiles = list(self.profiles)
+            frames = sys._current_frames()
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+            time.sleep(INTERVAL)
+
+
+_sampler = _Sampler()
+
+
+class _Attached:
+    __slots__ = ('profile', 'ident', 'token')
+
+    def __init__(self, profile: 'TurnProfile'):
+        self.profile = profile
+
+    def __enter__(self):
+        self.ident = threading.get_ident()
+        with self.profile._lock:
+            self.profile.threads[self.ident] = self.profile.threads.get(self.ident, 0) + 1
+        # helpers started from here (graph tasks, checkpoint writes) find the profile in their copied context
+        self.token = _current.set(self.profile)
+
+    def __exit__(self, *exc):
+        try:
+            _current.reset(self.token)
+        except ValueError:
+            pass  # a generator closed from another context
+        with self.profile._lock:
+            count = self.profile.threads.get(self.ident, 0) - 1
+            if count > 0:
+                self.profile.threads[self.ident] = count
+            else:
+                self.profile.threads.pop(self.ident, None)
+
+
+class TurnProfile:
+    """The samples of one profiled turn."""
+
+    def __init__(self, user_id: int, thread_id: str, run_id: Optional[str] = None):
+        self.user_id = user_id
+        self.thread_id = thread_id
+        self.run_id = run_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.threads: dict[int, int] = {}  # thread ident -> attach depth
+        self.stacks: Counter = Counter()  # code objects, outermost first -> samples
+        self.idle = 0
+        self.path: Optional[str] = None
+        self.finished = False
+        _sampler.add(self)
+
+    def attach(self) -> _Attached:
+        """Sample the calling thread with the turn until the block exits."""
+        return _Attached(self)
+
+    def sample(self, frames: dict):
+        with self._lock:
+            idents = list(self.threads)
+        stacks, idle = [], 0
+        for ident in idents:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            if _waits_for_turn(frame):
+                idle += 1
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stacks.append(tuple(reversed(stack)))
+        with self._lock:
+            if not self.finished:
+                self.stacks.update(stacks)
+                self.idle += idle
+
+    def __enter__(self):
+        self._attached = self.attach()
+        self._attached.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._attached.__exit__(exc_type, exc, tb)
+        # by name: backend/cancellation.py imports this module
+        status = 'done' if exc_type is None else 'cancelled' if exc_type.__name__ == 'Cancelled' else 'error'
+        self.finish(status)
+
+    def finish(self, status: str = 'done') -> Optional[str]:
+        """Stop sampling and save the profile (once); returns the path of its JSON file. Never fails the turn."""
+        _sampler.remove(self)
+        with self._lock:
+            if self.finished:
+                return self.path
+            self.finished = True
+            stacks, idle = dict(self.stacks), self.idle
+        try:
+            self.path = save_profile(self._record(stacks, idle, status))
+        except Exception:
+            pass
+        return self.path
+
+    def _record(self, stacks: dict, idle: int, status: str) -> dict:
+        index: dict = {}
+        frames, folded = [], []
+        for stack, count in stacks.items():
+            ids = []
+            for code in stack:
+                if code not in index:
+                    index[code] = len(frames)
+                    frames.append({'function': code.co_qualname, 'module': _module(code.co_filename), 'line': code.co_firstlineno})
+                ids.append(index[code])
+            folded.append([ids, count])
+        record = {
+            'run_id': self.run_id,
+            'thread_id': self.thread_id,
+            'user_id': self.user_id,
+            'status': status,
+            'started_at': self.started_at,
+            'duration_s': round(time.perf_counter() - self._start, 4),
+            'interval_ms': INTERVAL * 1000,
+            'samples': sum(stacks.values()),
+            'idle_samples': idle,
+            'frames': frames,
+            'stacks': folded,
+        }
+        record.update(summarize(record, TOP))
+        return record
+
+
+# ---------- Hooks ----------
+
+def get_profile(config: Optional[dict]) -> Optional[TurnProfile]:
+    return ((config or {}).get('configurable') or {}).get('profile')
+
+
+def attach(profile: Optional[TurnProfile] = None):
+    """Sample the calling thread with `profile` (default: the turn profiled in this context), if any."""
+    profile = profile or _current.get()
+    return profile.attach() if profile else _OFF
+
+
+def run_attached(fn: Callable[[], Any]) -> Any:
+    with attach():
+        return fn()
+
+
+def attached(node: Callable) -> Callable:
+    """Graph node decorator: the node's thread is sampled while it runs, when its turn is profiled."""
+
+    @functools.wraps(node)
+    def run(state, config):
+        with attach(get_profile(config)):
+            return node(state, config)
+
+    return run
+
+
+def profiled(profile: Optional[TurnProfile]):
+    """Profile the turn run in this block (see TurnProfile.__exit__); a no-op for None."""
+    return profile if profile else _OFF
+
+
+# ---------- Per-user switch ----------
+
+_targets: frozenset = frozenset()
+_targets_read_at = float('-inf')
+_targets_lock = threading.Lock()
+
+
+def _targeted(user_id: int) -> bool:
+    global _targets, _targets_read_at
+    if time.monotonic() - _targets_read_at > TARGETS_TTL:
+        with _targets_lock:
+            if time.monotonic() - _targets_read_at > TARGETS_TTL:
+                _targets = frozenset(row['user_id'] for row in get_profile_targets(time.time()))
+                _targets_read_at = time.monotonic()
+    return user_id in _targets
+
+
+def new_profile(user_id: int, thread_id: str, run_id: Optional[str] = None, requested: bool = False) -> Optional[TurnProfile]:
+    """A TurnProfile if the caller asks for one or an admin has the user's turns profiled, else None."""
+    if not ENABLED:
+        return None
+    if requested or (_targeted(user_id) and claim_profile_turn(user_id, time.time())):
+        return TurnProfile(user_id, thread_id, run_id)
+    return None
+
+
+def set_profiling(user_id: int, turns: int = 1, hours: float = 24, set_by: Optional[int] = None) -> dict:
+    """Profile the user's next `turns` turns (within `hours`); 0 turns stops. Other workers notice within TARGETS_TTL."""
+    global _targets_read_at
+    if turns < 0 or turns > 1000:
+        raise ValueError('turns must be between 0 and 1000')
+    if hours <= 0:
+        raise ValueError('hours must be positive')
+    set_profile_target(user_id, turns, time.time() + hours * 3600, set_by)
+    with _targets_lock:
+        _targets_read_at = float('-inf')
+    return {'user_id': user_id, 'turns': turns}
+
+
+def profiling_report(limit: int = 50) -> dict:
+    """Who is being profiled, and the latest profiles stored by this host."""
+    return {'targets': get_profile_targets(time.time()), 'profiles': list_profiles(limit=limit)}
+
+
+# ---------- Storage ----------
+
+_LIBRARY_ROOTS = sorted(
+    {path for key in ('purelib', 'platlib', 'stdlib', 'platstdlib') if (path := sysconfig.get_paths().get(key))} | {ROOT_DIR},
+    key=len, reverse=True,
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def _module(filename: str) -> str:
+    if filename.startswith('<frozen '):
+        return filename[len('<frozen '):-1]
+    for root in _LIBRARY_ROOTS:
+        if filename.startswith(root + os.sep):
+            filename = filename[len(root) + 1:]
+            break
+    else:
+        filename = os.path.basename(filename)
+    module = filename.removesuffix('.py').replace(os.sep, '.')
+    return module.removesuffix('.__init__')
+
+
+def _package(module: str) -> str:
+    # two levels tell langgraph.pregel from langgraph.checkpoint, bs4 from bs4.builder
+    return '.'.join(module.split('.')[:2])
+
+
+def _label(frame: dict) -> str:
+    return f"{frame['function']} ({frame['module']}:{frame['line']})"
+
+
+def summarize(record: dict, top: int = TOP, sort: str = 'self') -> dict:
+    """Busiest functions by `sort` ('self' or 'total' samples) and samples per package of a stored profile."""
+    frames = record['frames']
+    own, total, packages = Counter(), Counter(), Counter()
+    for ids, count in record['stacks']:
+        own[ids[-1]] += count
+        for i in set(ids):
+            total[i] += count
+        packages[_package(frames[ids[-1]]['module'])] += count
+    seconds = record['interval_ms'] / 1000
+    busiest = sorted(total, key=lambda i: (own[i], total[i]) if sort == 'self' else (total[i], own[i]), reverse=True)[:top]
+    return {
+        'functions': [
+            {'function': _label(frames[i]), 'self': own[i], 'total': total[i], 'self_s': round(own[i] * seconds, 3)}
+            for i in busiest
+        ],
+        'packages': dict(packages.most_common()),
+    }
+
+
+def folded_stacks(record: dict) -> dict[str, int]:
+    """Stacks as `outer;inner` lines with their samples, the input of flamegraph.pl and speedscope."""
+    labels = [_label(frame) for frame in record['frames']]
+    folded: Counter = Counter()
+    for ids, count in record['stacks']:
+        folded[';'.join(labels[i] for i in ids)] += count
+    return dict(folded)
+
+
+def _safe(name: str) -> str:
+    return re.sub(r'[^\w.-]', '_', str(name))[:128] or '_'
+
+
+def save_profile(record: dict) -> str:
+    directory = os.path.join(PROFILE_DIR, _safe(record['thread_id']))
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, _safe(record['run_id']))
+    with open(base + '.svg', 'w', encoding='utf-8') as f:
+        f.write(flame_graph(record))
+    # the JSON last: a listed profile has its flame graph
+    with open(base + '.json.tmp', 'w', encoding='utf-8') as f:
+        json.dump(record, f, separators=(',', ':'))
+    os.replace(base + '.json.tmp', base + '.json')
+    return base + '.json'
+
+
+def list_profiles(thread_id: Optional[str] = None, user_id: Optional[int] = None, limit: Optional[int] = None) -> list[dict]:
+    """Stored profiles, newest first, without their stacks."""
+    pattern = os.path.join(PROFILE_DIR, _safe(thread_id) if thread_id else '*', '*.json')
+    paths = sorted(glob.glob(pattern), key=os.path.getmtime, reverse=True)
+    profiles = []
+    for path in paths:
+        try:
+            record = load_profile(path)
+        except (OSError, ValueError):
+            continue
+        if user_id is not None and record['user_id'] != user_id:
+            continue
+        profiles.append({
+            key: record[key]
+            for key in ('run_id', 'thread_id', 'user_id', 'status', 'started_at', 'duration_s', 'samples', 'idle_samples')
+        } | {'path': path})
+        if limit and len(profiles) >= limit:
+            break
+    return profiles
+
+
+def load_profile(run_id_or_path: str) -> dict:
+    """A stored profile by run id (or a unique prefix of it) or by path."""
+    if os.path.exists(run_id_or_path):
+        path = run_id_or_path
+    else:
+        matches = glob.glob(os.path.join(PROFILE_DIR, '*', f'{_safe(run_id_or_path)}*.json'))
+        if len(matches) != 1:
+            raise ValueError(f"{'No' if not matches else 'More than one'} profile matches {run_id_or_path!r}")
+        path = matches[0]
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+# ---------- Flame graph ----------
+
+def flame_graph(record: dict, width: int = 1200, row: int = 16) -> str:
+    """A standalone SVG flame graph of a profile: callers at the bottom, hover a frame for its samples."""
+    frames = record['frames']
+    root: list = [0, {}]
+    for ids, count in record['stacks']:
+        node = root
+        node[0] += count
+        for i in ids:
+            node = node[1].setdefault(i, [0, {}])
+            node[0] += count
+
+    rects = []
+    scale = width / root[0] if root[0] else 0
+
+    def walk(children: dict, x: float, depth: int):
+        for i, (count, grandchildren) in sorted(children.items(), key=lambda item: _label(frames[item[0]])):
+            if count * scale >= 0.3:  # narrower than a pixel's third: not drawn
+                rects.append((x, depth, count, i))
+                walk(grandchildren, x, depth + 1)
+            x += count * scale
+
+    walk(root[1], 0.0, 0)
+    depth = max((rect[1] for rect in rects), default=0) + 1
+    height = (depth + 3) * row
+    title = f"{record['thread_id']} / {record['run_id']}: {record['duration_s']:.2f} s, {root[0]} samples ({record['idle_samples']} idle)"
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">',
+        '<rect width="100%" height="100%" fill="#f8f8f8"/>',
+        f'<text x="4" y="{row}">{html.escape(title)}</text>',
+    ]
+    for x, level, count, i in rects:
+        label = _label(frames[i])
+        w = count * scale
+        y = height - (level + 1) * row - 2
+        hue = zlib.crc32(frames[i]['module'].encode())
+        fill = f'rgb({205 + hue % 50},{(hue >> 8) % 180 + 40},{(hue >> 16) % 55})'
+        share = count / root[0] * 100
+        text = label[:int(w / 6.6)] if w > 20 else ''
+        parts.append(
+            f'<g><title>{html.escape(label)}: {count} samples ({share:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{max(w - 0.5, 0.1):.1f}" height="{row - 1}" fill="{fill}"/>'
+            + (f'<text x="{x + 2:.1f}" y="{y + row - 4}">{html.escape(text)}</text>' if text else '')
+            + '</g>'
+        )
+    parts.append('</svg>')
+    return '\n'.join(parts)
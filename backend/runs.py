@@ -0,0 +1,352 @@
+import json, os, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional, Literal
+from .langgraph_tool_backend import get_chat_stream, index_chat_thread, AIMessage, ToolMessage
+from .cancellation import CancellationToken, Cancelled
+from .usage import TurnUsage, check_quota
+from .memory import remember_turn
+from .archive import check_thread_owner
+from .profiling import new_profile, profiled
+from .db import (
+    create_run,
+    get_run,
+    get_active_runs,
+    update_run,
+    request_run_cancel,
+    append_run_events,
+    get_run_events,
+    get_cancel_requests,
+    purge_finished_runs,
+)
+
+# ----------------
+# Background turns
+# ----------------
+# Each turn runs as a job keyed by (thread_id, run_id), independent of the HTTP
+# request / Streamlit script that started it. Emitted events are buffered in
+# memory and flushed to `chat_run_events` in small batches, so a client can
+# reattach after a rerun (on any service worker) and resume from an offset.
+
+FINISHED = ('done', 'error', 'cancelled')
+ON_BUSY = ('queue', 'cancel')
+
+RUN_WORKERS = int(os.getenv('CHATBOT_RUN_WORKERS', '64'))
+FLUSH_INTERVAL = float(os.getenv('CHATBOT_RUN_FLUSH_INTERVAL', '0.25'))
+STALE_SECONDS = float(os.getenv('CHATBOT_RUN_STALE_SECONDS', '300'))
+RETENTION_SECONDS = float(os.getenv('CHATBOT_RUN_RETENTION_SECONDS', '3600'))
+CANCEL_POLL_INTERVAL = float(os.getenv('CHATBOT_RUN_CANCEL_POLL_INTERVAL', '0.5'))
+TOOL_PREVIEW_CHARS = int(os.getenv('CHATBOT_TOOL_PREVIEW_CHARS', '2000'))
+POLL_INTERVAL = 0.1
+KEEPALIVE_INTERVAL = 1.0
+
+executor = ThreadPoolExecutor(max_workers=RUN_WORKERS, thread_name_prefix='chat-run')
+
+
+class Run:
+    def __init__(self, run_id: str, thread_id: str, user_id: int, user_message: str):
+        self.run_id = run_id
+        self.thread_id = thread_id
+        self.user_id = user_id
+        self.user_message = user_message
+        self.id: Optional[int] = None
+        self.status = 'queued'
+        self.events: list[tuple[str, dict]] = []
+        self.flushed = 0
+        self.last_flush = time.monotonic()
+        self.cond = threading.Condition()
+        # cancels the LLM calls and tools of this turn (see backend/cancellation.py)
+        self.cancel_token = CancellationToken()
+        # what the turn consumed, from the moment it starts running (see backend/usage.py)
+        self.usage: Optional[TurnUsage] = None
+        self.finished = threading.Event()
+
+    def to_dict(self) -> dict:
+        return {'run_id': self.run_id, 'thread_id': self.thread_id, 'status': self.status, 'events': len(self.events)}
+
+
+# runs executing (or recently executed) in this process
+_runs: dict[str, Run] = {}
+_runs_lock = threading.Lock()
+_started = 0
+
+
+# ----------------
+# Helpers
+# ----------------
+def to_event(message_chunk, metadata) -> tuple[str, dict] | None:
+    """
+    The client-facing event for a streamed message, or None. Tool activity is sent
+    as small status events: `tool_start` with the tool name, then `tool` with a
+    preview of the result (the raw payload, before it was shaped for the model).
+    """
+    if isinstance(message_chunk, ToolMessage):
+        payload = message_chunk.artifact if isinstance(message_chunk.artifact, str) else str(message_chunk.content)
+        return 'tool', {
+            'name': getattr(message_chunk, 'name', None) or 'tool',
+            'id': message_chunk.tool_call_id,
+            'preview': payload[:TOOL_PREVIEW_CHARS],
+            'chars': len(payload),
+        }
+    if isinstance(message_chunk, AIMessage) and metadata.get('langgraph_node') == 'chat_node':
+        # streamed calls name each tool in its first chunk, cached answers carry whole tool_calls
+        calls = getattr(message_chunk, 'tool_call_chunks', None) or message_chunk.tool_calls
+        started = [{'name': call['name'], 'id': call.get('id')} for call in calls if call.get('name')]
+        if started:
+            return 'tool_start', {'tools': started}
+        if message_chunk.content:
+            return 'token', {'content': message_chunk.content}
+    return None
+
+
+def _is_stale(row: dict) -> bool:
+    return (row.get('heartbeat_at') or 0) < time.time() - STALE_SECONDS
+
+
+def _emit(run: Run, event: str, data: dict):
+    with run.cond:
+        run.events.append((event, data))
+        run.cond.notify_all()
+    if event != 'token' or time.monotonic() - run.last_flush >= FLUSH_INTERVAL:
+        _flush(run)
+
+
+def _flush(run: Run):
+    with run.cond:
+        batch = run.events[run.flushed:]
+        first_seq = run.flushed
+        run.flushed = len(run.events)
+    run.last_flush = time.monotonic()
+    if not batch:
+        return
+    payload = [(event, json.dumps(data, default=str)) for event, data in batch]
+    # cancel requests from other workers arrive through the runs table
+    if append_run_events(run.run_id, run.user_id, first_seq, payload):
+        run.cancel_token.cancel()
+
+
+def _finish(run: Run, status: str, error: Optional[str] = None):
+    _emit(run, status, {'error': error} if error else {})
+    _flush(run)
+    update_run(run.run_id, run.user_id, status=status, error=error)
+    with run.cond:
+        run.status = status
+        run.cond.notify_all()
+    run.finished.set()
+    if run.usage:
+        run.usage.record(status)
+
+
+def _index(run: Run):
+    # after the run finished: search lags by one state read, the client never waits on it
+    try:
+        index_chat_thread(run.thread_id, run.user_id)
+    except Exception:
+        pass  # the next turn on this thread indexes whatever is missing
+    try:
+        remember_turn(run.user_id, run.thread_id, run.user_message)
+    except Exception:
+        pass  # memory is best effort; the run is already finished
+
+
+def _wait_for_turn(run: Run):
+    """Block until every earlier run on the same thread has finished."""
+    while not run.cancel_token.cancelled:
+        pending = [
+            r for r in get_active_runs(run.thread_id, run.user_id, before_id=run.id)
+            if not _is_stale(r)
+        ]
+        if not pending:
+            return
+        local = _runs.get(pending[0]['run_id'])
+        if local:
+            local.finished.wait(timeout=KEEPALIVE_INTERVAL)
+        else:
+            run.cancel_token.wait(POLL_INTERVAL)
+        if time.monotonic() - run.last_flush >= STALE_SECONDS / 10:
+            run.last_flush = time.monotonic()
+            update_run(run.run_id, run.user_id)  # heartbeat while queued
+
+
+def _execute(run: Run):
+    _watch_cancellations()
+    try:
+        _wait_for_turn(run)
+        if run.cancel_token.cancelled:
+            _finish(run, 'cancelled')
+            return
+
+        run.status = 'running'
+        update_run(run.run_id, run.user_id, status='running')
+        run.usage = TurnUsage(run.user_id, run.thread_id)
+        # when an admin profiles this user's turns (see backend/profiling.py)
+        profile = new_profile(run.user_id, run.thread_id, run.run_id)
+        stream = get_chat_stream(
+            run.user_message, thread_id=run.thread_id, user_id=run.user_id, cancel_token=run.cancel_token, usage=run.usage,
+            profile=profile,
+        )
+        with profiled(profile):
+            try:
+                for message_chunk, metadata in stream:
+                    if run.cancel_token.cancelled:
+                        break
+                    event = to_event(message_chunk, metadata)
+                    if event:
+                        _emit(run, *event)
+            finally:
+                stream.close()
+
+        _finish(run, 'cancelled' if run.cancel_token.cancelled else 'done')
+    except Cancelled:
+        _finish(run, 'cancelled')
+    except Exception as e:
+        if run.cancel_token.cancelled:
+            _finish(run, 'cancelled')
+        else:
+            _finish(run, 'error', str(e))
+    else:
+        # outside the try: the run is finished, nothing here may finish it again
+        _index(run)
+
+
+# ----------------
+# Cross-worker cancellation
+# ----------------
+# A cancel request handled by another worker only sets `cancel_requested`; this
+# watcher polls for it while runs execute here, so silent phases (waiting for
+# the first token, slow tools) are interrupted too.
+_watcher: Optional[threading.Thread] = None
+_watcher_lock = threading.Lock()
+
+
+def _watch_loop():
+    while True:
+        time.sleep(CANCEL_POLL_INTERVAL)
+        running = [r for r in list(_runs.values()) if not r.finished.is_set() and not r.cancel_token.cancelled]
+        if not running:
+            continue
+        try:
+            for run_id in get_cancel_requests([(r.run_id, r.user_id) for r in running]):
+                _runs[run_id].cancel_token.cancel()
+        except Exception:
+            pass  # transient DB errors: try again next tick
+
+
+def _watch_cancellations():
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch_loop, daemon=True, name='run-cancel-watcher')
+            _watcher.start()
+
+
+# ----------------
+# Public API
+# ----------------
+def start_run(user_message: str, thread_id: str, user_id: int, on_busy: Literal['queue', 'cancel'] = 'queue') -> Run:
+    """
+    Start a turn in the background and return immediately.
+    `on_busy` decides what happens to an in-flight run on the same thread:
+    'queue' waits for it to finish, 'cancel' stops it first.
+    """
+    global _started
+    if on_busy not in ON_BUSY:
+        raise ValueError(f"on_busy must be one of {', '.join(ON_BUSY)}")
+    check_quota(user_id)
+    # before on_busy='cancel' can touch the thread's runs
+    check_thread_owner(thread_id, user_id)
+
+    run = Run(uuid.uuid4().hex, thread_id, user_id, user_message)
+    run.id = create_run(run.run_id, thread_id, user_id)
+    if on_busy == 'cancel':
+        for other in get_active_runs(thread_id, user_id, before_id=run.id):
+            cancel_run(other['run_id'], user_id)
+
+    with _runs_lock:
+        _runs[run.run_id] = run
+        _started += 1
+        if _started % 100 == 0:
+            _forget_finished_runs()
+    executor.submit(_execute, run)
+    return run
+
+
+def cancel_run(run_id: str, user_id: int):
+    run = _runs.get(run_id)
+    if run and run.user_id == user_id:
+        run.cancel_token.cancel()
+    else:
+        row = get_run(run_id, user_id)
+        if not row or row['user_id'] != user_id:
+            raise ValueError('Unknown run')
+    request_run_cancel(run_id, user_id)
+
+
+def get_run_status(run_id: str, user_id: int) -> dict:
+    run = _runs.get(run_id)
+    if run and run.user_id == user_id:
+        return run.to_dict()
+
+    row = get_run(run_id, user_id)
+    if not row or row['user_id'] != user_id:
+        raise ValueError('Unknown run')
+    status = row['status']
+    if status not in FINISHED and _is_stale(row):
+        status = 'error'
+    return {'run_id': run_id, 'thread_id': row['thread_id'], 'status': status, 'events': None}
+
+
+def iter_run_events(run_id: str, user_id: int, offset: int = 0) -> Iterator[Optional[tuple[int, str, dict]]]:
+    """
+    Yield `(seq, event, data)` from `offset` until the run finishes.
+    Yields None as a keepalive while waiting so callers can notice disconnects.
+    """
+    run = _runs.get(run_id)
+    if run and run.user_id == user_id:
+        while True:
+            with run.cond:
+                if offset >= len(run.events) and not run.finished.is_set():
+                    run.cond.wait(timeout=KEEPALIVE_INTERVAL)
+                batch = run.events[offset:]
+                done = run.finished.is_set()
+            if not batch:
+                if done:
+                    return
+                yield None
+            for event, data in batch:
+                yield offset, event, data
+                offset += 1
+            if done and offset >= len(run.events):
+                return
+
+    # run lives in another worker (or a previous process): follow the event log
+    row = get_run(run_id, user_id)
+    if not row or row['user_id'] != user_id:
+        raise ValueError('Unknown run')
+    last_keepalive = time.monotonic()
+    while True:
+        events = get_run_events(run_id, user_id, offset)
+        for row_event in events:
+            event, data = row_event['event'], json.loads(row_event['data'])
+            yield row_event['seq'], event, data
+            offset = row_event['seq'] + 1
+            if event in FINISHED:
+                return
+
+        row = get_run(run_id, user_id)
+        if row['status'] in FINISHED and not get_run_events(run_id, user_id, offset):
+            return
+        if _is_stale(row):
+            yield offset, 'error', {'error': 'Run was lost'}
+            return
+        if time.monotonic() - last_keepalive >= KEEPALIVE_INTERVAL:
+            last_keepalive = time.monotonic()
+            yield None
+        time.sleep(POLL_INTERVAL)
+
+
+def _forget_finished_runs():
+    cutoff = time.monotonic() - RETENTION_SECONDS
+    for run_id, run in list(_runs.items()):
+        if run.finished.is_set() and run.last_flush < cutoff:
+            _runs.pop(run_id, None)
+    purge_finished_runs(RETENTION_SECONDS)
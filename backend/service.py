@@ -0,0 +1,422 @@
+"""
+Headless HTTP/SSE chat service.
+
+Exposes the chat graph and auth operations over HTTP so the Streamlit UI can run
+as a thin client and both can be scaled independently. Assistant tokens and tool
+activity are streamed as Server-Sent Events.
+
+    python -m backend.service --host 0.0.0.0 --port 8000 --workers 4
+"""
+import argparse, asyncio, json, multiprocessing, os, threading
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+
+from .langgraph_tool_backend import (
+    get_chat_history,
+    get_user_rooms,
+    get_thread_title,
+    get_user_details,
+    search_user_messages,
+    warm_up,
+)
+from .runs import start_run, cancel_run, get_run_status, iter_run_events
+from .archive import check_thread_owner
+from .auth import sign_up, sign_in, create_reset_token, reset_password, create_session, validate_session
+from .admission import llm_admission
+from .usage import QuotaExceeded, usage_report
+from .llm_cache import llm_cache
+from .speculation import speculation_stats
+from .cancellation import cancellable_stats
+from .profiling import set_profiling, profiling_report
+
+# token events are coalesced into one SSE message per interval / size, the first one is sent right away
+SSE_FLUSH_INTERVAL = float(os.getenv('CHATBOT_SSE_FLUSH_INTERVAL', '0.05'))
+SSE_FLUSH_CHARS = int(os.getenv('CHATBOT_SSE_FLUSH_CHARS', '512'))
+
+# sign-ins wait here for the password KDF pool (see backend/auth.py) instead of
+# holding the default executor threads that serve every other request
+auth_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('CHATBOT_AUTH_WORKERS', '16')),
+    thread_name_prefix='auth',
+)
+
+# each open SSE connection holds one of these threads while it follows a run
+stream_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('CHATBOT_STREAM_WORKERS', '64')),
+    thread_name_prefix='chat-stream',
+)
+
+
+# ----------------
+# Helpers
+# ----------------
+def sse(event: str, data: dict, event_id: int | None = None) -> bytes:
+    head = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{head}event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode()
+
+
+async def read_json(request: web.Request) -> dict:
+    try:
+        return await request.json()
+    except json.JSONDecodeError:
+        raise ValueError('Request body must be JSON')
+
+
+def parse_user_id(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError('A valid user_id is required')
+
+
+def session_user_id(request: web.Request, supplied=None) -> int:
+    """The signed-in user's id; a user_id the client also sent must be the same one."""
+    user_id = request['session']['user_id']
+    if supplied is not None and parse_user_id(supplied) != user_id:
+        raise PermissionError("user_id does not match the session")
+    return user_id
+
+
+async def thread_user_id(request: web.Request, supplied=None) -> int:
+    """session_user_id, once the path's thread is known to be that user's (or new); PermissionError otherwise."""
+    user_id = session_user_id(request, supplied)
+    await asyncio.to_thread(check_thread_owner, request.match_info['thread_id'], user_id)
+    return user_id
+
+
+@web.middleware
+async def error_middleware(request: web.Request, handler):
+    try:
+        return await handler(request)
+    except QuotaExceeded as e:
+        return web.json_response({'error': str(e), 'resets_at': e.resets_at}, status=429)
+    except PermissionError as e:
+        return web.json_response({'error': str(e)}, status=403)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+
+
+# ----------------
+# Auth
+# ----------------
+def bearer_token(request: web.Request) -> str:
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise ValueError('A bearer session token is required')
+    return token.strip()
+
+
+# signing in / up, password resets and health checks work without a session
+PUBLIC_PATHS = ('/health', '/stats', '/auth/')
+
+
+@web.middleware
+async def session_middleware(request: web.Request, handler):
+    """Every other route needs `Authorization: Bearer <token>`; handlers find the session in request['session']."""
+    if not request.path.startswith(PUBLIC_PATHS):
+        try:
+            # cached per worker (see backend/auth.py), so this rarely reads `users`
+            request['session'] = await asyncio.to_thread(validate_session, bearer_token(request))
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=401)
+    return await handler(request)
+
+
+async def run_auth(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(auth_executor, func, *args)
+
+
+async def sign_up_handler(request: web.Request):
+    body = await read_json(request)
+    user_id = await run_auth(
+        sign_up, body.get('email'), body.get('password'), body.get('first_name'), body.get('last_name')
+    )
+    return web.json_response(await asyncio.to_thread(create_session, user_id))
+
+
+async def sign_in_handler(request: web.Request):
+    body = await read_json(request)
+    user_id = await run_auth(sign_in, body.get('email'), body.get('password'))
+    return web.json_response(await asyncio.to_thread(create_session, user_id))
+
+
+async def session_handler(request: web.Request):
+    # cached per worker: restoring a session on page load does not read `users`
+    return web.json_response(await asyncio.to_thread(validate_session, bearer_token(request)))
+
+
+# Anyone can ask for a reset token, so handing it back in the response lets
+# anyone take over any account. The route only exists when an operator accepts
+# that (local development); otherwise tokens are issued out of band with
+# scripts/reset_token.py and only /auth/reset_password is served.
+RESET_TOKEN_ROUTE = os.getenv('CHATBOT_INSECURE_RESET_TOKEN_ROUTE', '0').lower() in ('1', 'true', 'yes', 'on')
+
+
+async def reset_token_handler(request: web.Request):
+    body = await read_json(request)
+    token = await run_auth(create_reset_token, body.get('email'))
+    return web.json_response({'token': token})
+
+
+async def reset_password_handler(request: web.Request):
+    body = await read_json(request)
+    await run_auth(reset_password, body.get('token'), body.get('new_password'))
+    return web.json_response({'ok': True})
+
+
+# ----------------
+# Users & threads
+# ----------------
+async def user_details_handler(request: web.Request):
+    user_id = session_user_id(request, request.match_info['user_id'])
+    return web.json_response(await asyncio.to_thread(get_user_details, user_id))
+
+
+async def user_rooms_handler(request: web.Request):
+    user_id = session_user_id(request, request.match_info['user_id'])
+    return web.json_response(await asyncio.to_thread(get_user_rooms, user_id))
+
+
+async def user_search_handler(request: web.Request):
+    user_id = session_user_id(request, request.match_info['user_id'])
+    limit = min(int(request.query.get('limit', 20)), 100)
+    return web.json_response(await asyncio.to_thread(search_user_messages, user_id, request.query.get('q', ''), limit))
+
+
+async def thread_title_handler(request: web.Request):
+    thread_id, user_id = request.match_info['thread_id'], await thread_user_id(request, request.query.get('user_id'))
+    return web.json_response({'thread_title': await asyncio.to_thread(get_thread_title, thread_id, user_id)})
+
+
+async def chat_history_handler(request: web.Request):
+    thread_id, user_id = request.match_info['thread_id'], await thread_user_id(request, request.query.get('user_id'))
+    return web.json_response(await asyncio.to_thread(get_chat_history, thread_id, user_id))
+
+
+# ----------------
+# Chat runs (SSE)
+# ----------------
+async def stream_run_events(request: web.Request, run_id: str, user_id: int, offset: int = 0) -> web.StreamResponse:
+    """Relay a run's events as SSE; disconnecting detaches without stopping the run."""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    end = object()
+
+    def produce():
+        try:
+            for item in iter_run_events(run_id, user_id, offset):
+                if stop.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (offset, 'error', {'error': str(e)}))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, end)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    await response.prepare(request)
+    loop.run_in_executor(stream_executor, produce)
+
+    # tokens waiting for the next write; the message takes the id of the last one,
+    # so a client that reattaches from it resumes right after the text it has
+    tokens: list[str] = []
+    last_seq = None
+    deadline = None
+    sent_token = False
+
+    async def flush_tokens():
+        nonlocal deadline, sent_token
+        if tokens:
+            await response.write(sse('token', {'content': ''.join(tokens), 'run_id': run_id}, last_seq))
+            tokens.clear()
+            sent_token = True
+        deadline = None
+
+    try:
+        while True:
+            try:
+                timeout = None if deadline is None else max(deadline - loop.time(), 0)
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                await flush_tokens()
+                continue
+            if item is end:
+                break
+            if item is None:
+                if not tokens:
+                    await response.write(b": keepalive\n\n")
+                continue
+            seq, event, data = item
+            if event == 'token':
+                tokens.append(data['content'])
+                last_seq = seq
+                if deadline is None:
+                    deadline = loop.time() + SSE_FLUSH_INTERVAL
+                if not sent_token or sum(map(len, tokens)) >= SSE_FLUSH_CHARS:
+                    await flush_tokens()
+                continue
+            await flush_tokens()
+            await response.write(sse(event, {**data, 'run_id': run_id}, seq))
+        await flush_tokens()
+        await response.write_eof()
+    except ConnectionResetError:
+        pass  # client detached; the run carries on and can be reattached
+    finally:
+        stop.set()
+    return response
+
+
+async def start_run_handler(request: web.Request):
+    thread_id = request.match_info['thread_id']
+    body = await read_json(request)
+    if not body.get('message'):
+        raise ValueError('message is required')
+    user_id = await thread_user_id(request, body.get('user_id'))
+    run = await asyncio.to_thread(start_run, body['message'], thread_id, user_id, body.get('on_busy', 'queue'))
+    return web.json_response(run.to_dict())
+
+
+async def run_status_handler(request: web.Request):
+    run_id, user_id = request.match_info['run_id'], await thread_user_id(request, request.query.get('user_id'))
+    return web.json_response(await asyncio.to_thread(get_run_status, run_id, user_id))
+
+
+async def run_events_handler(request: web.Request):
+    run_id, user_id = request.match_info['run_id'], await thread_user_id(request, request.query.get('user_id'))
+    # Last-Event-ID is what EventSource sends on reconnect
+    last_event_id = request.headers.get('Last-Event-ID')
+    offset = int(last_event_id) + 1 if last_event_id else int(request.query.get('offset', 0))
+    await asyncio.to_thread(get_run_status, run_id, user_id)  # ownership check
+    return await stream_run_events(request, run_id, user_id, offset)
+
+
+async def cancel_run_handler(request: web.Request):
+    body = await read_json(request)
+    await asyncio.to_thread(cancel_run, request.match_info['run_id'], await thread_user_id(request, body.get('user_id')))
+    return web.json_response({'ok': True})
+
+
+async def chat_stream_handler(request: web.Request):
+    """Start a run and follow it in one request (for simple clients)."""
+    thread_id = request.match_info['thread_id']
+    body = await read_json(request)
+    if not body.get('message'):
+        raise ValueError('message is required')
+    user_id = await thread_user_id(request, body.get('user_id'))
+    run = await asyncio.to_thread(start_run, body['message'], thread_id, user_id, body.get('on_busy', 'queue'))
+    return await stream_run_events(request, run.run_id, user_id)
+
+
+# ----------------
+# Admin
+# ----------------
+def admin_session(request: web.Request) -> dict | None:
+    """The caller's session if they are an admin, else None."""
+    session = request['session']
+    return session if (session['user_details'] or {}).get('is_admin') else None
+
+
+async def admin_usage_handler(request: web.Request):
+    if not admin_session(request):
+        return web.json_response({'error': 'Only admins can view usage'}, status=403)
+    period, days = request.query.get('period', 'day'), float(request.query.get('days', 7))
+    return web.json_response(await asyncio.to_thread(usage_report, period, min(days, 366)))
+
+
+async def admin_profiling_handler(request: web.Request):
+    if not admin_session(request):
+        return web.json_response({'error': 'Only admins can manage profiling'}, status=403)
+    return web.json_response(await asyncio.to_thread(profiling_report, int(request.query.get('limit', 50))))
+
+
+async def set_profiling_handler(request: web.Request):
+    session = admin_session(request)
+    if not session:
+        return web.json_response({'error': 'Only admins can manage profiling'}, status=403)
+    body = await read_json(request)
+    user_id = parse_user_id(body.get('user_id'))
+    turns, hours = int(body.get('turns', 1)), float(body.get('hours', 24))
+    return web.json_response(await asyncio.to_thread(set_profiling, user_id, turns, hours, session['user_id']))
+
+
+async def health_handler(request: web.Request):
+    return web.json_response({'status': 'ok', 'pid': os.getpid()})
+
+
+async def stats_handler(request: web.Request):
+    # counters of this worker process
+    return web.json_response({'pid': os.getpid(), 'llm_admission': llm_admission.stats(), 'llm_cache': llm_cache.stats(), 'tool_speculation': speculation_stats.stats(), 'cancellable_calls': cancellable_stats.stats()})
+
+
+async def start_warm_up(app: web.Application):
+    # serve sign-in and history right away; the graph and LLM clients load in the background
+    if os.getenv('CHATBOT_WARM_UP', '1') != '0':
+        threading.Thread(target=warm_up, daemon=True, name='warm-up').start()
+
+
+def create_app() -> web.Application:
+    app = web.Application(middlewares=[error_middleware, session_middleware])
+    app.on_startup.append(start_warm_up)
+    app.add_routes([
+        web.get('/health', health_handler),
+        web.get('/stats', stats_handler),
+        web.post('/auth/sign_up', sign_up_handler),
+        web.post('/auth/sign_in', sign_in_handler),
+        web.get('/auth/session', session_handler),
+        web.post('/auth/reset_password', reset_password_handler),
+        web.get('/users/{user_id}', user_details_handler),
+        web.get('/users/{user_id}/rooms', user_rooms_handler),
+        web.get('/users/{user_id}/search', user_search_handler),
+        web.get('/threads/{thread_id}/title', thread_title_handler),
+        web.get('/threads/{thread_id}/history', chat_history_handler),
+        web.post('/threads/{thread_id}/stream', chat_stream_handler),
+        web.post('/threads/{thread_id}/runs', start_run_handler),
+        web.get('/threads/{thread_id}/runs/{run_id}', run_status_handler),
+        web.get('/threads/{thread_id}/runs/{run_id}/events', run_events_handler),
+        web.post('/threads/{thread_id}/runs/{run_id}/cancel', cancel_run_handler),
+        web.get('/admin/usage', admin_usage_handler),
+        web.get('/admin/profiling', admin_profiling_handler),
+        web.post('/admin/profiling', set_profiling_handler),
+    ])
+    if RESET_TOKEN_ROUTE:
+        app.add_routes([web.post('/auth/reset_token', reset_token_handler)])
+    return app
+
+
+def serve(host: str, port: int, reuse_port: bool = False):
+    web.run_app(create_app(), host=host, port=port, reuse_port=reuse_port, print=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.getenv('CHATBOT_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('CHATBOT_PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('CHATBOT_WORKERS', '1')))
+    args = parser.parse_args()
+
+    print(f"chat service on http://{args.host}:{args.port} ({args.workers} worker(s))")
+    if args.workers <= 1:
+        serve(args.host, args.port)
+        return
+
+    # Workers share the port via SO_REUSEPORT. "spawn" so that every worker opens
+    # its own SQLite connection instead of inheriting the parent's across fork.
+    ctx = multiprocessing.get_context('spawn')
+    workers = [ctx.Process(target=serve, args=(args.host, args.port, True), daemon=True) for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+from typing import Any, Iterator, Optional, Sequence
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver
+from .db import Shard, shards, shard_index
+from .checkpoint_serde import CompactSerializer, thread_blob_refs, forget_thread_blobs, collect_blobs
+
+# ----------------
+# Sharded checkpointer
+# ----------------
+# One SqliteSaver per shard (see the storage layout in backend/db.py), each with
+# its own connection and lock, so turns of users on different shards checkpoint
+# in parallel. Calls are routed by the `user_id` that get_config puts in
+# `configurable`; langgraph carries it through to put / put_writes.
+
+
+def _user_id(config: Optional[RunnableConfig]) -> Optional[int]:
+    return ((config or {}).get('configurable') or {}).get('user_id')
+
+
+def _with_user(config: Optional[RunnableConfig], user_id: int) -> Optional[RunnableConfig]:
+    # configs handed back by the savers only carry thread / checkpoint ids
+    if config is None:
+        return None
+    return {**config, 'configurable': {**config.get('configurable', {}), 'user_id': user_id}}
+
+
+class ShardSaver(SqliteSaver):
+    """The SqliteSaver of one shard; records which blobs each thread uses and drops a deleted thread's unused ones."""
+
+    def __init__(self, shard: Shard):
+        super().__init__(conn=shard.conn, serde=CompactSerializer(shard))
+        self.lock = shard.lock
+        self.shard = shard
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        with self.serde.thread(str(config['configurable']['thread_id'])):
+            return super().put(config, checkpoint, metadata, new_versions)
+
+    def delete_thread(self, thread_id: str) -> None:
+        refs = thread_blob_refs(self.shard, thread_id)
+        super().delete_thread(thread_id)
+        refs |= forget_thread_blobs(self.shard, thread_id)
+        self.serde.forget_thread(thread_id)
+        collect_blobs(self.shard, refs)
+
+
+class ShardedSaver(BaseCheckpointSaver):
+    def __init__(self, savers: list[SqliteSaver]):
+        super().__init__(serde=savers[0].serde)
+        self.savers = savers
+
+    def saver_for(self, config: Optional[RunnableConfig]) -> SqliteSaver:
+        user_id = _user_id(config)
+        if user_id is None:
+            raise ValueError("Sharded checkpointer needs 'user_id' in config['configurable']")
+        return self.savers[shard_index(user_id, len(self.savers))]
+
+    def _tuple(self, value: Optional[CheckpointTuple], user_id: int) -> Optional[CheckpointTuple]:
+        if value is None:
+            return None
+        return value._replace(config=_with_user(value.config, user_id), parent_config=_with_user(value.parent_config, user_id))
+
+    # ---------- BaseCheckpointSaver ----------
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self._tuple(self.saver_for(config).get_tuple(config), _user_id(config))
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        user_id = _user_id(config)
+        if user_id is not None:
+            for value in self.saver_for(config).list(config, filter=filter, before=before, limit=limit):
+                yield self._tuple(value, user_id)
+            return
+        # no owner given (admin / maintenance): walk every shard
+        for saver in self.savers:
+            for value in saver.list(config, filter=filter, before=before, limit=limit):
+                yield value
+                if limit is not None:
+                    limit -= 1
+                    if limit <= 0:
+                        return
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        saved = self.saver_for(config).put(config, checkpoint, metadata, new_versions)
+        return _with_user(saved, _user_id(config))
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        self.saver_for(config).put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        for saver in self.savers:
+            saver.delete_thread(thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        return self.savers[0].get_next_version(current, channel)
+
+
+def build_checkpointer() -> BaseCheckpointSaver:
+    """A plain SqliteSaver on the central database, or a ShardedSaver over CHATBOT_SHARDS files."""
+    # compressed msgpack, large tool outputs stored once (see backend/checkpoint_serde.py)
+    savers = [ShardSaver(shard) for shard in shards]
+    return savers[0] if len(savers) == 1 else ShardedSaver(savers)
@@ -0,0 +1,267 @@
+import json, os, re, threading, time, uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from langchain_core.messages import ToolMessage
+from langgraph.prebuilt.tool_node import msg_content_output
+from .cancellation import CancellationToken
+from .tools import get_geocoding, get_weather, get_stock_price, google_search
+
+# ----------------
+# Speculative tool calls
+# ----------------
+# Some questions name their tool call outright ("weather in Paris", "price of
+# $AAPL", "search for ..."). With CHATBOT_SPECULATIVE_TOOLS=1 those calls are
+# predicted from the new user message and started while the first chat_node
+# call is still waiting for the model. A ToolSpeculation travels in
+# `config['configurable']['speculation']` (like the cancel token) and parks the
+# results; when the model asks for the same call, the tools node takes the
+# parked result instead of running the tool again. Predictions the model did not
+# make are cancelled as soon as its response arrives, and with the turn.
+
+ENABLED = os.getenv('CHATBOT_SPECULATIVE_TOOLS', '0').lower() in ('1', 'true', 'yes', 'on')
+WORKERS = int(os.getenv('CHATBOT_SPECULATION_WORKERS', '8'))
+MAX_PREDICTIONS = 3  # per turn, follow-up calls included
+
+TOOLS = {tool.name: tool for tool in (get_geocoding, get_weather, get_stock_price, google_search)}
+# arguments the model may leave out, so predicted and real calls compare equal
+_DEFAULTS = {
+    name: {field: info.default for field, info in tool.args_schema.model_fields.items() if not info.is_required()}
+    for name, tool in TOOLS.items()
+}
+
+_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='speculation')
+
+
+# ---------- Predictions ----------
+
+_WEATHER_AFTER = re.compile(
+    r"\b(?:weather|temperature|forecast|raining|snowing|humidity)\b[^?!.]*?\b(?:in|at|for)\s+"
+    r"(?P<city>[a-z][a-z .'-]*?)\s*(?:\b(?:today|tomorrow|tonight|right now|now|this week)\b|[?!.,]|$)",
+    re.IGNORECASE,
+)
+_WEATHER_BEFORE = re.compile(r"\b(?P<city>[A-Z][a-zA-Z'-]*(?:\s+[A-Z][a-zA-Z'-]*)*?)(?:'s)?\s+(?:weather|temperature|forecast)\b")
+_STOCK_WORDS = re.compile(r"\b(?:stocks?|shares?|price|ticker|quote|trading)\b", re.IGNORECASE)
+TICKER = re.compile(r"\$(?P<cashtag>[A-Za-z]{1,5})\b|\b(?P<symbol>[A-Z]{1,5})\b")
+NOT_TICKERS = {'I', 'A', 'AI', 'AM', 'PM', 'US', 'USA', 'UK', 'EU', 'USD', 'EUR', 'CEO', 'IPO', 'ETF', 'NYSE', 'OK', 'TV'}
+_SEARCH = re.compile(
+    r"^\s*(?:please\s+|can you\s+|could you\s+)?(?:search(?:\s+(?:the web|google|online))?\s+for|google|look up)\s+"
+    r"(?P<query>.+?)[\s?!.]*$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def _coordinates(geocoding: ToolMessage) -> Optional[dict]:
+    """get_weather arguments from a get_geocoding result: the first match, as the model picks it."""
+    try:
+        first = json.loads(geocoding.content)['results'][0]
+        return {'latitude': float(first['latitude']), 'longitude': float(first['longitude'])}
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def predict(text: str) -> list[tuple[str, dict, Optional[tuple[str, Callable[[ToolMessage], Optional[dict]]]]]]:
+    """Likely tool calls for a user message: (tool, args, follow-up tool and how to derive its args, if any)."""
+    predictions = []
+    if match := _WEATHER_AFTER.search(text) or _WEATHER_BEFORE.search(text):
+        # as get_geocoding asks: lower case, no punctuation
+        city = ' '.join(re.sub(r"[^\w\s]", ' ', match['city']).lower().split())
+        if city:
+            predictions.append(('get_geocoding', {'cityname': city}, ('get_weather', _coordinates)))
+    if _STOCK_WORDS.search(text):
+        symbols = {
+            (match['cashtag'] or match['symbol']).upper()
+            for match in TICKER.finditer(text)
+            if match['cashtag'] or match['symbol'] not in NOT_TICKERS
+        }
+        if len(symbols) == 1:  # several candidates: too likely to guess wrong
+            predictions.append(('get_stock_price', {'symbol': symbols.pop()}, None))
+    if match := _SEARCH.match(text):
+        predictions.append(('google_search', {'query': match['query']}, None))
+    return predictions
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return ' '.join(value.lower().split())
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # coordinates go through rounding (see backend/tool_budget.py) before the model repeats them
+        return round(float(value), 2)
+    return value
+
+
+def call_key(name: str, args: dict) -> str:
+    args = {**_DEFAULTS.get(name, {}), **args}
+    return json.dumps([name, {key: _normalize(value) for key, value in args.items()}], sort_keys=True, default=str)
+
+
+# ---------- Stats ----------
+
+class SpeculationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.predicted = 0
+        self.used = 0
+        self.unused = 0
+        self.failed = 0
+        self.seconds_saved = 0.0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            settled = self.used + self.unused + self.failed
+            return {
+                'enabled': ENABLED,
+                'turns': self.turns,
+                'predicted': self.predicted,
+                'used': self.used,
+                'unused': self.unused,
+                'failed': self.failed,
+                'precision': self.used / settled if settled else 0.0,
+                'latency_saved_ms': int(self.seconds_saved * 1000),
+            }
+
+
+speculation_stats = SpeculationStats()
+
+
+# ---------- Speculation ----------
+
+class _Speculated:
+    def __init__(self, name: str, args: Optional[dict] = None):
+        self.name = name
+        self.args = args
+        # None until the arguments are known (follow-up calls wait for their parent)
+        self.key = call_key(name, args) if args is not None else None
+        self.token = CancellationToken()
+        self.future: Optional[Future] = None
+        self.followups: list[tuple['_Speculated', Callable[[ToolMessage], Optional[dict]]]] = []
+        self.started_at = 0.0
+        self.finished_at = 0.0
+
+
+class ToolSpeculation:
+    """The speculative tool calls of one turn."""
+
+    def __init__(self, cancel_token: Optional[CancellationToken] = None):
+        self._lock = threading.Lock()
+        self.pending: list[_Speculated] = []
+        self.started = False
+        self._unregister = cancel_token.on_cancel(self.close) if cancel_token else (lambda: None)
+
+    def start(self, text: str):
+        """Predict from the user message and start the calls; only the first call of a turn counts."""
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+            for name, args, followup in predict(text):
+                if len(self.pending) + 1 + (followup is not None) > MAX_PREDICTIONS:
+                    break
+                entry = _Speculated(name, args)
+                self.pending.append(entry)
+                if followup:
+                    child = _Speculated(followup[0])
+                    entry.followups.append((child, followup[1]))
+                    self.pending.append(child)
+                entry.future = _pool.submit(self._run, entry)
+            predicted = len(self.pending)
+        speculation_stats.add(turns=1, predicted=predicted)
+
+    def _run(self, entry: _Speculated) -> ToolMessage:
+        entry.started_at = time.perf_counter()
+        try:
+            # the ToolMessage ToolNode would build, under a placeholder id replaced when it is used
+            message = TOOLS[entry.name].invoke(
+                {'type': 'tool_call', 'name': entry.name, 'args': entry.args, 'id': f'speculative_{uuid.uuid4().hex[:12]}'},
+                {'configurable': {'cancel_token': entry.token}},
+            )
+            message.content = msg_content_output(message.content)
+        except BaseException:
+            self._drop([child for child, _ in entry.followups])
+            raise
+        finally:
+            entry.finished_at = time.perf_counter()
+        for child, derive in entry.followups:
+            args = derive(message)
+            if args is None:
+                self._drop([child])
+                continue
+            with self._lock:
+                if child in self.pending:
+                    child.args = args
+                    child.key = call_key(child.name, args)
+                    child.future = _pool.submit(self._run, child)
+        return message
+
+    def settle(self, tool_calls: list[dict]):
+        """After a model response: keep what it asked for (and their follow-ups), cancel the rest."""
+        keys = {call_key(call['name'], call['args']) for call in tool_calls}
+        with self._lock:
+            matched = [entry for entry in self.pending if entry.key is not None and entry.key in keys]
+            keep = matched + [child for entry in matched for child, _ in entry.followups if child in self.pending]
+            dropped = [entry for entry in self.pending if entry not in keep]
+        self._drop(dropped)
+
+    def close(self):
+        """Cancel everything still pending (the turn ended or was cancelled)."""
+        with self._lock:
+            dropped = list(self.pending)
+        self._drop(dropped)
+        self._unregister()
+
+    def _drop(self, entries: list[_Speculated]):
+        with self._lock:
+            entries = [entry for entry in entries if entry in self.pending]
+            for entry in entries:
+                self.pending.remove(entry)
+        for entry in entries:
+            entry.token.cancel()
+            if entry.future:
+                entry.future.cancel()
+        if entries:
+            speculation_stats.add(unused=len(entries))
+
+    def _claim(self, tool_call: dict) -> Optional[_Speculated]:
+        if not self.pending:
+            return None
+        key = call_key(tool_call['name'], tool_call['args'])
+        with self._lock:
+            for entry in self.pending:
+                if entry.key == key:
+                    self.pending.remove(entry)
+                    return entry
+        return None
+
+    def serve(self, execute: Callable):
+        """Wrap a ToolNode `execute` so a call that was speculated is answered with the parked result."""
+
+        def run(request):
+            entry = self._claim(request.tool_call)
+            if entry is None:
+                return execute(request)
+            claimed_at = time.perf_counter()
+            try:
+                message = entry.future.result()
+            except BaseException:
+                # errors are reported the usual way, by running the call for real
+                speculation_stats.add(failed=1)
+                return execute(request)
+            # the tool would have started now; what it still had to run is what the turn waited
+            waited = max(0.0, entry.finished_at - claimed_at)
+            speculation_stats.add(used=1, seconds_saved=entry.finished_at - entry.started_at - waited)
+            return message.model_copy(update={'tool_call_id': request.tool_call['id']})
+
+        return run
+
+
+def new_speculation(cancel_token: Optional[CancellationToken] = None) -> Optional[ToolSpeculation]:
+    return ToolSpeculation(cancel_token) if ENABLED else None
+
+
+def get_speculation(config: Optional[dict]) -> Optional[ToolSpeculation]:
+    return ((config or {}).get('configurable') or {}).get('speculation')
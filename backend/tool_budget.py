@@ -0,0 +1,151 @@
+import json, os
+from typing import Any, Optional
+from langchain_core.messages import ToolMessage
+
+# ----------------
+# Tool output budget
+# ----------------
+# Tool results stay in the thread and are re-sent with every later LLM call of
+# it. Before a result reaches the state it is projected with the rules of its
+# tool (fields kept, lists capped or thinned, floats rounded, long strings cut),
+# minified, and held to a per-message token budget by halving list lengths (or
+# thinning them further) and, as a last resort, cutting the text. The untouched payload is kept as the message's
+# `artifact`, which is never sent to the model: the UI shows it, and the
+# checkpointer stores it as a blob (see backend/checkpoint_serde.py).
+
+MESSAGE_TOKENS = int(os.getenv('CHATBOT_TOOL_MESSAGE_TOKENS', '1000'))
+CHARS_PER_TOKEN = 4  # rough estimate, as in backend/llm_cache.py
+
+# keep: keys to keep, or {key: rule for its value / True for all of it}; applies to every item of a list
+# max_items: list length cap, float_digits: rounding, max_chars: cap for every string
+# every: keep every n-th list item instead of the first max_items, so a time series
+# keeps its whole span; over budget, the step doubles rather than the lists being halved
+PROJECTIONS: dict[str, dict[str, Any]] = {
+    'get_stock_price': {
+        'keep': {'Global Quote': [
+            '01. symbol', '05. price', '08. previous close', '09. change', '10. change percent', '06. volume', '07. latest trading day',
+        ]},
+    },
+    'get_geocoding': {
+        'keep': {'results': ['name', 'latitude', 'longitude', 'country', 'admin1', 'timezone', 'population']},
+        'max_items': 5,
+        'float_digits': 4,
+    },
+    'get_weather': {
+        # the whole 7-day forecast, every 3 hours
+        'keep': ['latitude', 'longitude', 'timezone', 'hourly_units', 'hourly'],
+        'every': 3,
+        'float_digits': 1,
+    },
+    'search_youtube': {
+        'keep': {'searched_content_name': True, 'results': ['title', 'uploader', 'duration', 'views', 'url']},
+        'max_items': 5,
+        'max_chars': 200,
+    },
+    'google_search': {
+        'keep': {'query': True, 'result_urls': ['url', 'title', 'description']},
+        'max_items': 5,
+        'max_chars': 300,
+    },
+}
+
+
+def _project(value: Any, keep: Any) -> Any:
+    if keep is None or keep is True:
+        return value
+    if isinstance(value, list):
+        return [_project(item, keep) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if isinstance(keep, dict):
+        return {key: _project(value[key], rule) for key, rule in keep.items() if key in value}
+    return {key: value[key] for key in keep if key in value}
+
+
+def _shrink(
+    value: Any, max_items: Optional[int], float_digits: Optional[int], max_chars: Optional[int], every: int = 1
+) -> tuple[Any, bool]:
+    """Apply the caps recursively; also returns whether anything was cut."""
+    if isinstance(value, dict):
+        cut = False
+        shrunk = {}
+        for key, item in value.items():
+            shrunk[key], item_cut = _shrink(item, max_items, float_digits, max_chars, every)
+            cut = cut or item_cut
+        return shrunk, cut
+    if isinstance(value, list):
+        cut = (max_items is not None and len(value) > max_items) or (every > 1 and len(value) > 1)
+        shrunk = []
+        for item in value[::every][:max_items]:
+            item, item_cut = _shrink(item, max_items, float_digits, max_chars, every)
+            shrunk.append(item)
+            cut = cut or item_cut
+        return shrunk, cut
+    if isinstance(value, float) and float_digits is not None:
+        return round(value, float_digits), False
+    if isinstance(value, str) and max_chars is not None and len(value) > max_chars:
+        return value[:max_chars] + '…', True
+    return value, False
+
+
+def _longest_list(value: Any) -> int:
+    if isinstance(value, dict):
+        return max((_longest_list(item) for item in value.values()), default=0)
+    if isinstance(value, list):
+        return max([len(value)] + [_longest_list(item) for item in value])
+    return 0
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + f'… [{len(text) - max_chars} more characters not shown]'
+
+
+def _same_json(a: str, b: str) -> bool:
+    # only minified: nothing was lost, no need to keep the raw text around
+    try:
+        return json.loads(a) == json.loads(b)
+    except ValueError:
+        return False
+
+
+def shape_content(tool_name: Optional[str], content: str, max_tokens: int = MESSAGE_TOKENS) -> str:
+    """The model-facing version of a tool result: projected, minified and within `max_tokens`."""
+    budget = max_tokens * CHARS_PER_TOKEN
+    try:
+        value = json.loads(content)
+    except ValueError:
+        value = None
+    if not isinstance(value, (dict, list)):
+        return _truncate(content, budget)
+
+    rule = PROJECTIONS.get(tool_name, {})
+    # payloads the rule does not describe (API errors, rate-limit notes) pass through whole
+    projected = _project(value, rule.get('keep')) or value
+    max_items, every = rule.get('max_items'), rule.get('every', 1)
+    while True:
+        shaped, cut = _shrink(projected, max_items, rule.get('float_digits'), rule.get('max_chars'), every)
+        if cut and isinstance(shaped, dict):
+            shaped['truncated'] = True
+        text = json.dumps(shaped, ensure_ascii=False, separators=(',', ':'), default=str)
+        longest = _longest_list(shaped)
+        if len(text) <= budget or longest <= 1:
+            return _truncate(text, budget)
+        if 'every' in rule:
+            every *= 2
+        else:
+            max_items = longest // 2
+
+
+def shape_tool_result(result: Any) -> Any:
+    """Shape a ToolNode result (ToolMessage) for the model, keeping the raw payload as its artifact."""
+    if not isinstance(result, ToolMessage) or not isinstance(result.content, str):
+        return result
+    shaped = shape_content(result.name, result.content)
+    if shaped == result.content:
+        return result
+    update = {'content': shaped}
+    if not _same_json(shaped, result.content) and result.artifact is None:
+        update['artifact'] = result.content
+    return result.model_copy(update=update)
@@ -1,14 +1,67 @@
-import datetime, math, requests
-from typing import Literal
+import datetime, functools, json, math, requests
+from typing import Annotated, Literal
 from langchain_core.tools import tool
-from langchain_community.tools import DuckDuckGoSearchRun
-from googlesearch import search
-from yt_dlp import YoutubeDL
+from .cancellation import Cancelled, get_cancel_token, raise_if_cancelled
 
+# langchain_community, googlesearch, bs4 and yt_dlp are imported inside the tools
+# that use them: together they are a large share of the backend's cold start, and
+# most turns never call those tools.
 
-from bs4 import BeautifulSoup
 
-search_tool = DuckDuckGoSearchRun(region='us-en')
+@functools.lru_cache(maxsize=None)
+def _duckduckgo():
+    from langchain_community.tools import DuckDuckGoSearchRun
+    return DuckDuckGoSearchRun(region='us-en')
+
+
+@tool('duckduckgo_search')
+def search_tool(query: Annotated[str, 'search query to look up']) -> str:
+    """A wrapper around DuckDuckGo Search. Useful for when you need to answer questions about current events. Input should be a search query."""
+    raise_if_cancelled()
+    return _duckduckgo().invoke(query)
+
+
+class HttpResponse:
+    """The status, headers and complete body http_get read (the parts of requests.Response the tools use)."""
+
+    def __init__(self, response: requests.Response, content: bytes):
+        self.url = response.url
+        self.status_code = response.status_code
+        self.reason = response.reason
+        self.headers = response.headers
+        self.encoding = response.encoding or 'utf-8'
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} {self.reason} for url: {self.url}")
+
+
+def http_get(url: str, timeout: float = 10, **kwargs) -> HttpResponse:
+    """
+    requests.get that stops downloading as soon as the current turn is cancelled.
+    The body is streamed in chunks and the connection is closed on cancel.
+    """
+    token = get_cancel_token()
+    raise_if_cancelled()
+    response = requests.get(url, timeout=timeout, stream=True, **kwargs)
+    unregister = token.on_cancel(response.close) if token else (lambda: None)
+    try:
+        chunks = []
+        for chunk in response.iter_content(chunk_size=16 * 1024):
+            raise_if_cancelled()
+            chunks.append(chunk)
+        return HttpResponse(response, b''.join(chunks))
+    finally:
+        unregister()
+        response.close()
 
 @tool
 def calculator(first_num: float, second_num: float, operation: Literal['add', 'mul', 'sub', 'div', 'mod', 'pow', 'log']):
@@ -134,7 +187,7 @@ def get_stock_price(symbol: str) -> dict:
     with Alpha Vantage with API key in the URL.
     '''
     url = f'https://www.alphavantage.co/query?apikey=7S92EVEUCWASARWC&function=GLOBAL_QUOTE&symbol={symbol}'
-    r = requests.get(url)
+    r = http_get(url)
     return r.json()
 
 @tool
@@ -156,7 +209,7 @@ def get_geocoding(cityname: str):
     :type cityname: str
     '''
     geocoding_url = f'https://geocoding-api.open-meteo.com/v1/search?name={cityname}'
-    geocoding = requests.get(geocoding_url)
+    geocoding = http_get(geocoding_url)
     return geocoding.json()
 
 @tool
@@ -173,7 +226,7 @@ def get_weather(latitude: float, longitude: float):
     '''
 
     weather_url = f'https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&hourly=temperature_2m,relative_humidity_2m,dew_point_2m,rain,snow_depth&timezone=auto&format=json'
-    weather_response = requests.get(weather_url)
+    weather_response = http_get(weather_url)
     return weather_response.json()
 
 @tool
@@ -205,9 +258,9 @@ def calculate_bmi(height: float, weight: float) -> float:
 #     return {'video_url': video_url}
 
 @tool
-def google_search(query: str, max_results: int = 15) -> list[str]:
+def google_search(query: str, max_results: int = 15) -> dict:
     """
-    Perform a Google web search and return a list of result URLs.
+    Perform a Google web search and return the result URLs with their titles and descriptions.
 
     This tool uses an unofficial Google search library that scrapes
     publicly available search results. It is intended for lightweight,
@@ -218,16 +271,25 @@ def google_search(query: str, max_results: int = 15) -> list[str]:
         max_results (int): Maximum number of URLs to return. Default is 5.
 
     Returns:
-        list[str]: A list of result URLs in order of relevance.
+        dict: The query and `result_urls`, a list of {url, title, description} in order of relevance.
 
     Notes:
         - This tool does NOT use an official Google API.
         - Excessive usage may result in CAPTCHA or temporary blocking.
         - Intended for informational and research purposes only.
     """
-    try:
-        return {'query': query, 'result_urls': list(search(query,num_results=max_results, unique=True,  advanced=True, sleep_interval=2))}
+    from googlesearch import search
 
+    try:
+        results = []
+        # check between results so a cancelled turn skips the remaining pages / sleeps
+        for result in search(query,num_results=max_results, unique=True,  advanced=True, sleep_interval=2):
+            raise_if_cancelled()
+            results.append({'url': result.url, 'title': result.title, 'description': result.description})
+        return {'query': query, 'result_urls': results}
+
+    except Cancelled:
+        raise
     except Exception as e:
         return [f"Search failed: {str(e)}"]
 
@@ -263,9 +325,11 @@ def scrape_webpage(url: str, max_chars: int = 4000) -> dict:
             "User-Agent": "Mozilla/5.0 (compatible; LangGraphBot/1.0)"
         }
 
-        response = requests.get(url, headers=headers, timeout=10)
+        response = http_get(url, headers=headers, timeout=10)
         response.raise_for_status()
+        raise_if_cancelled()
 
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(response.text, "html.parser")
 
         # Remove scripts and styles
@@ -283,6 +347,8 @@ def scrape_webpage(url: str, max_chars: int = 4000) -> dict:
             "truncated": truncated
         }
 
+    except Cancelled:
+        raise
     except Exception as e:
         return {
             "url": url,
@@ -310,9 +376,13 @@ def search_youtube(content_name: str, limit: int = 5) -> list[dict]:
     "default_search": f"ytsearch{limit}"
     }
 
+    from yt_dlp import YoutubeDL
+
     results = []
+    raise_if_cancelled()
     with YoutubeDL(ydl_opts) as ydl:
         info = ydl.extract_info(content_name, download=False)
+        raise_if_cancelled()
         for entry in info.get("entries", []):
             results.append({
                 "title": entry.get("title"),
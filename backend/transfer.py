@@ -0,0 +1,215 @@
+import gzip, json, os
+from typing import IO, Iterable, Optional
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, message_to_dict, messages_from_dict
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.sqlite import SqliteSaver
+from .db import (
+    Shard,
+    shards,
+    shard_for_user,
+    init_db,
+    iter_users,
+    iter_rooms,
+    get_latest_checkpoint_row,
+    import_users,
+    get_existing_threads,
+    import_thread_batch,
+    defer_search_merges,
+)
+from .archive import read_archived_thread, _ensure_checkpoint_tables
+from .checkpoint_serde import CompactSerializer
+
+try:
+    import zstandard
+except ImportError:  # gzip is always available
+    zstandard = None
+
+# ----------------
+# Bulk export / import
+# ----------------
+# A dump is JSONL, gzip- or zstd-compressed by file name: one header line,
+# then `user` lines, then every `room` followed by its `message` lines
+# (langchain's message_to_dict, artifacts included). Only a thread's latest
+# state is exported, read straight from its newest checkpoint (or from the
+# archive, without rehydrating it), so memory holds one thread at a time.
+# Importing writes IMPORT_BATCH threads per transaction and shard: each thread
+# gets one fresh checkpoint with its messages, its room row and its search rows.
+# The only index work deferred is FTS5 segment merging, done once at the end:
+# the other tables the batches write have no secondary indexes, just their
+# primary keys, which the inserts maintain (blob refs are written with the
+# blobs, before each batch). Threads that already exist are skipped.
+
+FORMAT_VERSION = 1
+IMPORT_BATCH = int(os.getenv('CHATBOT_IMPORT_BATCH', '200'))
+USER_BATCH = 1000
+
+
+def open_dump(path: str, mode: str = 'r') -> IO[str]:
+    """Open a dump for reading ('r') or writing ('w'); `.gz` and `.zst` names are compressed."""
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError('zstandard is required for .zst dumps')
+        return zstandard.open(path, mode + 't', encoding='utf-8')
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=6)
+    return open(path, mode, encoding='utf-8')
+
+
+def _line(out: IO[str], record: dict):
+    out.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str))
+    out.write('\n')
+
+
+def _thread_messages(shard: Shard, serde: CompactSerializer, room: dict) -> list[BaseMessage]:
+    if room['archived_at'] is not None:
+        exported = read_archived_thread(room['thread_id'], room['user_id'])
+        if not exported:
+            return []
+        columns = exported['checkpoints']['columns']
+        rows = [dict(zip(columns, row)) for row in exported['checkpoints']['rows'] if row[columns.index('checkpoint_ns')] == '']
+        latest = max(rows, key=lambda row: row['checkpoint_id'], default=None)
+        row = (latest['type'], latest['checkpoint']) if latest else None
+        # the thread's blobs were archived with it
+        blobs = {r[0]: (r[1], r[2]) for r in exported.get('checkpoint_blobs', {}).get('rows', [])}
+    else:
+        row, blobs = get_latest_checkpoint_row(shard, room['thread_id']), None
+    if row is None:
+        return []
+    return serde.loads_typed(row, blobs)['channel_values'].get('messages', [])
+
+
+def export_threads(out: IO[str], user_id: Optional[int] = None, progress=None) -> dict:
+    """Write the dump of one user (or of everyone) to `out`; returns counts."""
+    init_db()
+    counts = {'users': 0, 'rooms': 0, 'messages': 0}
+    _line(out, {'type': 'header', 'version': FORMAT_VERSION, 'user_id': user_id})
+    for user in iter_users(user_id):
+        _line(out, {'type': 'user', **user})
+        counts['users'] += 1
+
+    for shard in shards if user_id is None else [shard_for_user(user_id)]:
+        serde = CompactSerializer(shard)
+        for room in iter_rooms(shard, user_id):
+            messages = _thread_messages(shard, serde, room)
+            _line(out, {
+                'type': 'room',
+                'thread_id': room['thread_id'],
+                'user_id': room['user_id'],
+                'thread_title': room['thread_title'],
+                'created_at': room['created_at'],
+                'last_active_at': room['last_active_at'],
+            })
+            for message in messages:
+                _line(out, {'type': 'message', 'thread_id': room['thread_id'], 'message': message_to_dict(message)})
+            counts['rooms'] += 1
+            counts['messages'] += len(messages)
+            if progress and counts['rooms'] % 1000 == 0:
+                progress(counts)
+    return counts
+
+
+class _Importer:
+    def __init__(self, batch: int, progress=None):
+        self.batch = batch
+        self.progress = progress
+        self.counts = {'users': 0, 'rooms': 0, 'messages': 0, 'skipped': 0}
+        self.user_ids: dict[int, int] = {}
+        self.users: list[dict] = []
+        self.pending: dict[int, list[tuple[dict, list]]] = {}
+        self.thread: Optional[tuple[dict, list]] = None
+        self.serdes = {shard.index: CompactSerializer(shard) for shard in shards}
+        self.saver = SqliteSaver(conn=shards[0].conn)
+
+    def add(self, record: dict):
+        kind = record.get('type')
+        if kind == 'user':
+            self.users.append(record)
+            if len(self.users) >= USER_BATCH:
+                self.flush_users()
+        elif kind == 'room':
+            self.flush_users()
+            self.end_thread()
+            room = {key: record.get(key) for key in ('thread_id', 'user_id', 'thread_title', 'created_at', 'last_active_at')}
+            room['user_id'] = self.user_ids.get(room['user_id'], room['user_id'])
+            self.thread = (room, [])
+        elif kind == 'message':
+            if self.thread is None or self.thread[0]['thread_id'] != record['thread_id']:
+                raise ValueError(f"message of thread {record['thread_id']} outside its room")
+            self.thread[1].append(record['message'])
+        elif kind == 'header':
+            if record.get('version') != FORMAT_VERSION:
+                raise ValueError(f"Unsupported dump version {record.get('version')}")
+        else:
+            raise ValueError(f'Unknown record type {kind!r}')
+
+    def flush_users(self):
+        if self.users:
+            self.user_ids.update(import_users(self.users))
+            self.counts['users'] += len(self.users)
+            self.users = []
+
+    def end_thread(self):
+        if self.thread is None:
+            return
+        shard = shard_for_user(self.thread[0]['user_id'])
+        threads = self.pending.setdefault(shard.index, [])
+        threads.append(self.thread)
+        self.thread = None
+        if len(threads) >= self.batch:
+            self.write(shard)
+
+    def write(self, shard: Shard):
+        threads, self.pending[shard.index] = self.pending.get(shard.index, []), []
+        existing = get_existing_threads(shard, [room['thread_id'] for room, _ in threads])
+        serde = self.serdes[shard.index]
+        rooms, checkpoints, search = [], [], []
+        for room, message_dicts in threads:
+            if room['thread_id'] in existing:
+                self.counts['skipped'] += 1
+                continue
+            messages = messages_from_dict(message_dicts)
+            checkpoint = empty_checkpoint()
+            checkpoint['channel_values'] = {'messages': messages}
+            checkpoint['channel_versions'] = {'messages': self.saver.get_next_version(None, None)}
+            # serialized (large tool outputs stored as blobs, with their refs) before the batch transaction opens
+            with serde.thread(room['thread_id']):
+                type_, data = serde.dumps_typed(checkpoint)
+            metadata = json.dumps({'source': 'update', 'step': -1, 'parents': {}, 'user_id': room['user_id']}).encode()
+            rooms.append(room)
+            checkpoints.append((room['thread_id'], checkpoint['id'], type_, data, metadata))
+            search.append((room['thread_id'], [
+                ('user' if isinstance(m, HumanMessage) else 'assistant', m.text)
+                for m in messages
+                if isinstance(m, (HumanMessage, AIMessage))
+            ]))
+            self.counts['messages'] += len(messages)
+        if rooms:
+            import_thread_batch(shard, rooms, checkpoints, search)
+        self.counts['rooms'] += len(rooms)
+        if self.progress:
+            self.progress(self.counts)
+
+    def finish(self):
+        self.flush_users()
+        self.end_thread()
+        for shard in shards:
+            if self.pending.get(shard.index):
+                self.write(shard)
+
+
+def import_threads(lines: Iterable[str], batch: int = IMPORT_BATCH, progress=None) -> dict:
+    """Load a dump (an iterable of its lines); returns counts. Safe to re-run: existing threads are skipped."""
+    init_db()
+    _ensure_checkpoint_tables()
+    importer = _Importer(batch, progress)
+    for shard in shards:
+        defer_search_merges(shard, True)
+    try:
+        for line in lines:
+            if line.strip():
+                importer.add(json.loads(line))
+        importer.finish()
+    finally:
+        for shard in shards:
+            defer_search_merges(shard, False)
+    return importer.counts
@@ -0,0 +1,142 @@
+import os, threading, time
+from typing import Any, Optional
+from cachetools import TTLCache
+from .db import (
+    USAGE_PERIODS,
+    record_usage,
+    get_usage_totals,
+    get_usage_report,
+    get_users_by_id,
+    get_user_details,
+    purge_usage,
+)
+
+# ----------------
+# Usage accounting
+# ----------------
+# A TurnUsage travels in `config['configurable']['usage']` (like the cancel
+# token) and collects what one turn consumed: tokens of every LLM call that
+# reached the provider (cache hits cost nothing), tool calls by name, and the
+# turn's latency. It is recorded once when the turn ends, which also updates the
+# hour / day rollups that quotas are checked against before the next turn
+# starts (see the usage helpers in backend/db.py).
+
+# 0 = no limit; admins are never limited
+QUOTAS = {
+    ('hour', 'turns'): int(os.getenv('CHATBOT_QUOTA_TURNS_PER_HOUR', '0')),
+    ('day', 'turns'): int(os.getenv('CHATBOT_QUOTA_TURNS_PER_DAY', '0')),
+    ('hour', 'tokens'): int(os.getenv('CHATBOT_QUOTA_TOKENS_PER_HOUR', '0')),
+    ('day', 'tokens'): int(os.getenv('CHATBOT_QUOTA_TOKENS_PER_DAY', '0')),
+}
+EVENT_RETENTION = float(os.getenv('CHATBOT_USAGE_EVENT_RETENTION_DAYS', '90')) * 86400
+HOURLY_RETENTION = float(os.getenv('CHATBOT_USAGE_HOURLY_RETENTION_DAYS', '14')) * 86400
+PURGE_EVERY = 1000  # recorded turns between purges of old usage rows
+
+# is_admin per user, so quota checks do not read `users` on every turn
+_admins: TTLCache = TTLCache(maxsize=10000, ttl=60)
+_admins_lock = threading.Lock()
+_recorded = 0
+_recorded_lock = threading.Lock()
+
+
+class QuotaExceeded(ValueError):
+    def __init__(self, period: str, metric: str, limit: int, resets_at: float):
+        self.resets_at = resets_at
+        resets = time.strftime('%H:%M UTC', time.gmtime(resets_at))
+        unit = metric[:-1] if limit == 1 else metric
+        super().__init__(f"You have used your {'hourly' if period == 'hour' else 'daily'} limit of {limit:,} {unit}. It resets at {resets}.")
+
+
+class TurnUsage:
+    def __init__(self, user_id: int, thread_id: str):
+        self.user_id = user_id
+        self.thread_id = thread_id
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        # the title and chat nodes of a turn run in parallel
+        self._lock = threading.Lock()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.tools: dict[str, int] = {}
+        self.recorded = False
+
+    def add_llm_response(self, response: Any):
+        usage = getattr(response, 'usage_metadata', None)
+        if not usage:
+            return  # served from the LLM cache, or a model that reports nothing
+        with self._lock:
+            self.prompt_tokens += usage.get('input_tokens', 0)
+            self.completion_tokens += usage.get('output_tokens', 0)
+            self.llm_calls += 1
+
+    def add_tool_call(self, name: str):
+        with self._lock:
+            self.tools[name] = self.tools.get(name, 0) + 1
+
+    def record(self, status: str):
+        """Store the turn (once); failures are swallowed, accounting never fails a turn."""
+        global _recorded
+        with self._lock:
+            if self.recorded:
+                return
+            self.recorded = True
+            latency_ms = int((time.perf_counter() - self._start) * 1000)
+            tools = dict(self.tools)
+        try:
+            record_usage(
+                self.user_id, self.thread_id, self.started_at, status,
+                self.prompt_tokens, self.completion_tokens, self.llm_calls, tools, latency_ms,
+            )
+            with _recorded_lock:
+                _recorded += 1
+                purge = _recorded % PURGE_EVERY == 0
+            if purge:
+                now = time.time()
+                purge_usage(now - EVENT_RETENTION, now - HOURLY_RETENTION)
+        except Exception:
+            pass
+
+
+def get_turn_usage(config: Optional[dict]) -> Optional[TurnUsage]:
+    return ((config or {}).get('configurable') or {}).get('usage')
+
+
+def _is_admin(user_id: int) -> bool:
+    with _admins_lock:
+        cached = _admins.get(user_id)
+    if cached is None:
+        details = get_user_details(user_id) or {}
+        cached = bool(details.get('is_admin'))
+        with _admins_lock:
+            _admins[user_id] = cached
+    return cached
+
+
+def check_quota(user_id: int):
+    """Raise QuotaExceeded if the user has used up a quota; reads two rollup rows."""
+    if not any(QUOTAS.values()) or _is_admin(user_id):
+        return
+    now = time.time()
+    totals = get_usage_totals(user_id, now)
+    for (period, metric), limit in QUOTAS.items():
+        if not limit:
+            continue
+        used = totals[period]['turns'] if metric == 'turns' else totals[period]['prompt_tokens'] + totals[period]['completion_tokens']
+        if used >= limit:
+            resets_at = (now // USAGE_PERIODS[period] + 1) * USAGE_PERIODS[period]
+            raise QuotaExceeded(period, metric, limit, resets_at)
+
+
+def usage_report(period: str = 'day', days: float = 7) -> dict:
+    """Usage of all users over the last `days`, for the admin view."""
+    if period not in USAGE_PERIODS:
+        raise ValueError(f"period must be one of {', '.join(USAGE_PERIODS)}")
+    report = get_usage_report(period, time.time() - days * 86400)
+    users = get_users_by_id([row['user_id'] for row in report['users']])
+    for row in report['users']:
+        user = users.get(row['user_id'], {})
+        row['email'] = user.get('email')
+        row['name'] = ' '.join(filter(None, (user.get('first_name'), user.get('last_name'))))
+    report['quotas'] = {f"{metric}_per_{period}": limit for (period, metric), limit in QUOTAS.items() if limit}
+    return report
@@ -0,0 +1,135 @@
+import os, json
+from typing import Generator, Optional
+import httpx
+from httpx_sse import connect_sse
+
+# ----------------
+# Chat service client
+# ----------------
+# Thin HTTP client for backend/service.py. Function names and return values
+# mirror the backend helpers the UI used to import directly.
+
+API_URL = os.getenv('CHATBOT_API_URL', 'http://127.0.0.1:8000')
+
+client = httpx.Client(base_url=API_URL, timeout=httpx.Timeout(30.0, read=300.0))
+
+
+def _json(response: httpx.Response):
+    if response.status_code >= 400:
+        try:
+            message = response.json().get('error')
+        except ValueError:
+            message = None
+        raise ValueError(message or f'Chat service error ({response.status_code})')
+    return response.json()
+
+
+def _auth(token: str) -> dict:
+    # every route but sign-in / sign-up / password resets needs the session token
+    return {'Authorization': f'Bearer {token}'}
+
+
+# ---------- Auth ----------
+
+# sign_up / sign_in / get_session return the session: {user_id, token, expires_at, user_details}
+
+def sign_up(email: str, password: str, first_name: str, last_name: str | None) -> dict:
+    payload = {'email': email, 'password': password, 'first_name': first_name, 'last_name': last_name}
+    return _json(client.post('/auth/sign_up', json=payload))
+
+
+def sign_in(email: str, password: str) -> dict:
+    return _json(client.post('/auth/sign_in', json={'email': email, 'password': password}))
+
+
+def get_session(token: str) -> dict:
+    return _json(client.get('/auth/session', headers=_auth(token)))
+
+
+def create_reset_token(email: str) -> str:
+    response = client.post('/auth/reset_token', json={'email': email})
+    if response.status_code == 404:
+        # off unless CHATBOT_INSECURE_RESET_TOKEN_ROUTE is set (see backend/service.py)
+        raise ValueError('Ask an administrator for a reset token and enter it below')
+    return _json(response)['token']
+
+
+def reset_password(token: str, new_password: str):
+    _json(client.post('/auth/reset_password', json={'token': token, 'new_password': new_password}))
+
+
+# ---------- Users & threads ----------
+# `token` is the session token from sign_in / sign_up; the service only serves
+# the user it belongs to.
+
+def get_user_details(token: str, user_id: int) -> Optional[dict]:
+    return _json(client.get(f'/users/{user_id}', headers=_auth(token)))
+
+
+def get_user_rooms(token: str, user_id: int) -> list[dict]:
+    return _json(client.get(f'/users/{user_id}/rooms', headers=_auth(token)))
+
+
+def search_user_messages(token: str, user_id: int, query: str, limit: int = 20) -> list[dict]:
+    return _json(client.get(f'/users/{user_id}/search', params={'q': query, 'limit': limit}, headers=_auth(token)))
+
+
+def get_thread_title(token: str, thread_id: str, user_id: int) -> Optional[str]:
+    return _json(client.get(f'/threads/{thread_id}/title', params={'user_id': user_id}, headers=_auth(token)))['thread_title']
+
+
+def get_chat_history(token: str, thread_id: str, user_id: int) -> list[dict]:
+    return _json(client.get(f'/threads/{thread_id}/history', params={'user_id': user_id}, headers=_auth(token)))
+
+
+# ---------- Chat runs ----------
+
+def start_run(token: str, user_message: str, thread_id: str, user_id: int, on_busy: str = 'queue') -> dict:
+    payload = {'message': user_message, 'user_id': user_id, 'on_busy': on_busy}
+    return _json(client.post(f'/threads/{thread_id}/runs', json=payload, headers=_auth(token)))
+
+
+def get_run(token: str, thread_id: str, run_id: str, user_id: int) -> dict:
+    return _json(client.get(f'/threads/{thread_id}/runs/{run_id}', params={'user_id': user_id}, headers=_auth(token)))
+
+
+def cancel_run(token: str, thread_id: str, run_id: str, user_id: int):
+    _json(client.post(f'/threads/{thread_id}/runs/{run_id}/cancel', json={'user_id': user_id}, headers=_auth(token)))
+
+
+def attach_run(token: str, thread_id: str, run_id: str, user_id: int, offset: int = 0) -> Generator[tuple[int, str, dict], None, None]:
+    """
+    Yield `(seq, event, data)` for a background run starting at `offset`:
+    `token` and `tool` events, then `done` / `cancelled` (or raise on `error`).
+    """
+    params = {'user_id': user_id, 'offset': offset}
+    with connect_sse(client, 'GET', f'/threads/{thread_id}/runs/{run_id}/events', params=params, headers=_auth(token)) as event_source:
+        if event_source.response.status_code >= 400:
+            event_source.response.read()
+            _json(event_source.response)
+        for sse in event_source.iter_sse():
+            data = json.loads(sse.data) if sse.data else {}
+            if sse.event == 'error':
+                raise ValueError(data.get('error') or 'Chat failed')
+            yield int(sse.id), sse.event, data
+            if sse.event in ('done', 'cancelled'):
+                return
+
+
+# ---------- Admin ----------
+
+def get_usage_report(token: str, period: str = 'day', days: float = 7) -> dict:
+    """Usage of all users (admins only): {'users', 'series', 'tools', 'quotas'}."""
+    params = {'period': period, 'days': days}
+    return _json(client.get('/admin/usage', params=params, headers=_auth(token)))
+
+
+def get_profiling(token: str) -> dict:
+    """Users whose turns are profiled and the latest stored profiles (admins only): {'targets', 'profiles'}."""
+    return _json(client.get('/admin/profiling', headers=_auth(token)))
+
+
+def set_profiling(token: str, user_id: int, turns: int = 1, hours: float = 24) -> dict:
+    """Profile the next `turns` turns of a user (admins only); 0 turns stops."""
+    payload = {'user_id': user_id, 'turns': turns, 'hours': hours}
+    return _json(client.post('/admin/profiling', json=payload, headers=_auth(token)))
@@ -1,26 +1,34 @@
-import sys, os, uuid
+import sys, os, time, uuid, datetime
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(ROOT_DIR)
 import streamlit as st
-from backend.langgraph_tool_backend import (
-    get_chat_stream,
+# The UI is a thin client of the chat service (backend/service.py)
+from frontend.api_client import (
+    start_run,
+    attach_run,
+    get_run,
+    cancel_run,
     get_chat_history,
     get_user_rooms,
+    search_user_messages,
     get_thread_title,
     get_user_details,
-    AIMessage,
-    ToolMessage
+    sign_up,
+    sign_in,
+    create_reset_token,
+    reset_password,
+    get_usage_report,
+    get_profiling,
+    set_profiling,
 )
-from backend.auth import sign_up, sign_in, create_reset_token, reset_password
-from backend.db import init_db
-
-# ---------------------- INIT DB ----------------------
-init_db()  # ensure tables exist
 
 # ---------------------- SESSION ----------------------
 if 'user_id' not in st.session_state:
     st.session_state['user_id'] = None
 
+if 'session_token' not in st.session_state:
+    st.session_state['session_token'] = None
+
 if 'user_details' not in st.session_state:
     st.session_state['user_details'] = None
 
@@ -33,12 +41,33 @@ if 'thread_id' not in st.session_state:
 if 'message_history' not in st.session_state:
     st.session_state['message_history'] = []
 
+if 'active_runs' not in st.session_state:
+    st.session_state['active_runs'] = {}  # thread_id -> in-flight run
+
 if 'auth_page_type' not in st.session_state:
     st.session_state['auth_page_type'] = 'sign_in' 
 
 if 'is_authenticated' not in st.session_state:
     st.session_state['is_authenticated'] = False
 
+# ---------------------- SESSION TOKEN ----------------------
+# The signed session token lives in session state only, never in the URL where
+# history, shared links, proxy logs and Referer headers would leak it. Every
+# call to the chat service sends it; a reload asks for a new sign-in.
+def start_session(session: dict):
+    st.session_state['user_id'] = session['user_id']
+    st.session_state['user_details'] = session.get('user_details') or {}
+    st.session_state['session_token'] = session['token']
+
+def end_session():
+    st.session_state['user_id'] = None
+    st.session_state['user_details'] = None
+    st.session_state['session_token'] = None
+
+# links from before tokens left the URL: drop the credential, do not use it
+if 'session' in st.query_params:
+    st.query_params.pop('session', None)
+
 # ---------------------- AUTH UI ----------------------
 def login_ui():
     st.title('Welcome to LangGraph Chatbot')
@@ -118,8 +147,7 @@ def signin_ui():
             try:
                 if not email or not password:
                     raise ValueError('Email & password fields are required')
-                user_id = sign_in(email, password)
-                st.session_state['user_id'] = user_id
+                start_session(sign_in(email, password))
                 st.success('Logged in successfully!')
                 st.session_state['celebrate'] = True
                 st.rerun()
@@ -140,8 +168,7 @@ def signup_ui():
                     raise ValueError('Email & password fields are required')
                 if new_pass != confirm_pass:
                     raise ValueError('Passward didn\'t match')
-                user_id = sign_up(new_email, new_pass, first_name, last_name)
-                st.session_state['user_id'] = user_id
+                start_session(sign_up(new_email, new_pass, first_name, last_name))
                 st.session_state['celebrate'] = True
                 st.success('Account created and logged in!')
                 st.rerun()
@@ -153,6 +180,8 @@ def forgot_password_ui():
     is_authenticated = st.session_state.get('is_authenticated', False)
     with st.form(enter_to_submit=True, key='forgot_password'):
         email = st.text_input('Email :red[*]', placeholder='Enter your email address' ,key='authenticate_email', disabled=is_authenticated)
+        if not is_authenticated:
+            given_token = st.text_input('Reset token', placeholder='The token an administrator gave you', type='password', key='given_reset_token')
         if is_authenticated:
             new_pass = st.text_input('Password :red[*]', placeholder='Enter your password', type='password', key='update_pass')
             confirm_pass = st.text_input('Confirm Password :red[*]', placeholder='Confirm password', type='password', key='confirm_update_pass')
@@ -162,7 +191,7 @@ def forgot_password_ui():
                 if not st.session_state['is_authenticated']:
                     if not email:
                         raise ValueError('Email field is required')
-                    reset_token = create_reset_token(email=email)
+                    reset_token = given_token or create_reset_token(email=email)
                     st.session_state['password_reset_token'] = reset_token
                     st.session_state['is_authenticated'] = True
                     st.rerun()
@@ -185,11 +214,13 @@ if st.session_state['user_id'] is None:
     st.stop()  # stop here until user logs in
 
 user_id = st.session_state['user_id']
+token = st.session_state['session_token']
 assistant_name = os.getenv('ASSISTANT_NAME')
 
-if not st.session_state['user_details']:
-    global user_details
-    user_details = get_user_details(user_id)
+# fetched once per login (sign-in and session restore already bring them)
+if st.session_state['user_details'] is None:
+    st.session_state['user_details'] = get_user_details(token, user_id) or {}
+user_details = st.session_state['user_details']
 
 if st.session_state.get('celebrate'):
     st.balloons()
@@ -214,7 +245,7 @@ def add_thread(thread_id):
         st.session_state['thread_ids'].add(thread_id)
 
 # ---------------------- LOAD USER THREADS ----------------------
-st.session_state['chat_threads'] = get_user_rooms(user_id)
+st.session_state['chat_threads'] = get_user_rooms(token, user_id)
 
 if 'thread_ids' not in st.session_state:
     st.session_state['thread_ids'] = {t['thread_id'] for t in st.session_state['chat_threads']}
@@ -225,7 +256,7 @@ if 'thread_id' not in st.session_state or st.session_state['thread_id'] is None:
     st.session_state['thread_id'] = threads[0]['thread_id'] if threads else generate_thread_id()
 
 st.session_state['message_history'] = get_chat_history(
-    st.session_state['thread_id'], user_id
+    token, st.session_state['thread_id'], user_id
 ) or []
 
 add_thread(st.session_state['thread_id'])
@@ -235,13 +266,118 @@ with st.sidebar:
     st.title('LangGraph Chatbot')
     with st.container(horizontal=True, horizontal_alignment='distribute'):
         if st.button('Logout', icon=":material/logout:"):
-            st.session_state['user_id'] = None
-            st.session_state['user_details'] = None
+            end_session()
             st.rerun()
         if st.button('New Chat', icon=":material/edit_square:"):
             reset_chat()
     # st.link_button(f":blue[{user_details.get('email')}]",url=f"/mailto:{user_details.get('email')}", type='tertiary' )
     # st.divider()
+    if user_details.get('is_admin'):
+        st.toggle('Usage dashboard', key='show_usage')
+
+# ---------------------- ADMIN: USAGE ----------------------
+# Read from the hourly / daily rollups (see backend/usage.py), so it stays quick
+# however many turns have been recorded.
+USAGE_WINDOWS = {'Last 24 hours': ('hour', 1), 'Last 7 days': ('day', 7), 'Last 30 days': ('day', 30)}
+
+def usage_dashboard():
+    st.title('Usage')
+    window = st.radio('Window', list(USAGE_WINDOWS), index=1, horizontal=True, label_visibility='collapsed')
+    period, days = USAGE_WINDOWS[window]
+    try:
+        report = get_usage_report(token, period, days)
+    except Exception as e:
+        st.error(str(e))
+        return
+
+    users = report['users']
+    turns = sum(u['turns'] for u in users)
+    tokens = sum(u['prompt_tokens'] + u['completion_tokens'] for u in users)
+    with st.container(horizontal=True):
+        st.metric('Turns', f"{turns:,}")
+        st.metric('Tokens', f"{tokens:,}")
+        st.metric('Tool calls', f"{sum(u['tool_calls'] for u in users):,}")
+        st.metric('Avg. turn latency', f"{sum(u['latency_ms'] for u in users) / turns / 1000:.1f} s" if turns else '–')
+    if report['quotas']:
+        st.caption('Quotas: ' + ' · '.join(f"{name.replace('_', ' ')}: {limit:,}" for name, limit in report['quotas'].items()))
+
+    st.subheader('Tokens over time')
+    label = '%H:00' if period == 'hour' else '%b %d'
+    st.bar_chart(
+        [
+            {
+                'time': datetime.datetime.fromtimestamp(row['bucket'], datetime.timezone.utc).strftime(label),
+                'prompt': row['prompt_tokens'],
+                'completion': row['completion_tokens'],
+            }
+            for row in report['series']
+        ],
+        x='time', y=['prompt', 'completion'], stack=True,
+    )
+
+    st.subheader('By user')
+    st.dataframe(
+        [
+            {
+                'user': u['name'] or f"#{u['user_id']}",
+                'email': u['email'],
+                'turns': u['turns'],
+                'prompt tokens': u['prompt_tokens'],
+                'completion tokens': u['completion_tokens'],
+                'tool calls': u['tool_calls'],
+                'avg. latency (s)': round(u['latency_ms'] / u['turns'] / 1000, 2) if u['turns'] else None,
+            }
+            for u in users
+        ],
+        hide_index=True, width='stretch',
+    )
+
+    st.subheader('Tool calls')
+    st.dataframe(report['tools'], hide_index=True, width='stretch')
+
+    profiling_panel(users)
+
+# Profiles of a user's next turns are saved by the service workers that ran them
+# (see backend/profiling.py); scripts/profiles.py lists, shows and diffs them.
+def profiling_panel(users):
+    st.subheader('Turn profiling')
+    names = {u['user_id']: f"{u['name'] or '#' + str(u['user_id'])} ({u['email']})" for u in users}
+    with st.form('profiling', border=False):
+        with st.container(horizontal=True, vertical_alignment='bottom'):
+            target = st.selectbox('User', list(names), format_func=names.get)
+            turns = st.number_input('Next turns', min_value=0, max_value=1000, value=1, help='0 stops profiling the user')
+            submitted = st.form_submit_button('Profile')
+    if submitted and target is not None:
+        try:
+            set_profiling(token, target, int(turns))
+        except Exception as e:
+            st.error(str(e))
+    try:
+        profiling = get_profiling(token)
+    except Exception as e:
+        st.error(str(e))
+        return
+    if profiling['targets']:
+        st.caption('Profiling: ' + ' · '.join(f"{names.get(t['user_id'], '#' + str(t['user_id']))}: {t['turns_left']} turn(s) left" for t in profiling['targets']))
+    st.dataframe(
+        [
+            {
+                'started': datetime.datetime.fromtimestamp(p['started_at']).strftime('%b %d %H:%M:%S'),
+                'user': names.get(p['user_id'], f"#{p['user_id']}"),
+                'thread': p['thread_id'],
+                'run': p['run_id'],
+                'status': p['status'],
+                'duration (s)': round(p['duration_s'], 2),
+                'busy samples': p['samples'],
+            }
+            for p in profiling['profiles']
+        ],
+        hide_index=True, width='stretch',
+    )
+
+if user_details.get('is_admin') and st.session_state.get('show_usage'):
+    usage_dashboard()
+    st.stop()
 
 # ---------------------- CHAT UI ----------------------
 st.title(f"👋 Hello {user_details.get('first_name') or 'there'}!")
@@ -251,6 +387,85 @@ st.caption(f"You’re chatting with {f':green[**{assistant_name}**],' if assista
 
 st.divider()
 
+# ---------------------- BACKGROUND RUNS ----------------------
+# Turns run in the chat service as background jobs. Only the run id, the
+# event offset and the partial answer live in session state, so a rerun or a
+# thread switch just detaches; coming back reattaches from the offset.
+on_busy = os.getenv('CHATBOT_ON_BUSY', 'queue')
+
+show_timings = os.getenv('CHATBOT_UI_TIMINGS') == '1'
+
+def format_size(chars: int) -> str:
+    return f"{chars / 1024:.1f} KB" if chars >= 1024 else f"{chars} chars"
+
+def render_run(run):
+    with st.chat_message('assistant'):
+        # cancels the LLM call / tools server-side; the rerun then shows the partial answer
+        st.button(
+            'Stop generating', icon=":material/stop_circle:", type='tertiary', key=f"stop_{run['run_id']}",
+            on_click=cancel_run, args=(token, run['thread_id'], run['run_id'], user_id),
+        )
+        # one collapsible status box per tool call, driven by the small tool_start / tool events
+        tool_boxes = {}
+        timings = {'start': time.perf_counter(), 'first_token': None, 'chunks': 0}
+
+        def tool_box(tool_id, tool_name):
+            if tool_id not in tool_boxes:
+                tool_boxes[tool_id] = st.status(f"🔧 Using `{tool_name}` …", expanded=False)
+            return tool_boxes[tool_id]
+
+        # Generator to stream AI message only
+        def stream_ai_only():
+            if run['content']:
+                yield run['content']
+            for seq, event, data in attach_run(token, run['thread_id'], run['run_id'], user_id, offset=run['offset']):
+                run['offset'] = seq + 1
+                if event == 'tool_start':
+                    for tool in data['tools']:
+                        tool_box(tool['id'] or tool['name'], tool['name'])
+                elif event == 'tool':
+                    box = tool_box(data.get('id') or data['name'], data['name'])
+                    cut = data['chars'] - len(data['preview'])
+                    box.code(data['preview'], language='json', wrap_lines=True, height=240 if len(data['preview']) > 800 else 'content')
+                    if cut > 0:
+                        box.caption(f"Preview: first {len(data['preview'])} of {data['chars']} characters")
+                    box.update(label=f"✅ `{data['name']}` · {format_size(data['chars'])}", state='complete', expanded=False)
+
+                # Stream ONLY assistant tokens (the service sends them in batches)
+                elif event == 'token':
+                    if timings['first_token'] is None:
+                        timings['first_token'] = time.perf_counter() - timings['start']
+                    timings['chunks'] += 1
+                    run['content'] += data['content']
+                    yield data['content']
+
+        assistant_response = st.write_stream(stream_ai_only())
+        for box in tool_boxes.values():
+            box.update(state='complete', expanded=False)
+        if show_timings:
+            total = time.perf_counter() - timings['start']
+            first = f"{timings['first_token'] * 1000:.0f} ms" if timings['first_token'] is not None else '–'
+            st.caption(f"First token {first} · rendered in {total * 1000:.0f} ms · {timings['chunks']} chunks")
+
+    st.session_state['active_runs'].pop(run['thread_id'], None)
+    # store assistant output in session state
+    st.session_state['message_history'].append({
+        'role': 'assistant',
+        'content': assistant_response
+    })
+
+active_run = st.session_state['active_runs'].get(st.session_state['thread_id'])
+if active_run and get_run(token, active_run['thread_id'], active_run['run_id'], user_id)['status'] in ('done', 'error', 'cancelled'):
+    # finished while detached: the answer is already in the loaded history
+    st.session_state['active_runs'].pop(active_run['thread_id'], None)
+    active_run = None
+
+if active_run:
+    # a queued run has not written the user message to the thread yet
+    last_user = next((m['content'] for m in reversed(st.session_state['message_history']) if m['role'] == 'user'), None)
+    if last_user != active_run['user_message']:
+        st.session_state['message_history'].append({'role': 'user', 'content': active_run['user_message']})
+
 for message in st.session_state['message_history']:
     with st.chat_message(message['role']):
         st.write(message['content'])
@@ -268,49 +483,25 @@ if user_input:
     with st.chat_message('user'):
         st.write(user_input)
     try:
-        # stream assistant response
-        # show assisstant output
-        stream = get_chat_stream(user_input, thread_id=st.session_state['thread_id'], user_id=user_id)
-        with st.chat_message('assistant'):
-            status_holder = {'box': None}
-            # Generator to stream AI message only
-            def stream_ai_only():
-                for message_chunk, metadata in stream:
-                    # Lazily create & update the SAME status container when any tool runs
-                    if isinstance(message_chunk, ToolMessage):
-                        tool_name = getattr(message_chunk, 'name', 'tool')
-                        if status_holder["box"] is None:
-                            status_holder["box"] = st.status(
-                                f"🔧 Using `{tool_name}` …", expanded=True
-                            )
-                        else:
-                            status_holder["box"].update(
-                                label=f"🔧 Using `{tool_name}` …",
-                                state="running",
-                                expanded=True,
-                            )
-                            # with status_holder['box']:
-                            status_holder['box'].write(f"🔧 Using `{tool_name}` …")
-                            status_holder['box'].write(message_chunk)
-                            status_holder['box'].write('---')
-                    
-                    # Stream ONLY assistant tokens
-                    if isinstance(message_chunk, AIMessage) and metadata.get('langgraph_node') == 'chat_node':
-                        yield message_chunk
-
-            assistant_response = st.write_stream(stream_ai_only())
-            if status_holder['box'] is not None:
-                status_holder['box'].update(
-                    label='✅ Tool finished', state='complete', expanded=False
-                )
-
-
-        # store assistant output in session state
-        st.session_state['message_history'].append({
-            'role': 'assistant',
-            'content': assistant_response
-        })
+        run = start_run(token, user_input, thread_id=st.session_state['thread_id'], user_id=user_id, on_busy=on_busy)
+        active_run = {
+            'thread_id': st.session_state['thread_id'],
+            'run_id': run['run_id'],
+            'user_message': user_input,
+            'offset': 0,
+            'content': '',
+        }
+        st.session_state['active_runs'][active_run['thread_id']] = active_run
     except Exception as e:
+        active_run = None
+        st.error(str(e))
+
+if active_run:
+    try:
+        # stream (or resume streaming) assistant response
+        render_run(active_run)
+    except Exception as e:
+        st.session_state['active_runs'].pop(active_run['thread_id'], None)
         st.error(str(e))
 
 def stripped(s: str, max_len = 30):
@@ -318,18 +509,37 @@ def stripped(s: str, max_len = 30):
         return False, s.strip()
     return True, s.strip()[:(max_len + 1)] + '...'
 
+def open_thread(thread_id):
+    st.session_state['thread_id'] = thread_id
+    st.session_state['message_history'] = get_chat_history(token, thread_id=thread_id, user_id=user_id)
+    st.rerun()
+
+# ***************************** Sidebar UI Search *****************************************
+with st.sidebar:
+    search_query = st.text_input(
+        'Search conversations', key='search_query', placeholder='Search messages and titles',
+        icon=":material/search:", label_visibility='collapsed',
+    )
+    if search_query.strip():
+        with st.container(border=True):
+            hits = search_user_messages(token, user_id, search_query)
+            if not hits:
+                st.caption('No matching messages')
+            for i, hit in enumerate(hits):
+                _, hit_title = stripped(hit['thread_title'] or 'Untitled chat')
+                if st.button(hit_title, key=f"search_{i}_{hit['thread_id']}", use_container_width=True, type='tertiary'):
+                    open_thread(hit['thread_id'])
+                st.caption(hit['snippet'])
+
 # ***************************** Sidebar UI Chat Rooms *****************************************
 with st.sidebar:
     with st.container(border=True):
         st.header('My Conversations')
         for thread in st.session_state['chat_threads']:
             thread_id, thread_title =  thread['thread_id'], thread['thread_title']
-            thread_title = thread_title or get_thread_title(thread_id, user_id)
+            thread_title = thread_title or get_thread_title(token, thread_id, user_id)
             if not thread_title:
                 continue
             is_stripped, stripped_title = stripped(thread_title)
             if st.button(stripped_title, help=thread_title if is_stripped else None, key=str(thread_id), use_container_width=True, type='primary' if thread_id == st.session_state['thread_id'] else 'secondary'):
-                st.session_state['thread_id'] = thread_id
-                message_history = get_chat_history(thread_id=thread_id, user_id=user_id)
-                st.session_state['message_history'] = message_history
-                st.rerun()
+                open_thread(thread_id)
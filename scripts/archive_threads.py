@@ -0,0 +1,40 @@
+"""
+Move threads idle for more than N days out of the hot database into compressed
+per-user archives (see backend/archive.py). Archived threads come back
+transparently the next time they are opened. Meant to run from cron.
+
+    python scripts/archive_threads.py --days 7 --vacuum
+"""
+import sys, os, argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.getenv('CHATBOT_DB_PATH', 'chatbot.db'))
+    parser.add_argument('--days', type=float, default=None, help='inactivity threshold (default CHATBOT_ARCHIVE_AFTER_DAYS or 7)')
+    parser.add_argument('--limit', type=int, default=1000, help='threads per run')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM afterwards so the file shrinks')
+    parser.add_argument('--all-blobs', action='store_true', help='also drop unreferenced blobs left by other tools, e.g. scripts/reshard.py')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    os.environ['CHATBOT_DB_PATH'] = args.db
+
+    from backend.db import init_db
+    from backend.archive import ARCHIVE_AFTER_DAYS, ARCHIVE_DIR, archive_cold_threads
+
+    init_db()
+    result = archive_cold_threads(ARCHIVE_AFTER_DAYS if args.days is None else args.days, args.limit, args.vacuum, args.all_blobs)
+    before, after = result['before'], result['after']
+    print(f"archived {result['archived']} threads to {ARCHIVE_DIR} ({result['skipped']} became active, skipped)")
+    print(f"dropped {result['blobs']} checkpoint blobs no hot thread uses")
+    print(f"hot db file: {before['file_bytes']:,} -> {after['file_bytes']:,} bytes")
+    print(f"hot db used: {before['used_bytes']:,} -> {after['used_bytes']:,} bytes")
+
+
+if __name__ == '__main__':
+    main()
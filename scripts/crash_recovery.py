@@ -0,0 +1,149 @@
+"""
+Kill a worker in the middle of a turn and check what each checkpoint durability
+mode (CHATBOT_CHECKPOINT_DURABILITY) leaves behind, and that the thread keeps
+working afterwards. Runs offline against the fake model (backend/fake_llm.py).
+
+    python scripts/crash_recovery.py
+    python scripts/crash_recovery.py --modes step,turn --crash-at answer
+
+Every case uses a fresh database. A child process completes one turn, then
+starts a tool-using turn ("what is 12 * 7") and exits hard (os._exit, no
+cleanup) at the crash point:
+
+    tool    while the calculator runs
+    answer  while the model writes the answer to the tool result
+
+A second process reads the thread back, compares it with what the mode
+promises, and runs one more turn on it.
+"""
+import sys, os, argparse, json, subprocess, tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+MODES = ('step', 'async', 'turn')
+CRASH_POINTS = ('tool', 'answer')
+CRASH_EXIT_CODE = 99
+
+# message kinds of the crashed turn that are on disk once each step is saved
+STEPS = {
+    'tool': ['human', 'ai', 'human', 'ai+tool_calls'],
+    'answer': ['human', 'ai', 'human', 'ai+tool_calls', 'tool'],
+}
+PREVIOUS_TURN = ['human', 'ai']
+
+
+def kinds(messages) -> list[str]:
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+    result = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            result.append('human')
+        elif isinstance(message, AIMessage):
+            result.append('ai+tool_calls' if message.tool_calls else 'ai')
+        elif isinstance(message, ToolMessage):
+            result.append('tool')
+    return result
+
+
+def child_crash(crash_at: str):
+    import backend.langgraph_tool_backend as backend
+    from langchain_core.messages import ToolMessage
+
+    thread_id, user_id = 'crash-thread', 1
+    backend.get_chat_response('hello there', thread_id, user_id)
+
+    if crash_at == 'tool':
+        def shape_tool_result(result):
+            os._exit(CRASH_EXIT_CODE)
+        backend.shape_tool_result = shape_tool_result
+    else:
+        invoke_cancellable = backend.invoke_cancellable
+
+        def crash_on_answer(model, messages, config):
+            if isinstance(messages[-1], ToolMessage):
+                os._exit(CRASH_EXIT_CODE)
+            return invoke_cancellable(model, messages, config)
+        backend.invoke_cancellable = crash_on_answer
+
+    backend.get_chat_response('what is 12 * 7', thread_id, user_id)
+    raise SystemExit('the turn finished instead of crashing')
+
+
+def child_recover():
+    import backend.langgraph_tool_backend as backend
+
+    thread_id, user_id = 'crash-thread', 1
+    state = backend.get_chatbot().get_state(config=backend.get_config(thread_id, user_id))
+    after_crash = kinds(state.values.get('messages', []))
+    answer = backend.get_chat_response('what is 2 + 3', thread_id, user_id)
+    state = backend.get_chatbot().get_state(config=backend.get_config(thread_id, user_id))
+    print(json.dumps({'after_crash': after_crash, 'answer': answer, 'after_recovery': kinds(state.values['messages'])}))
+
+
+def run_case(mode: str, crash_at: str) -> dict:
+    env = {
+        **os.environ,
+        'PYTHONPATH': os.pathsep.join(filter(None, [ROOT_DIR, os.getenv('PYTHONPATH')])),
+        'CHATBOT_DB_PATH': os.path.join(tempfile.mkdtemp(prefix='chatbot-crash-'), 'chatbot.db'),
+        'CHATBOT_FAKE_LLM': '1',
+        'CHATBOT_LLM_CACHE': '0',
+        'CHATBOT_SHARDS': '1',
+        'CHATBOT_CHECKPOINT_DURABILITY': mode,
+    }
+    script = os.path.abspath(__file__)
+    crashed = subprocess.run([sys.executable, script, '--child', 'crash', '--crash-at', crash_at], env=env, capture_output=True, text=True)
+    if crashed.returncode != CRASH_EXIT_CODE:
+        raise SystemExit(f"{mode}/{crash_at}: the child did not crash as planned\n{crashed.stderr}")
+    recovered = subprocess.run([sys.executable, script, '--child', 'recover'], env=env, capture_output=True, text=True)
+    if recovered.returncode != 0:
+        return {'ok': False, 'after_crash': None, 'problem': recovered.stderr.strip().splitlines()[-1]}
+
+    result = json.loads(recovered.stdout.strip().splitlines()[-1])
+    after_crash, steps = result['after_crash'], STEPS[crash_at]
+    if mode == 'step':
+        ok, promise = after_crash == steps, 'every finished step'
+    elif mode == 'turn':
+        ok, promise = after_crash == PREVIOUS_TURN, 'nothing of the crashed turn'
+    else:
+        # the last step may still have been in flight; anything between the two is correct
+        ok, promise = after_crash == steps[:len(after_crash)] and len(after_crash) >= len(PREVIOUS_TURN), 'every step but the last in flight'
+    recovered_ok = bool(result['answer']) and result['after_recovery'][-1] == 'ai'
+    return {
+        'ok': ok and recovered_ok,
+        'after_crash': after_crash,
+        'problem': None if ok and recovered_ok else f"expected {promise}" if not ok else 'the next turn failed',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default=','.join(MODES), help='durability modes to test')
+    parser.add_argument('--crash-at', default=','.join(CRASH_POINTS), help='crash points to test')
+    parser.add_argument('--child', choices=('crash', 'recover'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == 'crash':
+        return child_crash(args.crash_at)
+    if args.child == 'recover':
+        return child_recover()
+
+    modes = args.modes.split(',')
+    crash_points = args.crash_at.split(',')
+    for value, allowed in ((modes, MODES), (crash_points, CRASH_POINTS)):
+        if set(value) - set(allowed):
+            parser.error(f"choose from {', '.join(allowed)}")
+
+    failures = 0
+    print(f"{'mode':<7}{'crash at':<9}{'ok':<5}saved after the crash")
+    for mode in modes:
+        for crash_at in crash_points:
+            result = run_case(mode, crash_at)
+            failures += not result['ok']
+            saved = ' '.join(result['after_crash'] or []) or '-'
+            print(f"{mode:<7}{crash_at:<9}{'yes' if result['ok'] else 'NO':<5}{saved}{'  (' + result['problem'] + ')' if result['problem'] else ''}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Export conversations (users, chat rooms and their messages) as compressed JSONL,
+for backups or to move them to another database (see backend/transfer.py).
+
+    python scripts/export_threads.py --db chatbot.db --out backup.jsonl.gz
+    python scripts/export_threads.py --db chatbot.db --user-id 42 --out user42.jsonl.zst
+
+Memory stays flat however large the database is: tables are read page by page
+and one thread is held at a time. Archived threads are exported from their
+archive and stay archived. The service can keep running meanwhile.
+"""
+import sys, os, argparse, time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.getenv('CHATBOT_DB_PATH', 'chatbot.db'))
+    parser.add_argument('--out', required=True, help='dump file; .gz / .zst names are compressed')
+    parser.add_argument('--user-id', type=int, default=None, help='only this user (default: everyone)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    os.environ['CHATBOT_DB_PATH'] = args.db
+
+    from backend.transfer import export_threads, open_dump
+
+    start = time.perf_counter()
+
+    def progress(counts):
+        print(f"  {counts['rooms']:,} threads, {counts['messages']:,} messages", file=sys.stderr)
+
+    with open_dump(args.out, 'w') as out:
+        counts = export_threads(out, args.user_id, progress)
+    print(
+        f"exported {counts['users']:,} users, {counts['rooms']:,} threads and {counts['messages']:,} messages "
+        f"to {args.out} ({os.path.getsize(args.out):,} bytes) in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == '__main__':
+    main()
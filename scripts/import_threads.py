@@ -0,0 +1,49 @@
+"""
+Import a dump written by scripts/export_threads.py (see backend/transfer.py).
+
+    python scripts/import_threads.py --db new.db --in backup.jsonl.gz
+    CHATBOT_SHARDS=4 python scripts/import_threads.py --db new.db --in backup.jsonl.gz
+
+Threads are placed in the shards of the target database and written in batches
+of --batch per transaction, together with their search index rows. Only the
+search index's segment merges are put off until the end (the other tables have
+no secondary indexes). Users are matched by email: an existing account is
+kept and the imported threads are attached to it. Threads that already exist
+are skipped, so an interrupted import is finished by running it again. Each
+batch locks its shard for writing; run large imports while the service is
+stopped.
+"""
+import sys, os, argparse, time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.getenv('CHATBOT_DB_PATH', 'chatbot.db'))
+    parser.add_argument('--in', dest='path', required=True, help='dump file; .gz / .zst names are decompressed')
+    parser.add_argument('--batch', type=int, default=None, help='threads per transaction (default CHATBOT_IMPORT_BATCH or 200)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        parser.error(f"{args.path} does not exist")
+    os.environ['CHATBOT_DB_PATH'] = args.db
+
+    from backend.transfer import IMPORT_BATCH, import_threads, open_dump
+
+    start = time.perf_counter()
+
+    def progress(counts):
+        print(f"  {counts['rooms']:,} threads, {counts['messages']:,} messages", file=sys.stderr)
+
+    with open_dump(args.path, 'r') as lines:
+        counts = import_threads(lines, args.batch or IMPORT_BATCH, progress)
+    print(
+        f"imported {counts['users']:,} users, {counts['rooms']:,} threads and {counts['messages']:,} messages "
+        f"in {time.perf_counter() - start:.1f}s ({counts['skipped']:,} threads already present, skipped)"
+    )
+
+
+if __name__ == '__main__':
+    main()
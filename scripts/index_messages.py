@@ -0,0 +1,48 @@
+"""
+Build the full-text search index for conversations that predate it.
+
+New turns are indexed as they complete (see `search_user_messages` in
+backend/db.py); this script fills in existing threads and titles once. Threads
+already indexed are only topped up, so it is safe to re-run.
+
+    python scripts/index_messages.py --db chatbot.db
+"""
+import sys, os, argparse, time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.getenv('CHATBOT_DB_PATH', 'chatbot.db'))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    os.environ['CHATBOT_DB_PATH'] = args.db
+
+    from backend.db import shards, index_thread_title
+    from backend.langgraph_tool_backend import index_chat_thread
+
+    start = time.perf_counter()
+    threads = 0
+    for shard in shards:
+        rooms = shard.conn.execute(
+            """
+            SELECT r.thread_id, r.user_id, r.thread_title, p.title_rowid
+            FROM chat_rooms AS r LEFT JOIN chat_search_progress AS p ON p.thread_id = r.thread_id
+            """
+        ).fetchall()
+        for room in rooms:
+            # archived threads have no checkpoints here; they are indexed once reopened
+            index_chat_thread(room['thread_id'], room['user_id'])
+            if room['thread_title'] and room['title_rowid'] is None:
+                index_thread_title(room['thread_id'], room['user_id'], room['thread_title'])
+            threads += 1
+
+    print(f"indexed {threads} threads in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+Concurrent multi-user load generator for the chat backend.
+
+Simulates N users that sign up through `backend.auth.sign_up`, each holding a few
+threads, and drives mixed turns through `get_chat_stream` against the offline
+`FakeChatModel`. Concurrency is ramped step by step and every step reports
+throughput, turn latency percentiles, time spent waiting on the shared SQLite
+connection and error rates.
+
+    python scripts/load_test.py --levels 1,2,4,8,16 --turns 5 --threads 3
+"""
+import sys, os, argparse, random, tempfile, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+# Fake model and a scratch database unless the caller points somewhere else.
+os.environ.setdefault('CHATBOT_FAKE_LLM', '1')
+os.environ.setdefault('CHATBOT_DB_PATH', os.path.join(tempfile.mkdtemp(prefix='chatbot-load-'), 'chatbot.db'))
+
+import backend.db as db
+
+
+# ----------------
+# DB instrumentation
+# ----------------
+class DbStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.db_seconds = 0.0
+            self.lock_wait_seconds = 0.0
+            self.calls = 0
+
+    def add(self, db_seconds: float = 0.0, lock_wait_seconds: float = 0.0):
+        with self._lock:
+            self.db_seconds += db_seconds
+            self.lock_wait_seconds += lock_wait_seconds
+            self.calls += 1
+
+
+stats = DbStats()
+
+
+class TimedCursor:
+    """Cursor proxy that charges execute/commit time to `stats`."""
+
+    def __init__(self, cursor):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name not in ('execute', 'executemany', 'executescript', 'fetchone', 'fetchall', 'fetchmany'):
+            return attr
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                stats.add(db_seconds=time.perf_counter() - start)
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class TimedConnection(TimedCursor):
+    """Connection proxy; cursors it hands out are timed as well."""
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._cursor.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        if name == 'commit':
+            commit = self._cursor.commit
+
+            def timed_commit():
+                start = time.perf_counter()
+                try:
+                    return commit()
+                finally:
+                    stats.add(db_seconds=time.perf_counter() - start)
+            return timed_commit
+        return super().__getattr__(name)
+
+
+class TimedLock:
+    """Drop-in for the checkpointer's threading.Lock that records wait time."""
+
+    def __init__(self, lock):
+        self._lock = lock
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self._lock.acquire()
+        stats.add(lock_wait_seconds=time.perf_counter() - start)
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+# must happen before auth / backend bind `conn` by name
+db.conn = TimedConnection(db.conn)
+for shard in db.shards:
+    # with one shard it shares the central connection
+    shard.conn = db.conn if shard.path == db.DB_PATH else TimedConnection(shard.conn)
+
+from backend.auth import sign_up
+import backend.langgraph_tool_backend as backend
+from backend.models import iter_models
+import backend.llm_cache as llm_cache
+
+for saver in getattr(backend.checkpointer, 'savers', [backend.checkpointer]):
+    saver.lock = TimedLock(saver.lock)
+
+
+# ----------------
+# Workload
+# ----------------
+TURN_MIX = [
+    (0.45, 'plain', lambda: random.choice([
+        'Explain how a hash map works',
+        'Give me three tips for better sleep',
+        'What is the difference between a list and a tuple in Python?',
+    ])),
+    (0.30, 'tool', lambda: random.choice([
+        f'What is {random.randint(1, 999)} * {random.randint(1, 999)}?',
+        f'Compute {random.randint(1, 99)} / {random.randint(1, 9)} please',
+        'What time is it right now?',
+    ])),
+    (0.15, 'bmi', lambda: 'Calculate my BMI, I am 1.75m and 70kg'),
+    (0.10, 'convert', lambda: 'Convert 90 degree to radian'),
+]
+
+
+def pick_prompt() -> tuple[str, str]:
+    r, acc = random.random(), 0.0
+    for weight, kind, prompt in TURN_MIX:
+        acc += weight
+        if r <= acc:
+            return kind, prompt()
+    return TURN_MIX[0][1], TURN_MIX[0][2]()
+
+
+def create_user(index: int) -> int:
+    email = f'load-{index}-{uuid.uuid4().hex[:8]}@example.com'
+    return sign_up(email, 'load-test-password', f'Load{index}', None)
+
+
+def run_turn(user_id: int, thread_id: str, prompt: str) -> tuple[float, float]:
+    start = time.perf_counter()
+    first_token = None
+    for message_chunk, metadata in backend.get_chat_stream(prompt, thread_id=thread_id, user_id=user_id):
+        if first_token is None and isinstance(message_chunk, backend.AIMessage) and message_chunk.content:
+            first_token = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return total, first_token if first_token is not None else total
+
+
+def simulate_user(user_id: int, threads: list[str], turns: int, results: list, errors: list):
+    for _ in range(turns):
+        kind, prompt = pick_prompt()
+        try:
+            results.append((kind, *run_turn(user_id, random.choice(threads), prompt)))
+        except Exception as e:
+            errors.append(f'{type(e).__name__}: {e}')
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(pct / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def run_level(concurrency: int, turns: int, threads_per_user: int) -> dict:
+    users = [create_user(i) for i in range(concurrency)]
+    user_threads = {u: [uuid.uuid4().hex for _ in range(threads_per_user)] for u in users}
+    results, errors = [], []
+
+    stats.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for user_id in users:
+            pool.submit(simulate_user, user_id, user_threads[user_id], turns, results, errors)
+    elapsed = time.perf_counter() - start
+
+    latencies = [r[1] for r in results]
+    ttfts = [r[2] for r in results]
+    attempted = len(results) + len(errors)
+    return {
+        'concurrency': concurrency,
+        'turns': len(results),
+        'errors': len(errors),
+        'error_rate': len(errors) / attempted if attempted else 0.0,
+        'throughput': len(results) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'ttft_p50': percentile(ttfts, 50),
+        'db_ms_per_turn': 1000 * stats.db_seconds / max(1, len(results)),
+        'lock_wait_ms_per_turn': 1000 * stats.lock_wait_seconds / max(1, len(results)),
+        # share of wall-clock "user time" spent blocked on / inside the shared connection
+        'db_share': min(1.0, (stats.db_seconds + stats.lock_wait_seconds) / max(1e-9, sum(latencies))),
+        'sample_errors': sorted(set(errors))[:3],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--levels', default='1,2,4,8,16,32', help='comma separated concurrent user counts')
+    parser.add_argument('--turns', type=int, default=5, help='turns per user per level')
+    parser.add_argument('--threads', type=int, default=3, help='chat threads held by each user')
+    parser.add_argument('--token-latency', type=float, default=0.005, help='fake model seconds per token')
+    parser.add_argument('--first-token-latency', type=float, default=0.05, help='fake model seconds to first token')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--llm-cache', action='store_true', help='keep the LLM response cache on (turns repeat, so it hides model latency)')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    llm_cache.ENABLED = args.llm_cache
+    for model in iter_models(backend.get_llm_tiers().values()):
+        if hasattr(model, 'token_latency'):
+            model.token_latency = args.token_latency
+            model.first_token_latency = args.first_token_latency
+
+    print(f"database: {db.DB_PATH} ({len(db.shards)} shard(s), CHATBOT_SHARDS)")
+    header = f"{'users':>5} {'turns':>6} {'err%':>6} {'turns/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ttft ms':>8} {'db ms':>7} {'lock ms':>8} {'db %':>6}"
+    print(header)
+    print('-' * len(header))
+
+    rows = []
+    for level in [int(x) for x in args.levels.split(',') if x.strip()]:
+        row = run_level(level, args.turns, args.threads)
+        rows.append(row)
+        print(
+            f"{row['concurrency']:>5} {row['turns']:>6} {100 * row['error_rate']:>6.1f} {row['throughput']:>8.2f} "
+            f"{1000 * row['p50']:>8.1f} {1000 * row['p95']:>8.1f} {1000 * row['p99']:>8.1f} {1000 * row['ttft_p50']:>8.1f} "
+            f"{row['db_ms_per_turn']:>7.1f} {row['lock_wait_ms_per_turn']:>8.1f} {100 * row['db_share']:>6.1f}"
+        )
+        for err in row['sample_errors']:
+            print(f"      error: {err}")
+
+    # The shared `conn` is the bottleneck once adding users stops buying throughput
+    # while the share of turn time spent on the connection keeps growing.
+    for prev, cur in zip(rows, rows[1:]):
+        scaling = cur['throughput'] / prev['throughput'] if prev['throughput'] else 0.0
+        ideal = cur['concurrency'] / prev['concurrency']
+        if scaling < 0.5 * ideal + 0.5 and cur['db_share'] > max(0.2, prev['db_share']):
+            print(
+                f"\nshared SQLite connection becomes the bottleneck at ~{cur['concurrency']} users: "
+                f"throughput x{scaling:.2f} for x{ideal:.0f} users, {100 * cur['db_share']:.0f}% of turn time on the connection"
+            )
+            break
+
+    if args.llm_cache:
+        stats = llm_cache.llm_cache.stats()
+        print(f"\nllm cache: hit ratio {100 * stats['hit_ratio']:.1f}%, {stats['tokens_saved']} tokens saved, {stats['bypassed']} bypassed")
+
+
+if __name__ == '__main__':
+    main()
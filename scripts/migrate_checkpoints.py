@@ -0,0 +1,124 @@
+"""
+Rewrite existing checkpoints with the compact serializer (or back to the default one).
+
+Checkpoints written by langgraph's default serializer keep loading after the
+switch to `backend.checkpoint_serde.CompactSerializer`; this script converts
+them in place so old threads shrink as well, and reports the sizes.
+
+    python scripts/migrate_checkpoints.py --db chatbot.db --vacuum
+    python scripts/migrate_checkpoints.py --db chatbot.db --plain   # roll back
+
+With CHATBOT_SHARDS > 1 every shard file is migrated.
+"""
+import sys, os, argparse, sqlite3, time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+
+def table_bytes(conn: sqlite3.Connection, table: str, column: str) -> int:
+    return conn.execute(f"SELECT COALESCE(SUM(LENGTH({column})), 0) FROM {table}").fetchone()[0]
+
+
+def db_bytes(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def measure(conn: sqlite3.Connection, sizes: dict):
+    sizes['checkpoints'] += table_bytes(conn, 'checkpoints', 'checkpoint')
+    sizes['writes'] += table_bytes(conn, 'writes', 'value')
+    sizes['blobs'] += table_bytes(conn, 'checkpoint_blobs', 'data')
+    sizes['database'] += db_bytes(conn)
+
+
+def migrate_table(conn: sqlite3.Connection, table: str, column: str, reader, writer, batch: int) -> int:
+    """Re-encode `table.column` batch by batch; returns the number of rows changed."""
+    changed = 0
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            f"SELECT rowid, thread_id, type, {column} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, batch)
+        ).fetchall()
+        if not rows:
+            return changed
+        last_rowid = rows[-1][0]
+
+        # encode first: blobs are written on their own connection, outside our transaction
+        updates = []
+        for rowid, thread_id, type_, data in rows:
+            if type_ is None:
+                continue
+            obj = reader.loads_typed((type_, data))
+            if hasattr(writer, 'thread'):
+                # the blobs it stores are recorded as the thread's refs
+                with writer.thread(thread_id):
+                    new_type, new_data = writer.dumps_typed(obj)
+            else:
+                new_type, new_data = writer.dumps_typed(obj)
+            if (new_type, new_data) != (type_, data):
+                updates.append((new_type, new_data, rowid))
+
+        with conn:
+            conn.executemany(f"UPDATE {table} SET type=?, {column}=? WHERE rowid=?", updates)
+        changed += len(updates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.getenv('CHATBOT_DB_PATH', 'chatbot.db'))
+    parser.add_argument('--plain', action='store_true', help="rewrite with langgraph's default serializer (inlines blobs)")
+    parser.add_argument('--batch', type=int, default=200, help='rows per transaction')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM afterwards to return freed pages to the OS')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    os.environ['CHATBOT_DB_PATH'] = args.db
+
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+    from backend.db import init_db, shards
+    from backend.checkpoint_serde import CompactSerializer
+
+    init_db()
+    start = time.perf_counter()
+    changed = {'checkpoints': 0, 'writes': 0}
+    before = {'checkpoints': 0, 'writes': 0, 'blobs': 0, 'database': 0}
+    after = dict(before)
+    for shard in shards:
+        conn = sqlite3.connect(shard.path, timeout=30)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        if 'checkpoints' not in tables:
+            conn.close()
+            continue
+
+        # blobs belong to the shard of the checkpoints referencing them
+        reader = CompactSerializer(shard)
+        writer = JsonPlusSerializer() if args.plain else reader
+        measure(conn, before)
+
+        changed['checkpoints'] += migrate_table(conn, 'checkpoints', 'checkpoint', reader, writer, args.batch)
+        changed['writes'] += migrate_table(conn, 'writes', 'value', reader, writer, args.batch)
+        if args.plain:
+            with conn:
+                conn.execute("DELETE FROM checkpoint_blobs")
+                conn.execute("DELETE FROM checkpoint_blob_refs")
+        if args.vacuum:
+            conn.execute("VACUUM")
+
+        measure(conn, after)
+        conn.close()
+
+    if not before['database']:
+        print('no checkpoints to migrate')
+        return
+
+    print(f"migrated {len(shards)} shard(s) in {time.perf_counter() - start:.1f}s")
+    for table in ('checkpoints', 'writes'):
+        print(f"{table:>12}: {changed[table]} rows rewritten, {before[table]:,} -> {after[table]:,} bytes")
+    print(f"{'blobs':>12}: {before['blobs']:,} -> {after['blobs']:,} bytes")
+    print(f"{'database':>12}: {before['database']:,} -> {after['database']:,} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Measure cold-start time: how long importing the service (or another module) takes
+in a fresh interpreter, which packages that time goes to, and how long the lazily
+built graph and LLM clients take on top.
+
+    python scripts/profile_startup.py
+    python scripts/profile_startup.py --module backend.langgraph_tool_backend --top 25
+    python scripts/profile_startup.py --json >> startup.jsonl   # track over time
+
+Each run starts a new `python -X importtime` against a throwaway database, so
+nothing is cached between runs except the OS page cache; the fastest of
+`--repeat` runs is reported.
+"""
+import sys, os, argparse, json, subprocess, tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1], fromlist=['_'])
+imported = time.perf_counter()
+if sys.argv[2] == '1':
+    from backend.langgraph_tool_backend import warm_up
+    warm_up()
+print(f"{imported - start} {time.perf_counter() - imported}")
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Self time in seconds per top-level package, from `-X importtime` output."""
+    packages: dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1e6
+    return packages
+
+
+def profile(module: str, build: bool) -> dict:
+    env = {
+        **os.environ,
+        'PYTHONPATH': os.pathsep.join(filter(None, [ROOT_DIR, os.getenv('PYTHONPATH')])),
+        'CHATBOT_DB_PATH': os.path.join(tempfile.mkdtemp(prefix='chatbot-startup-'), 'chatbot.db'),
+        'CHATBOT_SHARDS': '1',
+    }
+    # building real ChatOpenAI clients needs a key but makes no request
+    env.setdefault('OPENAI_API_KEY', 'profile-startup')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE, module, '1' if build else '0'],
+        env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(proc.stderr.strip().splitlines()[-1])
+    import_s, build_s = map(float, proc.stdout.split()[-2:])
+    return {'import_s': import_s, 'build_s': build_s, 'packages': parse_importtime(proc.stderr)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='backend.service', help='module to import (default: backend.service)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs; the fastest is reported')
+    parser.add_argument('--top', type=int, default=15, help='packages to list')
+    parser.add_argument('--no-build', action='store_true', help='skip building the graph and LLM clients')
+    parser.add_argument('--json', action='store_true', help='print one JSON line instead of a table')
+    args = parser.parse_args()
+
+    runs = [profile(args.module, not args.no_build) for _ in range(max(args.repeat, 1))]
+    best = min(runs, key=lambda run: run['import_s'])
+    top = sorted(best['packages'].items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({
+            'module': args.module,
+            'import_s': round(best['import_s'], 3),
+            'build_s': round(min(run['build_s'] for run in runs), 3),
+            'packages': {name: round(seconds, 3) for name, seconds in top},
+        }))
+        return
+
+    print(f"import {args.module}: {best['import_s'] * 1000:.0f} ms (fastest of {len(runs)})")
+    if not args.no_build:
+        print(f"graph + LLM clients (first turn): {min(run['build_s'] for run in runs) * 1000:.0f} ms")
+    label = 'package' if args.no_build else 'package (import + build)'
+    print(f"\n{label:<32}{'self ms':>10}")
+    for name, seconds in top:
+        print(f"{name:<32}{seconds * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
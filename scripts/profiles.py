@@ -0,0 +1,107 @@
+"""
+List, inspect and compare the turn profiles saved by the chat service (see
+backend/profiling.py). Profiles are taken when an admin switches profiling on
+for a user (POST /admin/profiling, or the usage dashboard) or when a caller
+passes profile=True to get_chat_response.
+
+    python scripts/profiles.py list --user-id 42
+    python scripts/profiles.py show 3f9c2a --top 20 --sort total
+    python scripts/profiles.py show 3f9c2a --folded > turn.folded   # flamegraph.pl / speedscope
+    python scripts/profiles.py diff 3f9c2a 8be1d0
+
+Runs are named by their run id or any unique prefix of it (or a profile's path).
+Each profile also has an SVG flame graph next to its JSON file. Times are
+samples x interval: the wall time the turn's busy threads spent there.
+"""
+import sys, os, argparse, datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+
+def seconds(samples: int, record: dict) -> float:
+    return samples * record['interval_ms'] / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.getenv('CHATBOT_DB_PATH', 'chatbot.db'), help='profiles live next to it unless CHATBOT_PROFILE_DIR is set')
+    commands = parser.add_subparsers(dest='command', required=True)
+    listing = commands.add_parser('list', help='stored profiles, newest first')
+    listing.add_argument('--thread-id', default=None)
+    listing.add_argument('--user-id', type=int, default=None)
+    listing.add_argument('--limit', type=int, default=20)
+    show = commands.add_parser('show', help='busiest functions and packages of one profile')
+    show.add_argument('run')
+    show.add_argument('--top', type=int, default=25)
+    show.add_argument('--sort', choices=('self', 'total'), default='self')
+    show.add_argument('--folded', action='store_true', help='print folded stacks instead')
+    diff = commands.add_parser('diff', help='where the time moved between two profiles')
+    diff.add_argument('before')
+    diff.add_argument('after')
+    diff.add_argument('--top', type=int, default=25)
+    args = parser.parse_args()
+
+    os.environ['CHATBOT_DB_PATH'] = args.db
+    from backend.profiling import PROFILE_DIR, list_profiles, load_profile, summarize, folded_stacks
+
+    try:
+        if args.command == 'list':
+            list_command(list_profiles(args.thread_id, args.user_id, args.limit), PROFILE_DIR)
+        elif args.command == 'show':
+            record = load_profile(args.run)
+            if args.folded:
+                for stack, count in folded_stacks(record).items():
+                    print(stack, count)
+            else:
+                show_command(record, summarize(record, args.top, args.sort))
+        else:
+            before, after = load_profile(args.before), load_profile(args.after)
+            diff_command(before, after, summarize(before, 10**9), summarize(after, 10**9), args.top)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def list_command(profiles: list, directory: str):
+    if not profiles:
+        print(f"no profiles in {directory}")
+        return
+    print(f"{'started':<20}{'run':<34}{'thread':<38}{'user':>6}{'status':>11}{'wall s':>9}{'busy s':>9}")
+    for p in profiles:
+        started = datetime.datetime.fromtimestamp(p['started_at']).strftime('%Y-%m-%d %H:%M:%S')
+        busy = p['samples'] / (p['samples'] + p['idle_samples']) * p['duration_s'] if p['samples'] else 0.0
+        print(f"{started:<20}{p['run_id']:<34}{p['thread_id'][:36]:<38}{p['user_id']:>6}{p['status']:>11}{p['duration_s']:>9.2f}{busy:>9.2f}")
+
+
+def show_command(record: dict, summary: dict):
+    print(f"run {record['run_id']} of thread {record['thread_id']} (user {record['user_id']}, {record['status']})")
+    print(f"{record['duration_s']:.2f} s wall, {record['samples']} busy and {record['idle_samples']} idle samples every {record['interval_ms']:g} ms")
+    print(f"\n{'function':<90}{'self s':>9}{'total s':>9}")
+    for f in summary['functions']:
+        print(f"{f['function'][:88]:<90}{seconds(f['self'], record):>9.3f}{seconds(f['total'], record):>9.3f}")
+    print(f"\n{'package':<40}{'self s':>9}{'share':>8}")
+    for package, samples in list(summary['packages'].items())[:15]:
+        print(f"{package:<40}{seconds(samples, record):>9.3f}{samples / record['samples'] * 100:>7.1f}%")
+
+
+def diff_command(before: dict, after: dict, old: dict, new: dict, top: int):
+    print(f"before: run {before['run_id']}, {before['duration_s']:.2f} s wall, {before['samples']} busy samples")
+    print(f"after:  run {after['run_id']}, {after['duration_s']:.2f} s wall, {after['samples']} busy samples")
+    for title, rows_old, rows_new in (
+        ('function (self)', {f['function']: f['self'] for f in old['functions']}, {f['function']: f['self'] for f in new['functions']}),
+        ('package (self)', old['packages'], new['packages']),
+    ):
+        changes = sorted(
+            (
+                (name, seconds(rows_old.get(name, 0), before), seconds(rows_new.get(name, 0), after))
+                for name in rows_old.keys() | rows_new.keys() if rows_old.get(name, 0) or rows_new.get(name, 0)
+            ),
+            key=lambda row: abs(row[2] - row[1]), reverse=True,
+        )[:top]
+        print(f"\n{title:<90}{'before s':>9}{'after s':>9}{'change':>9}")
+        for name, was, now in changes:
+            print(f"{name[:88]:<90}{was:>9.3f}{now:>9.3f}{now - was:>+9.3f}")
+
+
+if __name__ == '__main__':
+    main()
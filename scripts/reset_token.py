@@ -0,0 +1,37 @@
+"""
+Issue a password reset token for an account, to hand to its owner out of band.
+
+    python scripts/reset_token.py --db chatbot.db --email someone@example.com
+
+The owner enters it on the UI's "Forgot password" page (or sends it to
+`POST /auth/reset_password`) within 30 minutes. Asking again before then
+prints the same token.
+"""
+import sys, os, argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.getenv('CHATBOT_DB_PATH', 'chatbot.db'))
+    parser.add_argument('--email', required=True)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    os.environ['CHATBOT_DB_PATH'] = args.db
+
+    from backend.db import init_db
+    from backend.auth import create_reset_token
+
+    init_db()
+    try:
+        print(create_reset_token(args.email))
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Move per-user chat data (chat rooms, checkpoints, runs, search index, usage, memory) to a new shard count.
+
+Threads are routed by the owner's user_id, exactly like the service does (see
+the storage layout in backend/db.py); usage and memory rows follow their user_id
+(memory vector files are per user, not per shard, and stay put). Stop the service first, then
+
+    python scripts/reshard.py --db chatbot.db --shards 8 --dry-run
+    python scripts/reshard.py --db chatbot.db --shards 8
+
+and start it again with CHATBOT_SHARDS=8. Rows are copied (INSERT OR IGNORE)
+and then deleted from their old shard batch by batch, so an interrupted run is
+finished by running the script again. The shard count recorded in the central
+database only changes once everything has moved. Threads whose owner cannot be
+determined stay where they are and are reported. Old shard files are left
+behind (emptied) for you to remove.
+"""
+import sys, os, argparse, json, sqlite3, time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+THREAD_TABLES = ('checkpoints', 'writes', 'checkpoint_blob_refs', 'chat_rooms', 'chat_runs')
+USER_TABLES = ('usage_events', 'usage_rollups', 'usage_tool_rollups', 'memory_facts')
+
+
+def thread_owners(conn: sqlite3.Connection) -> dict:
+    """thread_id -> user_id from chat_rooms, falling back to the checkpoint metadata."""
+    owners = {}
+    for thread_id, metadata in conn.execute("SELECT DISTINCT thread_id, metadata FROM checkpoints WHERE metadata IS NOT NULL"):
+        if thread_id not in owners:
+            user_id = json.loads(metadata).get('user_id')
+            if user_id is not None:
+                owners[thread_id] = int(user_id)
+    for table in ('chat_runs', 'chat_rooms'):
+        owners.update(conn.execute(f"SELECT thread_id, user_id FROM {table}").fetchall())
+    return owners
+
+
+def columns(conn: sqlite3.Connection, table: str) -> str:
+    return ', '.join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+
+
+def move_search_rows(conn: sqlite3.Connection, ids: str) -> int:
+    """Move the threads' full-text rows; they get new rowids, so the title pointers are rewritten."""
+    in_ids = "thread_id IN (SELECT value FROM json_each(?))"
+    rows = conn.execute(f"SELECT content, owner, thread_id, role, position FROM main.chat_search WHERE {in_ids}", (ids,)).fetchall()
+    progress = conn.execute(f"SELECT thread_id, indexed FROM main.chat_search_progress WHERE {in_ids}", (ids,)).fetchall()
+    # leftovers of an interrupted run would otherwise be indexed twice
+    conn.execute(f"DELETE FROM dst.chat_search WHERE {in_ids}", (ids,))
+    titles = {}
+    for row in rows:
+        cur = conn.execute("INSERT INTO dst.chat_search (content, owner, thread_id, role, position) VALUES (?, ?, ?, ?, ?)", row)
+        if row[3] == 'title':
+            titles[row[2]] = cur.lastrowid
+    conn.executemany(
+        "INSERT OR REPLACE INTO dst.chat_search_progress (thread_id, indexed, title_rowid) VALUES (?, ?, ?)",
+        [(thread_id, indexed, titles.get(thread_id)) for thread_id, indexed in progress]
+    )
+    conn.execute(f"DELETE FROM main.chat_search WHERE {in_ids}", (ids,))
+    conn.execute(f"DELETE FROM main.chat_search_progress WHERE {in_ids}", (ids,))
+    return len(rows)
+
+
+def move_threads(conn: sqlite3.Connection, thread_ids: list, search: bool = True) -> dict:
+    """Copy the threads' rows into the attached `dst` shard and delete them here, in one transaction."""
+    ids = json.dumps(thread_ids)
+    moved = {}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        run_ids = "SELECT run_id FROM main.chat_runs WHERE thread_id IN (SELECT value FROM json_each(?))"
+        cols = columns(conn, 'chat_run_events')
+        conn.execute(f"INSERT OR IGNORE INTO dst.chat_run_events ({cols}) SELECT {cols} FROM main.chat_run_events WHERE run_id IN ({run_ids})", (ids,))
+        conn.execute(f"DELETE FROM main.chat_run_events WHERE run_id IN ({run_ids})", (ids,))
+        for table in THREAD_TABLES:
+            cols = columns(conn, table)
+            if not cols:
+                continue  # e.g. no checkpoint_blob_refs in databases from before it
+            if table == 'chat_runs':
+                # keep AUTOINCREMENT ids unique in the target: runs are ordered per thread only
+                cols = ', '.join(c for c in cols.split(', ') if c != 'id')
+            cur = conn.execute(
+                f"INSERT OR IGNORE INTO dst.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE thread_id IN (SELECT value FROM json_each(?))",
+                (ids,)
+            )
+            moved[table] = cur.rowcount
+            conn.execute(f"DELETE FROM main.{table} WHERE thread_id IN (SELECT value FROM json_each(?))", (ids,))
+        if search:
+            moved['chat_search'] = move_search_rows(conn, ids)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return moved
+
+
+def move_user_rows(conn: sqlite3.Connection, user_ids: list, tables: list) -> dict:
+    """Copy the users' rows of `tables` (usage, memory) into the attached `dst` shard and delete them here, in one transaction."""
+    ids = json.dumps(user_ids)
+    moved = {}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in tables:
+            cols = columns(conn, table)
+            if table == 'usage_events':
+                cols = ', '.join(c for c in cols.split(', ') if c != 'id')
+            cur = conn.execute(
+                f"INSERT OR IGNORE INTO dst.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE user_id IN (SELECT value FROM json_each(?))",
+                (ids,)
+            )
+            moved[table] = cur.rowcount
+            conn.execute(f"DELETE FROM main.{table} WHERE user_id IN (SELECT value FROM json_each(?))", (ids,))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.getenv('CHATBOT_DB_PATH', 'chatbot.db'))
+    parser.add_argument('--shards', type=int, required=True, help='new shard count')
+    parser.add_argument('--batch', type=int, default=100, help='threads (or users, for usage and memory rows) per transaction')
+    parser.add_argument('--dry-run', action='store_true', help='only report where threads would go')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    if args.shards < 1:
+        parser.error('--shards must be at least 1')
+    os.environ['CHATBOT_DB_PATH'] = args.db
+    # open the database as a single shard: the current layout may not match either count
+    os.environ['CHATBOT_SHARDS'] = '1'
+
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    from backend.db import conn, DB_PATH, SHARD_DIR, Shard, init_shard, shard_index, shard_path
+
+    # databases from before sharding have no storage_meta and one shard
+    has_meta = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='storage_meta'").fetchone()
+    row = has_meta and conn.execute("SELECT value FROM storage_meta WHERE key='shards'").fetchone()
+    current = int(row[0]) if row else 1
+    print(f"{DB_PATH}: {current} -> {args.shards} shard(s)")
+
+    if not args.dry_run:
+        os.makedirs(SHARD_DIR, exist_ok=True)
+        for index in range(args.shards):
+            target = Shard(index, shard_path(index, args.shards), main_conn=conn if args.shards == 1 else None)
+            init_shard(target)
+            SqliteSaver(conn=target.conn).setup()
+
+    start = time.perf_counter()
+    totals = {table: 0 for table in THREAD_TABLES + ('chat_search',) + USER_TABLES}
+    threads = users = orphans = 0
+    for source_index in range(current):
+        source_path = shard_path(source_index, current)
+        if not os.path.exists(source_path):
+            continue
+        source = sqlite3.connect(source_path, timeout=30, isolation_level=None)
+        tables = {row[0] for row in source.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        if not {'checkpoints', 'chat_rooms'} <= tables:
+            source.close()
+            continue
+
+        by_target: dict[int, list] = {}
+        users_by_target: dict[int, list] = {}
+        user_tables = [table for table in USER_TABLES if table in tables]
+        # moved threads only bring complete blob refs along if the source had them all
+        refs_complete = 'storage_meta' in tables and source.execute(
+            "SELECT 1 FROM storage_meta WHERE key='blob_refs' AND value='complete'"
+        ).fetchone()
+        if user_tables:
+            owners_query = ' UNION '.join(f"SELECT user_id FROM {table}" for table in user_tables)
+            for (user_id,) in source.execute(owners_query):
+                target_index = shard_index(user_id, args.shards)
+                if shard_path(target_index, args.shards) != source_path:
+                    users_by_target.setdefault(target_index, []).append(user_id)
+        thread_ids = {row[0] for table in ('checkpoints', 'chat_rooms') for row in source.execute(f"SELECT DISTINCT thread_id FROM {table}")}
+        owners = thread_owners(source)
+        for thread_id in thread_ids:
+            if thread_id not in owners:
+                orphans += 1
+                continue
+            target_index = shard_index(owners[thread_id], args.shards)
+            if shard_path(target_index, args.shards) != source_path:
+                by_target.setdefault(target_index, []).append(thread_id)
+
+        for target_index in sorted(set(by_target) | set(users_by_target)):
+            ids, user_ids = by_target.get(target_index, []), users_by_target.get(target_index, [])
+            threads += len(ids)
+            users += len(user_ids)
+            print(f"  {os.path.basename(source_path)} -> {os.path.basename(shard_path(target_index, args.shards))}: {len(ids)} threads, usage and memory of {len(user_ids)} users")
+            if args.dry_run:
+                continue
+            source.execute("ATTACH DATABASE ? AS dst", (shard_path(target_index, args.shards),))
+            try:
+                # blobs first, so a moved checkpoint never references a missing one
+                source.execute("INSERT OR IGNORE INTO dst.checkpoint_blobs (hash, codec, data) SELECT hash, codec, data FROM main.checkpoint_blobs")
+                if ids and not refs_complete:
+                    # the service fills them in again before collecting any blob
+                    source.execute("DELETE FROM dst.storage_meta WHERE key='blob_refs'")
+                for offset in range(0, len(ids), args.batch):
+                    for table, count in move_threads(source, ids[offset:offset + args.batch], 'chat_search' in tables).items():
+                        totals[table] += count
+                for offset in range(0, len(user_ids), args.batch):
+                    for table, count in move_user_rows(source, user_ids[offset:offset + args.batch], user_tables).items():
+                        totals[table] += count
+            finally:
+                source.execute("DETACH DATABASE dst")
+        source.close()
+
+    if args.dry_run:
+        print(f"{threads} threads and the usage and memory of {users} users would move, {orphans} threads without an owner stay")
+        return
+
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS storage_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("INSERT OR REPLACE INTO storage_meta (key, value) VALUES ('shards', ?)", (str(args.shards),))
+    print(f"moved {threads} threads and the usage and memory of {users} users in {time.perf_counter() - start:.1f}s ({orphans} threads without an owner left in place)")
+    for table, count in totals.items():
+        print(f"{table:>20}: {count} rows")
+    print(f"start the service with CHATBOT_SHARDS={args.shards}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import os, sys, tempfile
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+# backend reads its settings at import time: point it at a scratch database and
+# the offline model before any test imports it
+DATA_DIR = tempfile.mkdtemp(prefix='chatbot-tests-')
+os.environ.update({
+    'CHATBOT_DB_PATH': os.path.join(DATA_DIR, 'chatbot.db'),
+    'CHATBOT_ARCHIVE_DIR': os.path.join(DATA_DIR, 'archive'),
+    'CHATBOT_PROFILE_DIR': os.path.join(DATA_DIR, 'profiles'),
+    'CHATBOT_FAKE_LLM': '1',
+    'CHATBOT_LLM_CACHE': '0',
+    'CHATBOT_WARM_UP': '0',
+    'CHATBOT_SESSION_SECRET': 'test-secret',
+    'CHATBOT_SCRYPT_N': '1024',
+})
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    from backend.db import init_db
+    init_db()
+
+
+@pytest.fixture
+def make_user():
+    """Sign up a fresh user; returns their id."""
+    from uuid import uuid4
+    from backend.auth import sign_up
+
+    def make(password: str = 'correct horse 1A!') -> int:
+        return sign_up(f'{uuid4().hex}@example.com', password, 'Test', None)
+    return make
+
+
+@pytest.fixture
+def seed_thread():
+    """Write a thread whose tool output is large enough to become a checkpoint blob; returns its messages."""
+    from uuid import uuid4
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+    from langgraph.graph import END, START, MessagesState, StateGraph
+    from backend.db import set_thread_title
+    from backend.langgraph_tool_backend import checkpointer
+
+    def seed(user_id: int, thread_id: str = None, tool_output: str = None) -> tuple[str, list]:
+        thread_id = thread_id or uuid4().hex
+        call_id = f'call_{uuid4().hex[:12]}'
+        messages = [
+            HumanMessage('what does the page say?'),
+            AIMessage('', tool_calls=[{'name': 'scrape_webpage', 'args': {'url': 'https://example.com'}, 'id': call_id}]),
+            ToolMessage(tool_output or f'page {thread_id} ' + 'lorem ipsum ' * 1000, tool_call_id=call_id),
+            AIMessage('It is mostly lorem ipsum.'),
+        ]
+        graph = StateGraph(MessagesState)
+        graph.add_node('turn', lambda state: {'messages': messages})
+        graph.add_edge(START, 'turn')
+        graph.add_edge('turn', END)
+        graph.compile(checkpointer=checkpointer).invoke(
+            {'messages': []}, {'configurable': {'thread_id': thread_id, 'user_id': user_id}}
+        )
+        set_thread_title(thread_id, user_id, f'Thread {thread_id[:8]}')
+        return thread_id, messages
+    return seed
@@ -0,0 +1,143 @@
+import os
+from backend import archive, checkpoint_serde
+from backend.db import get_checkpoint_blobs, get_thread_blob_refs, is_thread_archived, set_shard_meta, shard_for_user, touch_thread
+from backend.checkpoint_serde import thread_blob_refs
+from backend.langgraph_tool_backend import checkpointer, get_chat_history
+
+
+def go_cold(user_id: int, *thread_ids: str):
+    """Backdate the threads and their blobs past every archive / collection threshold."""
+    shard = shard_for_user(user_id)
+    with shard.archive_lock:
+        shard.archive_conn.executemany(
+            "UPDATE chat_rooms SET last_active_at=0 WHERE thread_id=?", [(thread_id,) for thread_id in thread_ids]
+        )
+    with shard.blobs_lock:
+        shard.blobs_conn.execute("UPDATE checkpoint_blobs SET stored_at=0")
+
+
+def archive_now(user_id: int, thread_id: str, refs: set = None) -> bool:
+    return archive.archive_thread(thread_id, user_id, 0, refs)
+
+
+def test_archive_then_rehydrate(make_user, seed_thread):
+    user_id = make_user()
+    thread_id, messages = seed_thread(user_id)
+    shard = shard_for_user(user_id)
+    (digest,) = thread_blob_refs(shard, thread_id)
+    history = get_chat_history(thread_id, user_id)
+    go_cold(user_id, thread_id)
+
+    result = archive.archive_cold_threads(0)
+
+    assert result['archived'] >= 1 and result['blobs'] >= 1
+    assert is_thread_archived(thread_id, user_id)
+    assert os.path.exists(archive.archive_path(user_id))
+    assert get_checkpoint_blobs(shard, [digest]) == {}
+    archived = archive.read_archived_thread(thread_id, user_id)
+    assert archived['checkpoints']['rows'] and [row[0] for row in archived['checkpoint_blobs']['rows']] == [digest]
+
+    # the next history load brings it back, blob included
+    assert get_chat_history(thread_id, user_id) == history
+    assert not is_thread_archived(thread_id, user_id)
+    assert archive.read_archived_thread(thread_id, user_id) is None
+    state = checkpointer.get_tuple({'configurable': {'thread_id': thread_id, 'user_id': user_id}})
+    assert state.checkpoint['channel_values']['messages'][2].content == messages[2].content
+
+
+def test_shared_blob_stays_while_a_hot_thread_uses_it(make_user, seed_thread):
+    user_id = make_user()
+    shared = 'the same page, fetched twice ' * 300
+    cold, _ = seed_thread(user_id, tool_output=shared)
+    hot, _ = seed_thread(user_id, tool_output=shared)
+    shard = shard_for_user(user_id)
+    (digest,) = thread_blob_refs(shard, cold)
+    go_cold(user_id, cold)
+
+    refs = set()
+    assert archive_now(user_id, cold, refs)
+    assert archive.collect_blobs(shard, refs) == 0
+    assert digest in get_checkpoint_blobs(shard, [digest])
+
+    checkpointer.delete_thread(hot)
+    assert get_checkpoint_blobs(shard, [digest]) == {}
+
+
+def test_deleting_a_thread_reads_only_its_refs(make_user, seed_thread, monkeypatch):
+    user_id = make_user()
+    seed_thread(user_id)  # another thread on the shard
+    thread_id, _ = seed_thread(user_id)
+    shard = shard_for_user(user_id)
+    (digest,) = thread_blob_refs(shard, thread_id)
+    go_cold(user_id, thread_id)
+
+    def no_scans(*args, **kwargs):
+        raise AssertionError('collecting a deleted thread\'s blobs decoded checkpoints')
+
+    monkeypatch.setattr(checkpoint_serde, 'iter_checkpoint_payloads', no_scans)
+    checkpointer.delete_thread(thread_id)
+
+    assert get_checkpoint_blobs(shard, [digest]) == {}
+    assert get_thread_blob_refs(shard, thread_id) == []
+
+
+def test_refs_of_older_checkpoints_are_filled_in_before_collecting(make_user, seed_thread, monkeypatch):
+    user_id = make_user()
+    thread_id, _ = seed_thread(user_id)
+    shard = shard_for_user(user_id)
+    (digest,) = thread_blob_refs(shard, thread_id)
+    # as if the thread was checkpointed before checkpoint_blob_refs existed
+    with shard.blobs_lock:
+        shard.blobs_conn.execute("DELETE FROM checkpoint_blob_refs WHERE thread_id=?", (thread_id,))
+    set_shard_meta(shard, 'blob_refs', 'incomplete')
+    monkeypatch.setattr(checkpoint_serde, '_refs_complete', set())
+    go_cold(user_id)
+
+    archive.collect_blobs(shard)
+
+    assert digest in get_checkpoint_blobs(shard, [digest])
+    assert get_thread_blob_refs(shard, thread_id) == [digest]
+    assert len(get_chat_history(thread_id, user_id)) == 2
+
+
+def test_recently_stored_blobs_are_not_collected(make_user, seed_thread):
+    user_id = make_user()
+    thread_id, _ = seed_thread(user_id)
+    shard = shard_for_user(user_id)
+    refs = thread_blob_refs(shard, thread_id)
+    with shard.archive_lock:
+        shard.archive_conn.execute("UPDATE chat_rooms SET last_active_at=0 WHERE thread_id=?", (thread_id,))
+
+    assert archive_now(user_id, thread_id)
+    # a turn in flight may be about to reference it
+    assert archive.collect_blobs(shard, refs) == 0
+    assert get_checkpoint_blobs(shard, list(refs)).keys() == refs
+
+
+def test_thread_touched_meanwhile_stays_hot(make_user, seed_thread):
+    user_id = make_user()
+    thread_id, _ = seed_thread(user_id)
+    go_cold(user_id, thread_id)
+    touch_thread(thread_id, user_id)
+
+    # the archiver saw last_active_at=0 before the touch
+    assert not archive_now(user_id, thread_id)
+    assert not is_thread_archived(thread_id, user_id)
+    assert archive.read_archived_thread(thread_id, user_id) is None
+
+
+def test_touch_writes_at_most_once_per_interval(make_user, seed_thread):
+    user_id = make_user()
+    thread_id, _ = seed_thread(user_id)
+    shard = shard_for_user(user_id)
+
+    def last_active_at():
+        with shard.archive_lock:
+            return shard.archive_conn.execute(
+                "SELECT last_active_at FROM chat_rooms WHERE thread_id=?", (thread_id,)
+            ).fetchone()[0]
+
+    touch_thread(thread_id, user_id)
+    first = last_active_at()
+    assert touch_thread(thread_id, user_id) == {'user_id': user_id, 'archived_at': None}
+    assert last_active_at() == first
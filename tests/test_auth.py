@@ -0,0 +1,143 @@
+import asyncio
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from backend import auth
+from backend.auth import create_reset_token, create_session, reset_password, sign_in, validate_session
+from backend.db import conn, conn_lock, touch_thread
+from backend.langgraph_tool_backend import get_chat_history
+from backend.service import create_app
+
+
+def forget_cached_sessions():
+    # validation then has to check the signature and the users row
+    with auth._sessions_lock:
+        auth._sessions.clear()
+
+
+def test_token_round_trip(make_user):
+    user_id = make_user()
+    session = create_session(user_id)
+
+    assert validate_session(session['token'])['user_id'] == user_id
+    forget_cached_sessions()
+    assert validate_session(session['token'])['user_id'] == user_id
+
+
+@pytest.mark.parametrize('tamper', [
+    lambda token: token[:-2] + ('AA' if not token.endswith('AA') else 'BB'),
+    lambda token: token.split('.')[0],
+    lambda token: '',
+])
+def test_tampered_tokens_are_rejected(make_user, tamper):
+    token = create_session(make_user())['token']
+    forget_cached_sessions()
+
+    with pytest.raises(ValueError, match='Invalid session'):
+        validate_session(tamper(token))
+
+
+def test_expired_tokens_are_rejected(make_user, monkeypatch):
+    user_id = make_user()
+    monkeypatch.setattr(auth, 'SESSION_TTL', -1)
+    token = create_session(user_id)['token']
+
+    with pytest.raises(ValueError, match='expired'):
+        validate_session(token)
+    forget_cached_sessions()
+    with pytest.raises(ValueError, match='expired'):
+        validate_session(token)
+
+
+def email_of(user_id: int) -> str:
+    with conn_lock:
+        return conn.execute("SELECT email FROM users WHERE id=?", (user_id,)).fetchone()[0]
+
+
+def test_password_reset_ends_older_sessions(make_user):
+    user_id = make_user()
+    email = email_of(user_id)
+    token = create_session(user_id)['token']
+
+    reset_password(create_reset_token(email), 'a new password 2B!')
+
+    with pytest.raises(ValueError, match='Invalid session'):
+        validate_session(token)
+    forget_cached_sessions()  # as another worker would see it
+    with pytest.raises(ValueError, match='Invalid session'):
+        validate_session(token)
+    assert sign_in(email, 'a new password 2B!') == user_id
+    assert validate_session(create_session(user_id)['token'])['user_id'] == user_id
+
+
+def test_rehash_at_sign_in_keeps_other_sessions(make_user, monkeypatch):
+    user_id = make_user()
+    email = email_of(user_id)
+    other_device = create_session(user_id)['token']
+    # hashes made with older parameters are replaced at the next sign-in
+    monkeypatch.setattr(auth, 'SCRYPT_N', auth.SCRYPT_N * 2)
+
+    assert sign_in(email, 'correct horse 1A!') == user_id
+
+    with conn_lock:
+        assert conn.execute("SELECT password_hash FROM users WHERE id=?", (user_id,)).fetchone()[0].startswith(f'scrypt${auth.SCRYPT_N}$')
+    assert validate_session(other_device)['user_id'] == user_id
+    forget_cached_sessions()
+    assert validate_session(other_device)['user_id'] == user_id
+
+
+def test_reset_tokens_are_not_handed_out_over_http(make_user):
+    user_id = make_user()
+    email = email_of(user_id)
+
+    async def reset():
+        async with TestClient(TestServer(create_app())) as client:
+            asked = await client.post('/auth/reset_token', json={'email': email})
+            # issued out of band (scripts/reset_token.py), then redeemed over HTTP
+            token = create_reset_token(email)
+            redeemed = await client.post('/auth/reset_password', json={'token': token, 'new_password': 'a new password 2B!'})
+            return asked.status, 'token' in await asked.text(), redeemed.status
+
+    assert asyncio.run(reset()) == (404, False, 200)
+    assert sign_in(email, 'a new password 2B!') == user_id
+
+
+def test_user_routes_need_the_callers_session(make_user):
+    me, other = make_user(), make_user()
+    headers = {'Authorization': f"Bearer {create_session(me)['token']}"}
+
+    async def statuses():
+        async with TestClient(TestServer(create_app())) as client:
+            return [
+                (await client.get('/health')).status,
+                (await client.get(f'/users/{me}/rooms')).status,
+                (await client.get(f'/users/{me}/rooms', headers={'Authorization': 'Bearer forged.token'})).status,
+                (await client.get(f'/users/{me}/rooms', headers=headers)).status,
+                (await client.get(f'/users/{other}/rooms', headers=headers)).status,
+                (await client.get(f'/threads/x/history?user_id={other}', headers=headers)).status,
+                (await client.get('/admin/usage', headers=headers)).status,
+            ]
+
+    assert asyncio.run(statuses()) == [200, 401, 401, 200, 403, 403, 403]
+
+
+def test_threads_of_other_users_are_off_limits(make_user, seed_thread):
+    me, other = make_user(), make_user()
+    thread_id, _ = seed_thread(other)
+    mine = {'Authorization': f"Bearer {create_session(me)['token']}"}
+    theirs = {'Authorization': f"Bearer {create_session(other)['token']}"}
+
+    async def statuses():
+        async with TestClient(TestServer(create_app())) as client:
+            return [
+                # the caller's own, valid user_id: only the thread is not theirs
+                (await client.get(f'/threads/{thread_id}/history?user_id={me}', headers=mine)).status,
+                (await client.get(f'/threads/{thread_id}/title', headers=mine)).status,
+                (await client.post(f'/threads/{thread_id}/runs', json={'message': 'hi', 'on_busy': 'cancel'}, headers=mine)).status,
+                (await client.get(f'/threads/{thread_id}/history?user_id={other}', headers=theirs)).status,
+            ]
+
+    assert asyncio.run(statuses()) == [403, 403, 403, 200]
+    with pytest.raises(PermissionError):
+        get_chat_history(thread_id, me)
+    assert touch_thread(thread_id, me) is None
+    assert len(get_chat_history(thread_id, other)) == 2
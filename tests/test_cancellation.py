@@ -0,0 +1,111 @@
+import threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+import pytest
+from langchain_core.runnables import RunnableLambda
+from backend import tools
+from backend.cancellation import CancellationToken, Cancelled, cancellable_stats, run_cancellable
+from backend.langgraph_tool_backend import get_chat_history
+from backend.runs import cancel_run, get_run_status, start_run
+
+
+@pytest.fixture
+def slow_server():
+    """Serves 100 KB at 10 KB/s, so a download takes ten seconds."""
+    class Slow(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(100 * 1000))
+            self.end_headers()
+            try:
+                for _ in range(100):
+                    self.wfile.write(b'x' * 1000)
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            except OSError:
+                pass  # the client hung up
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Slow)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/'
+    server.shutdown()
+
+
+def test_run_cancellable_returns_as_soon_as_the_token_fires():
+    token = CancellationToken()
+    release = threading.Event()
+    threading.Timer(0.2, token.cancel).start()
+    started = time.monotonic()
+
+    with pytest.raises(Cancelled):
+        run_cancellable(lambda: release.wait(10), token)
+    assert time.monotonic() - started < 2
+    release.set()
+
+
+def test_cancelled_calls_share_a_bounded_pool_and_show_in_stats():
+    release = threading.Event()
+    before = cancellable_stats.stats()
+
+    for _ in range(before['workers'] * 2):
+        token = CancellationToken()
+        threading.Timer(0.01, token.cancel).start()
+        with pytest.raises(Cancelled):
+            run_cancellable(lambda: release.wait(10), token)
+
+    stats = cancellable_stats.stats()
+    # twice as many calls as workers, yet no more threads than the pool has
+    assert sum(t.name.startswith('cancellable') for t in threading.enumerate()) <= before['workers']
+    assert stats['abandoned'] - before['abandoned'] == stats['running'] - before['running'] > 0
+    assert stats['abandoned_total'] - before['abandoned_total'] == stats['abandoned'] - before['abandoned']
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while cancellable_stats.stats()['abandoned'] > before['abandoned'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cancellable_stats.stats()['abandoned'] == before['abandoned']
+    assert run_cancellable(lambda: 'still serving', CancellationToken()) == 'still serving'
+
+
+def test_http_get_stops_downloading_on_cancel(slow_server):
+    token = CancellationToken()
+    threading.Timer(0.3, token.cancel).start()
+    started = time.monotonic()
+
+    with pytest.raises(Cancelled):
+        RunnableLambda(lambda _: tools.http_get(slow_server)).invoke(None, {'configurable': {'cancel_token': token}})
+    # cut at the next chunk, long before the body is complete
+    assert time.monotonic() - started < 5
+
+
+def test_cancel_during_a_tool_call(make_user, monkeypatch):
+    user_id, thread_id = make_user(), uuid4().hex
+    entered, release = threading.Event(), threading.Event()
+
+    def stuck_calculator(first_num, second_num, operation):
+        entered.set()
+        release.wait(30)
+        return {'result': 'too late'}
+
+    # the fake model answers arithmetic with a calculator call
+    monkeypatch.setattr(tools.calculator, 'func', stuck_calculator)
+    run = start_run('what is 2 + 3', thread_id, user_id)
+    try:
+        assert entered.wait(30), 'the tool was never called'
+        cancelled_at = time.monotonic()
+        cancel_run(run.run_id, user_id)
+
+        assert run.finished.wait(5)
+        assert time.monotonic() - cancelled_at < 2
+        assert get_run_status(run.run_id, user_id)['status'] == 'cancelled'
+    finally:
+        release.set()
+
+    # the thread keeps working after the cancelled turn
+    follow_up = start_run('hello again', thread_id, user_id)
+    assert follow_up.finished.wait(30)
+    assert get_run_status(follow_up.run_id, user_id)['status'] == 'done'
+    assert get_chat_history(thread_id, user_id)[-1]['role'] == 'assistant'
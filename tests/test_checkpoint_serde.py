@@ -0,0 +1,88 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from backend.checkpoint_serde import BLOB_KEY, CompactSerializer
+from backend.db import get_checkpoint_blobs, shards
+
+
+def checkpoint_with(messages: list) -> dict:
+    checkpoint = empty_checkpoint()
+    checkpoint['channel_values'] = {'messages': messages}
+    return checkpoint
+
+
+def tool_turn(content: str, artifact=None) -> list:
+    return [
+        HumanMessage('weather in Paris?'),
+        AIMessage('', tool_calls=[{'name': 'get_weather', 'args': {'latitude': 48.9, 'longitude': 2.3}, 'id': 'call_1'}]),
+        ToolMessage(content, tool_call_id='call_1', artifact=artifact),
+        AIMessage('Sunny.'),
+    ]
+
+
+def test_round_trip_stores_large_tool_output_once():
+    serde = CompactSerializer(shards[0])
+    output = '{"temperature": 21.5} ' * 500
+    type_, data = serde.dumps_typed(checkpoint_with(tool_turn(output, artifact='raw ' * 2000)))
+
+    assert type_.startswith('msgpack+')
+    assert output.encode() not in data
+    refs = serde.blob_refs((type_, data))
+    assert len(refs) == 2
+    assert get_checkpoint_blobs(shards[0], list(refs)).keys() == refs
+
+    # a fresh serializer has no cache: the contents come back from checkpoint_blobs
+    loaded = CompactSerializer(shards[0]).loads_typed((type_, data))
+    messages = loaded['channel_values']['messages']
+    assert messages == tool_turn(output, artifact='raw ' * 2000)
+    assert BLOB_KEY not in messages[2].additional_kwargs
+
+
+def test_round_trip_without_blobs_or_compression():
+    serde = CompactSerializer(shards[0], compression='none', blob_min_bytes=0)
+    messages = tool_turn('x' * 10_000)
+    type_, data = serde.dumps_typed(checkpoint_with(messages))
+
+    assert type_ == 'msgpack'
+    assert serde.blob_refs((type_, data)) == set()
+    assert serde.loads_typed((type_, data))['channel_values']['messages'] == messages
+
+
+def test_small_checkpoints_stay_uncompressed():
+    serde = CompactSerializer(shards[0])
+    type_, data = serde.dumps_typed(checkpoint_with([HumanMessage('hi'), AIMessage('hello')]))
+
+    assert type_ == 'msgpack'
+    assert serde.loads_typed((type_, data))['channel_values']['messages'] == [HumanMessage('hi'), AIMessage('hello')]
+
+
+def test_loads_checkpoints_written_by_the_default_serializer():
+    messages = tool_turn('y' * 10_000)
+    legacy = JsonPlusSerializer().dumps_typed(checkpoint_with(messages))
+
+    assert CompactSerializer(shards[0]).loads_typed(legacy)['channel_values']['messages'] == messages
+
+
+def test_archived_blobs_are_used_before_the_shard():
+    writer = CompactSerializer(shards[0])
+    output = 'only in the archive ' * 400
+    payload = writer.dumps_typed(checkpoint_with(tool_turn(output)))
+    (digest,) = writer.blob_refs(payload)
+    archived = get_checkpoint_blobs(shards[0], [digest])
+    with shards[0].blobs_lock:
+        shards[0].blobs_conn.execute("DELETE FROM checkpoint_blobs WHERE hash=?", (digest,))
+
+    reader = CompactSerializer(shards[0])
+    assert reader.loads_typed(payload, archived)['channel_values']['messages'][2].content == output
+
+
+def test_missing_blob_fails_loudly():
+    writer = CompactSerializer(shards[0])
+    payload = writer.dumps_typed(checkpoint_with(tool_turn('gone ' * 2000)))
+    (digest,) = writer.blob_refs(payload)
+    with shards[0].blobs_lock:
+        shards[0].blobs_conn.execute("DELETE FROM checkpoint_blobs WHERE hash=?", (digest,))
+
+    with pytest.raises(ValueError, match=digest):
+        CompactSerializer(shards[0]).loads_typed(payload)
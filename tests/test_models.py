@@ -0,0 +1,51 @@
+import time
+from langchain_core.messages import HumanMessage
+from backend.admission import AdmissionController
+from backend.fake_llm import FakeChatModel
+from backend.models import HedgedChatModel
+
+
+def hedged(admission: AdmissionController) -> HedgedChatModel:
+    """A primary slower than its usual 10 ms to first token, and a quick hedge model."""
+    model = HedgedChatModel(
+        primary=FakeChatModel(first_token_latency=0.5, answer_words=3),
+        fallback=FakeChatModel(first_token_latency=0.01, answer_words=3),
+        min_samples=1,
+        admission=admission,
+    )
+    model._record(0.01, hedge_won=False)
+    return model
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_hedge_takes_a_slot_of_its_own():
+    admission = AdmissionController(max_concurrency=2, max_queue=4, queue_timeout=1)
+    model = hedged(admission)
+
+    with admission.slot():
+        model.invoke([HumanMessage('hello')])
+        assert (model.hedged, model.hedge_wins, model.hedges_skipped) == (1, 1, 0)
+        # the slow primary is still out there, on the hedge's slot
+        assert admission.stats()['active'] == 2
+        assert wait_for(lambda: admission.stats()['active'] == 1)
+    assert admission.stats()['active'] == 0
+
+
+def test_no_hedge_without_a_free_slot():
+    admission = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=1)
+    model = hedged(admission)
+
+    with admission.slot():
+        started = time.monotonic()
+        model.invoke([HumanMessage('hello')])
+        # waited for the primary instead
+        assert time.monotonic() - started >= 0.5
+        assert (model.hedged, model.hedge_wins, model.hedges_skipped) == (0, 0, 1)
+        assert admission.stats()['active'] == 1
+    assert admission.stats()['active'] == 0
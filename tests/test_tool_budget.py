@@ -0,0 +1,46 @@
+import json
+from datetime import datetime, timedelta
+from backend.tool_budget import shape_content
+
+VARIABLES = ('temperature_2m', 'relative_humidity_2m', 'dew_point_2m', 'rain', 'snow_depth')
+
+
+def forecast(days: int = 7) -> dict:
+    """An open-meteo response with `days` of hourly values, as get_weather returns it."""
+    start = datetime(2026, 10, 19)
+    hours = [start + timedelta(hours=i) for i in range(days * 24)]
+    return {
+        'latitude': 48.86, 'longitude': 2.3522, 'generationtime_ms': 0.0421, 'utc_offset_seconds': 7200,
+        'timezone': 'Europe/Paris', 'timezone_abbreviation': 'GMT+2', 'elevation': 43.0,
+        'hourly_units': {'time': 'iso8601', 'temperature_2m': '°C', 'relative_humidity_2m': '%', 'dew_point_2m': '°C', 'rain': 'mm', 'snow_depth': 'm'},
+        'hourly': {
+            'time': [hour.strftime('%Y-%m-%dT%H:%M') for hour in hours],
+            **{name: [round(10 + i * 0.137 % 7, 2) for i in range(len(hours))] for name in VARIABLES},
+        },
+    }
+
+
+def test_weather_keeps_the_whole_forecast():
+    payload = forecast()
+    shaped = json.loads(shape_content('get_weather', json.dumps(payload)))
+
+    times = shaped['hourly']['time']
+    assert times[0] == payload['hourly']['time'][0]
+    assert times[-1].startswith('2026-10-25')  # the last forecast day
+    assert all(len(shaped['hourly'][name]) == len(times) for name in VARIABLES)
+    assert 'generationtime_ms' not in shaped
+
+
+def test_weather_over_budget_is_thinned_not_cut():
+    shaped = json.loads(shape_content('get_weather', json.dumps(forecast()), max_tokens=300))
+
+    assert shaped['truncated']
+    assert shaped['hourly']['time'][-1].startswith('2026-10-25')
+    assert len(json.dumps(shaped, separators=(',', ':'), ensure_ascii=False)) <= 300 * 4
+
+
+def test_lists_without_a_step_are_still_capped():
+    results = [{'name': f'Paris {i}', 'latitude': 48.8566, 'longitude': 2.3522, 'country': 'France'} for i in range(10)]
+    shaped = json.loads(shape_content('get_geocoding', json.dumps({'results': results})))
+
+    assert [r['name'] for r in shaped['results']] == [f'Paris {i}' for i in range(5)]
@@ -0,0 +1,82 @@
+import json
+from uuid import uuid4
+from backend import archive
+from backend.auth import sign_in
+from backend.db import get_user_rooms, search_user_messages, shard_for_user
+from backend.langgraph_tool_backend import get_chat_history
+from backend.transfer import export_threads, import_threads, open_dump
+
+
+def export_user(user_id: int, path: str) -> list[dict]:
+    with open_dump(path, 'w') as out:
+        export_threads(out, user_id)
+    with open_dump(path) as dump:
+        return [json.loads(line) for line in dump]
+
+
+def as_lines(records: list[dict]) -> list[str]:
+    return [json.dumps(record) for record in records]
+
+
+def copy_threads(records: list[dict], prefix: str) -> list[dict]:
+    """The dump with every thread renamed, so importing it next to the originals adds new threads."""
+    return [
+        {**record, 'thread_id': prefix + record['thread_id']} if record['type'] in ('room', 'message') else record
+        for record in records
+    ]
+
+
+def test_export_then_import(make_user, seed_thread, tmp_path):
+    user_id = make_user()
+    hot, messages = seed_thread(user_id)
+    cold, _ = seed_thread(user_id)
+    shard = shard_for_user(user_id)
+    with shard.archive_lock:
+        shard.archive_conn.execute("UPDATE chat_rooms SET last_active_at=0 WHERE thread_id=?", (cold,))
+    assert archive.archive_thread(cold, user_id, 0)
+
+    records = export_user(user_id, str(tmp_path / 'dump.jsonl.gz'))
+
+    assert [r['type'] for r in records].count('room') == 2
+    exported = [r['message'] for r in records if r['type'] == 'message' and r['thread_id'] == hot]
+    assert [m['data']['content'] for m in exported] == [m.content for m in messages]
+    # read from the archive without bringing the thread back
+    assert len([r for r in records if r['type'] == 'message' and r['thread_id'] == cold]) == 4
+    assert archive.read_archived_thread(cold, user_id) is not None
+
+    prefix = f'copy-{uuid4().hex[:6]}-'
+    counts = import_threads(as_lines(copy_threads(records, prefix)), batch=1)
+
+    assert counts['rooms'] == 2 and counts['messages'] == 8 and counts['skipped'] == 0
+    for thread_id in (hot, cold):
+        assert get_chat_history(prefix + thread_id, user_id) == get_chat_history(thread_id, user_id)
+    rooms = {room['thread_id'] for room in get_user_rooms(user_id)}
+    assert {prefix + hot, prefix + cold} <= rooms
+    hits = {hit['thread_id'] for hit in search_user_messages(user_id, 'lorem ipsum', 50)}
+    assert {prefix + hot, prefix + cold} <= hits
+
+    # re-running an import finishes it: nothing is written twice
+    again = import_threads(as_lines(copy_threads(records, prefix)))
+    assert again['rooms'] == 0 and again['skipped'] == 2
+
+
+def test_import_creates_missing_accounts(make_user, seed_thread, tmp_path):
+    password = 'moved over 9Z!'
+    user_id = make_user(password)
+    thread_id, _ = seed_thread(user_id)
+    records = export_user(user_id, str(tmp_path / 'dump.jsonl'))
+
+    # pretend the dump comes from another installation
+    email = f'{uuid4().hex}@example.org'
+    moved = []
+    for record in copy_threads(records, 'moved-'):
+        if record['type'] == 'user':
+            record = {**record, 'email': email}
+        moved.append(record)
+    counts = import_threads(as_lines(moved))
+
+    assert counts['users'] == 1 and counts['rooms'] == 1
+    new_id = sign_in(email, password)
+    assert new_id != user_id
+    assert [room['thread_id'] for room in get_user_rooms(new_id)] == ['moved-' + thread_id]
+    assert get_chat_history('moved-' + thread_id, new_id) == get_chat_history(thread_id, user_id)